@@ -9,14 +9,14 @@ from langchain.tools import Tool
 from langchain_core.prompts import PromptTemplate
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.documents import Document
-from langchain_community.vectorstores import FAISS
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
 import json
 import re
 from dataclasses import dataclass
 
-from config import GOOGLE_API_KEY
+from config import GOOGLE_API_KEY, EMBEDDING_MODEL, EMBEDDING_BACKEND
 from data_loader import get_equipment_data
+from embedding_service import get_embedding_service
+from equipment_index import get_equipment_index
 
 @dataclass
 class EquipmentRecommendation:
@@ -37,8 +37,10 @@ class GuitarEquipmentAgent:
             temperature=0.3,
             max_tokens=1000
         )
-        self.embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
+        self.embeddings = get_embedding_service(EMBEDDING_MODEL, backend=EMBEDDING_BACKEND)
         self.guitarist_options = ["B'z 松本孝弘", "布袋寅泰", "結束バンド 後藤ひとり"]
+        # 全機材を1つにまとめたインデックス (RAGSystem と共有)。セマンティック検索はギタリストで絞り込んだハイブリッド検索
+        self.equipment_index = get_equipment_index(self.embeddings, self.embeddings.model_name)
         
         # 各ギタリストの機材データベースを初期化
         self.equipment_databases = self._initialize_equipment_databases()
@@ -56,9 +58,6 @@ class GuitarEquipmentAgent:
         for guitarist in self.guitarist_options:
             documents = get_equipment_data(guitarist)
             if documents:
-                # FAISSベクトルストアを作成
-                vectorstore = FAISS.from_documents(documents, self.embeddings)
-                
                 # 機材データをカテゴリ別に整理
                 equipment_by_category = {"ギター": [], "アンプ": [], "エフェクター": []}
                 all_equipment = []
@@ -78,7 +77,6 @@ class GuitarEquipmentAgent:
                         equipment_by_category[category].append(equipment_info)
                 
                 databases[guitarist] = {
-                    "vectorstore": vectorstore,
                     "equipment_by_category": equipment_by_category,
                     "all_equipment": all_equipment
                 }
@@ -284,8 +282,7 @@ class GuitarEquipmentAgent:
             if guitarist not in self.equipment_databases:
                 return f"ギタリスト '{guitarist}' のデータが見つかりません。"
             
-            vectorstore = self.equipment_databases[guitarist]["vectorstore"]
-            docs = vectorstore.similarity_search(query, k=3)
+            docs = self.equipment_index.hybrid_search(query, k=3, guitarist=guitarist)
             
             result = f"{guitarist}の'{query}'に関連する機材:\n"
             for i, doc in enumerate(docs, 1):
@@ -0,0 +1,212 @@
+# alignment.py
+"""
+ピッチ輪郭のDTWアライメント。
+
+dtw-python の step_pattern='asymmetric' と同じ漸化式
+    g[i, j] = |x[i] - y[j]| + min(g[i-1, j], g[i-1, j-1], g[i-1, j-2])
+を、行ごとに許可された列の範囲 (窓) だけで計算する。
+累積コストは直前の1行分、バックトラック用の情報は窓内のみ int8 で保持するため、
+メモリは O(N × 窓幅) (窓幅が一定なら系列長に対して線形) に収まる。
+
+- 窓なし: 全列を対象にする (全コスト行列を使う場合と同じ結果)。バックトラック用に N × M バイトを使うため、
+  N × M が FULL_DTW_MAX_CELLS を超える場合は multiscale で解く (結果は近似になる)
+- band_radius: Sakoe-Chiba バンド + 傾き制約 (1行あたり列は 0〜2 進む)
+- multiscale: 系列を半分に縮約して再帰的に解き、粗いパスの周囲 radius だけを精密に解く
+
+dtw_align_batch は同じ長さの複数の query を (K × 窓幅) の配列でまとめて解く。
+"""
+
+import os
+from dataclasses import dataclass
+
+import numpy as np
+
+DEFAULT_RADIUS = 32
+# 窓なしで解く系列長の積の上限 (query の数 × N × M、int8 のバックトラック情報のバイト数)。既定は 64MB
+FULL_DTW_MAX_CELLS = int(os.getenv("FULL_DTW_MAX_CELLS", 64 * 1024 * 1024))
+# これより短い系列は縮約せずにそのまま解く
+MULTISCALE_MIN_SIZE = 64
+
+
+@dataclass
+class AlignmentResult:
+    """アライメント結果。属性名は dtw-python の DTW オブジェクトに合わせている。"""
+    index1: np.ndarray
+    index2: np.ndarray
+    distance: float
+    normalizedDistance: float
+
+
+def _windowed_dtw_batch(xs, y, lo, hi, open_begin, open_end):
+    """
+    行 i で列 [lo[i], hi[i]) のみを許可してDTWを解く。
+    同じ長さの複数の query (xs: K × n) を共通の窓で同時に解くので、Pythonのループは1本分で済む。
+    結果は query ごとの AlignmentResult (到達不能なら None) のリスト。
+    """
+    k, n = xs.shape
+    widths = hi - lo
+    offsets = np.concatenate([[0], np.cumsum(widths)])
+    steps = np.zeros((k, offsets[-1]), dtype=np.int8)
+
+    prev = None
+    for i in range(n):
+        l, h = lo[i], hi[i]
+        cost = np.abs(xs[:, i, None] - y[None, l:h])
+        if i == 0:
+            if open_begin:
+                g = cost
+            else:
+                g = np.full((k, h - l), np.inf)
+                if l == 0:
+                    g[:, 0] = cost[:, 0]
+        else:
+            # 直前の行の値を列 l-2 .. h-1 に並べ直す (窓の外は inf)
+            ext = np.full((k, h - l + 2), np.inf)
+            pl, ph = lo[i - 1], hi[i - 1]
+            a, b = max(l - 2, pl), min(h, ph)
+            if a < b:
+                ext[:, a - (l - 2):b - (l - 2)] = prev[:, a - pl:b - pl]
+            stay, diag, skip = ext[:, 2:], ext[:, 1:-1], ext[:, :-2]
+            best = np.minimum(np.minimum(stay, diag), skip)
+            step = np.where(stay == best, 0, np.where(diag == best, 1, 2))
+            steps[:, offsets[i]:offsets[i + 1]] = step
+            g = cost + best
+        prev = g
+
+    results = []
+    for q in range(k):
+        if open_end:
+            j_end = int(lo[-1]) + int(np.argmin(prev[q]))
+        elif hi[-1] != len(y):
+            results.append(None)
+            continue
+        else:
+            j_end = len(y) - 1
+        distance = float(prev[q, j_end - lo[-1]])
+        if not np.isfinite(distance):
+            results.append(None)
+            continue
+
+        path = np.empty(n, dtype=np.intp)
+        j = j_end
+        for i in range(n - 1, -1, -1):
+            path[i] = j
+            j -= int(steps[q, offsets[i] + j - lo[i]])
+        results.append(AlignmentResult(
+            index1=np.arange(n), index2=path,
+            distance=distance, normalizedDistance=distance / n
+        ))
+    return results
+
+
+def _full_window(n, m):
+    return np.zeros(n, dtype=np.intp), np.full(n, m, dtype=np.intp)
+
+
+def _band_window(n, m, radius, open_begin, open_end):
+    """対角線を中心とした Sakoe-Chiba バンドに、漸化式の傾き制約を重ねた窓"""
+    rows = np.arange(n)
+    center = rows * (m - 1) / max(n - 1, 1)
+    lo = np.floor(center - radius).astype(np.intp)
+    hi = np.ceil(center + radius).astype(np.intp) + 1
+    if not open_begin:
+        # (0, 0) から始まる場合、行 i で到達できる列は 2i まで
+        hi = np.minimum(hi, 2 * rows + 1)
+    if not open_end:
+        # (n-1, m-1) で終わる場合、残りの行で m-1 まで到達できる列のみ
+        lo = np.maximum(lo, m - 1 - 2 * (n - 1 - rows))
+    lo = np.clip(lo, 0, m)
+    hi = np.clip(hi, 0, m)
+    return lo, np.maximum(hi, lo + 1)
+
+
+def _coarsen(x):
+    """隣接する2フレームを平均して長さを半分にする"""
+    half = len(x) // 2
+    coarse = x[:2 * half].reshape(half, 2).mean(axis=1)
+    if len(x) % 2:
+        coarse = np.append(coarse, x[-1])
+    return coarse
+
+
+def _expand_path(coarse, n, m, radius):
+    """
+    粗いパス (のリスト) を元の解像度に投影し、周囲 radius 列を許可する窓を作る。
+    複数のパスがある場合は、それらを全て含む窓 (和集合) にする。
+    """
+    coarse_js = [c.index2 for c in coarse]
+    nc = len(coarse_js[0])
+    rows = np.arange(n) // 2
+    neighbours = np.stack([np.clip(rows + k, 0, nc - 1) for k in (-1, 0, 1)])
+    lo = 2 * np.min([coarse_j[neighbours].min(axis=0) for coarse_j in coarse_js], axis=0) - radius
+    hi = 2 * np.max([coarse_j[neighbours].max(axis=0) for coarse_j in coarse_js], axis=0) + 2 + radius
+    lo = np.clip(lo, 0, m)
+    hi = np.clip(hi, 0, m)
+    return lo, np.maximum(hi, lo + 1)
+
+
+def _multiscale_dtw_batch(xs, y, radius, open_begin, open_end):
+    n, m = xs.shape[1], len(y)
+    if n <= MULTISCALE_MIN_SIZE or m <= MULTISCALE_MIN_SIZE:
+        return _windowed_dtw_batch(xs, y, *_full_window(n, m), open_begin, open_end)
+    coarse = _multiscale_dtw_batch(np.stack([_coarsen(x) for x in xs]), _coarsen(y), radius, open_begin, open_end)
+    coarse = [c for c in coarse if c is not None]
+    if not coarse:
+        return [None] * len(xs)
+    lo, hi = _expand_path(coarse, n, m, radius)
+    return _windowed_dtw_batch(xs, y, lo, hi, open_begin, open_end)
+
+
+def dtw_align(query, reference, open_begin=False, open_end=False, band_radius=None, multiscale=False, radius=DEFAULT_RADIUS):
+    """
+    query の全フレームを reference にアライメントする。
+
+    :param query: 基準となる系列 (index1 は常に 0..len(query)-1)
+    :param reference: 対応付けられる系列。open_begin/open_end で部分系列との照合になる
+    :param band_radius: Sakoe-Chiba バンドの半径 (フレーム数)。None なら制限なし
+        (ただし N × M が FULL_DTW_MAX_CELLS を超える場合は multiscale で解く)
+    :param multiscale: 粗い解像度から順に解く (open_begin/open_end と併用可)
+    :param radius: multiscale で粗いパスの周囲に許可する列数
+    :return: AlignmentResult (index1, index2, distance, normalizedDistance)
+    """
+    return dtw_align_batch(
+        [query], reference, open_begin=open_begin, open_end=open_end,
+        band_radius=band_radius, multiscale=multiscale, radius=radius
+    )[0]
+
+
+def dtw_align_batch(queries, reference, open_begin=False, open_end=False, band_radius=None, multiscale=False, radius=DEFAULT_RADIUS):
+    """
+    同じ長さの複数の query (例: 音程をずらした同じ演奏) を一度にアライメントする。
+    引数は dtw_align と同じで、query ごとの AlignmentResult のリストを返す。
+    multiscale では全ての query の粗いパスを含む窓を共有する。
+    """
+    xs = np.asarray(queries, dtype=np.float64)
+    y = np.asarray(reference, dtype=np.float64)
+    if xs.ndim != 2:
+        raise ValueError("queries は同じ長さの系列のリストである必要があります。")
+    n, m = xs.shape[1], len(y)
+    if n == 0 or m == 0:
+        raise ValueError("空の系列はアライメントできません。")
+
+    full_cells = len(xs) * n * m
+    if not multiscale and band_radius is None and full_cells > FULL_DTW_MAX_CELLS:
+        # 全列を対象にするとバックトラック情報だけで N × M バイトになるため、粗いパスの周囲だけを解く
+        multiscale = True
+
+    if multiscale:
+        results = _multiscale_dtw_batch(xs, y, radius, open_begin, open_end)
+    elif band_radius is not None:
+        results = _windowed_dtw_batch(xs, y, *_band_window(n, m, band_radius, open_begin, open_end), open_begin, open_end)
+    else:
+        results = _windowed_dtw_batch(xs, y, *_full_window(n, m), open_begin, open_end)
+
+    missing = [q for q, result in enumerate(results) if result is None]
+    if missing and (multiscale or band_radius is not None) and len(missing) * n * m <= FULL_DTW_MAX_CELLS:
+        # 窓が狭すぎて終点に到達できなかった場合は制限なしで解き直す
+        retried = _windowed_dtw_batch(xs[missing], y, *_full_window(n, m), open_begin, open_end)
+        for q, result in zip(missing, retried):
+            results[q] = result
+    if any(result is None for result in results):
+        raise ValueError("アライメントのパスが見つかりませんでした (系列長の比が大きすぎます)。")
+    return results
@@ -0,0 +1,72 @@
+# analysis_pool.py
+"""
+CPUを使う解析処理(ピッチ・オンセット・音量など)を並列に実行するためのプロセスプール。
+
+プールはサーバープロセスが生きている間は再利用される(Streamlitの再実行でも作り直さない)。
+プロセスを起動できない環境では、同じタスクを順番に実行する。
+"""
+
+import atexit
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# 解析用ワーカー数 (環境変数 ANALYSIS_WORKERS で上書き可能)
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "0")) or max(1, min(os.cpu_count() or 1, 8))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_process_pool():
+    """共有プロセスプールを返す。初回呼び出し時に作成する。"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=ANALYSIS_WORKERS)
+        return _pool
+
+
+def shutdown_process_pool():
+    """共有プロセスプールを停止する。"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+atexit.register(shutdown_process_pool)
+
+
+def run_parallel(tasks):
+    """
+    タスクを共有プロセスプールで並列に実行し、全ての結果を投入順に返す。
+
+    :param tasks: (関数, 引数タプル) または (関数, 引数タプル, キーワード引数辞書) のリスト。
+                  関数はモジュールのトップレベルに定義されている(pickle可能である)こと
+    :return: 各タスクの戻り値のリスト
+    """
+    tasks = [task if len(task) == 3 else (task[0], task[1], {}) for task in tasks]
+    if len(tasks) <= 1 or ANALYSIS_WORKERS <= 1:
+        return [func(*args, **kwargs) for func, args, kwargs in tasks]
+
+    try:
+        pool = get_process_pool()
+        futures = [pool.submit(func, *args, **kwargs) for func, args, kwargs in tasks]
+    except (OSError, RuntimeError) as e:
+        # プロセスを起動できない環境 (/dev/shm が無いなど) や、停止済み・異常終了済みのプール
+        return _run_serial(tasks, e)
+    try:
+        return [future.result() for future in futures]
+    except BrokenProcessPool as e:
+        # ワーカーが異常終了した場合のみ。タスク自体が送出した例外はそのまま呼び出し元に伝える
+        return _run_serial(tasks, e)
+
+
+def _run_serial(tasks, error):
+    """プールを作り直せるようにしてから、今回のタスクを順番に実行する。"""
+    print(f"Error running analysis pool, falling back to serial execution: {error}")
+    shutdown_process_pool()
+    return [func(*args, **kwargs) for func, args, kwargs in tasks]
@@ -11,7 +11,11 @@ from config import GOOGLE_API_KEY
 from data_loader import get_practice_phrase # get_equipment_dataはRAGSystem内で呼ばれる
 from rag_system import RAGSystem, get_practice_advice # RAGSystemをインポート
 from langchain_core.documents import Document
-from pitch_analyzer import analyze_pitch_and_create_graph, compare_pitches_and_create_graph
+from pitch_analyzer import compare_pitches
+from pitch_render import compact_result, render_comparison_png
+from asset_registry import get_asset_registry
+from audio_ingest import AudioIngestError, ingest_audio
+from stem_store import load_peaks, stem_media
 
 # --- グローバルなリソースのキャッシュ ---
 @st.cache_resource  # ★キャッシュを有効化してパフォーマンス改善
@@ -24,8 +28,11 @@ def load_rag_system():
 
 def main():
     # --- セッションステートの初期化 ---
-    if 'pitch_graph' not in st.session_state:
-        st.session_state.pitch_graph = None
+    # 分析結果は間引いた数値データとPNGのバイト列だけを保持する (Figureは保持しない)
+    if 'pitch_result' not in st.session_state:
+        st.session_state.pitch_result = None
+    if 'pitch_chart' not in st.session_state:
+        st.session_state.pitch_chart = None
     if 'pitch_score' not in st.session_state:
         st.session_state.pitch_score = None
     if 'practice_advice' not in st.session_state:
@@ -191,25 +198,9 @@ def run_practice_mode():
         st.info("下の動画や分離された音源を再生して練習しましょう！\n\n**⚠️ 音が重ならないように、不要な音源はミュートしてください。**")
         
         # --- パート別音源のパス設定 ---
-        # 選択されたギタリストに応じて適切な音源を選択
-        download_dir = "downloaded_audio"
-        reference_audio_path = None
-        
-        # ギタリスト別の音源検索パターン
-        guitarist_search_patterns = {
-            "B'z 松本孝弘": "*ultra*",
-            "布袋寅泰": "*スリル*",
-            "結束バンド 後藤ひとり": "*忘れてやらない*"
-        }
-        
-        # 選択されたギタリストの音源を動的に探す
-        search_pattern = guitarist_search_patterns.get(selected_guitarist)
-        if search_pattern:
-            import glob
-            pattern = os.path.join('separated_audio', 'htdemucs', search_pattern, 'other.wav')
-            matching_files = glob.glob(pattern)
-            if matching_files:
-                reference_audio_path = matching_files[0]
+        # お手本はアセット台帳 (asset_registry) からギタリスト名で引く。
+        # asset_pipeline でビルド済みなら前後の無音を除いたお手本 (ピッチ輪郭もキャッシュ済み) を使う
+        reference_audio_path = get_asset_registry().reference_audio(selected_guitarist)
         
         # セッションステートに保存（ギタリスト変更時に更新されるよう）
         st.session_state.reference_audio_path = reference_audio_path
@@ -228,10 +219,18 @@ def run_practice_mode():
 
             # 次に音源プレーヤー
             st.subheader("🎧 お手本ギター音源")
-            if st.session_state.reference_audio_path:
-                st.audio(st.session_state.reference_audio_path)
+            reference_preview = get_asset_registry().reference_preview(selected_guitarist)
+            if reference_preview:
+                # asset_pipeline で作った低ビットレートのプレビューと波形のピークを表示する (元のステムは解析にだけ使う)
+                preview_path, preview_mime, peaks_path = reference_preview
+                st.audio(preview_path, format=preview_mime)
+                peaks_min, peaks_max, _ = load_peaks(peaks_path)
+                st.line_chart({"min": peaks_min, "max": peaks_max}, height=100)
+            elif st.session_state.reference_audio_path:
+                reference_media, reference_mime = stem_media(st.session_state.reference_audio_path)
+                st.audio(reference_media, format=reference_mime)
             else:
-                st.warning("お手本ギター音源が見つかりません。")
+                st.warning("お手本ギター音源が見つかりません。`python asset_pipeline.py` でお手本の音源をビルドしてください。")
             
             # 最後に録音ウィジェット
             st.markdown("#### 🎤 あなたの演奏を録音してください")
@@ -245,9 +244,9 @@ def run_practice_mode():
                 help="音質に問題がある場合は、外部アプリで録音してアップロードをお試しください"
             )
             
-            audio_bytes = None
+            recorded_audio = None
             if recording_method == "🎤 ブラウザで直接録音":
-                audio_bytes = st_audiorec()
+                recorded_audio = st_audiorec()
             else:
                 uploaded_file = st.file_uploader(
                     "録音ファイルをアップロードしてください",
@@ -255,46 +254,78 @@ def run_practice_mode():
                     help="Audacity、GarageBand、スマホの録音アプリなどで録音したファイルをアップロードできます"
                 )
                 if uploaded_file is not None:
-                    audio_bytes = uploaded_file.read()
+                    # read() でメモリに読み込まず、ファイルオブジェクトのまま渡す (サイズ・長さの上限は audio_ingest で確認)
+                    recorded_audio = uploaded_file
             
-            if audio_bytes:
-                st.audio(audio_bytes, format='audio/wav')
+            if recorded_audio:
+                st.audio(recorded_audio, format=getattr(recorded_audio, 'type', None) or 'audio/wav')
                 
                 # 比較ボタンは、お手本音源がある場合のみ表示
                 if st.session_state.reference_audio_path:
                     if st.button("今の演奏を比較・分析する"):
-                        with st.spinner("演奏を比較・分析し、アドバイスを生成中です..."):
-                            # ピッチ比較を実行し、グラフとスコアを生成
-                            fig, score = compare_pitches_and_create_graph(
-                                audio_bytes, 
-                                st.session_state.reference_audio_path
-                            )
+                        try:
+                            # ブロックごとにデコードしながらモノラル・解析用のサンプルレートに変換し、前後の無音を除く
+                            user_audio = ingest_audio(recorded_audio)
+                        except AudioIngestError as e:
+                            st.error(str(e))
+                            user_audio = None
+                        if user_audio is not None:
+                            with st.spinner("演奏を比較・分析し、アドバイスを生成中です..."):
+                                # ピッチ比較を実行し、スコアと比較データを取得
+                                # ユーザー演奏は高速な acf で解析し、お手本はキャッシュ済みの pyin 輪郭を使う
+                                result, score = compare_pitches(
+                                    user_audio,
+                                    st.session_state.reference_audio_path,
+                                    engine="acf"
+                                )
                             
-                            # 結果をセッションステートに保存
-                            st.session_state.pitch_graph = fig
-                            st.session_state.pitch_score = score
+                                # 結果をセッションステートに保存 (グラフは一度だけPNGに描画する)
+                                st.session_state.pitch_result = compact_result(result) if result else None
+                                st.session_state.pitch_chart = render_comparison_png(result) if result else None
+                                st.session_state.pitch_score = score
                             
-                            # アドバイスを非同期で取得
-                            try:
-                                advice = asyncio.run(get_practice_advice(float(score), selected_guitarist))
-                                st.session_state.practice_advice = advice
-                            except Exception as e:
-                                st.session_state.practice_advice = f"アドバイスの生成中にエラーが発生しました: {e}"
+                                # アドバイスを非同期で取得
+                                try:
+                                    advice = asyncio.run(get_practice_advice(float(score), selected_guitarist))
+                                    st.session_state.practice_advice = advice
+                                except Exception as e:
+                                    st.session_state.practice_advice = f"アドバイスの生成中にエラーが発生しました: {e}"
 
                 else:
                     st.warning("比較対象のお手本音源が見つからないため、比較できません。")
         
         # --- 分析結果の表示 ---
-        if st.session_state.pitch_graph and st.session_state.pitch_score:
+        if st.session_state.pitch_chart and st.session_state.pitch_score:
             st.markdown("---")
             st.header("📈 あなたの演奏分析結果")
 
             # スコアを大きく表示
             st.metric(label="類似度スコア", value=f"{st.session_state.pitch_score} / 100")
-
-            st.pyplot(st.session_state.pitch_graph)
+            pitch_result = st.session_state.pitch_result or {}
+            if pitch_result.get("rhythm_score") is not None:
+                col_pitch, col_rhythm, col_timing = st.columns(3)
+                col_pitch.metric(label="音程", value=f"{pitch_result['pitch_score']:.1f}")
+                col_rhythm.metric(label="リズム", value=f"{pitch_result['rhythm_score']:.1f}")
+                if pitch_result.get("timing_offset_ms") is not None:
+                    # 正ならお手本より遅れ、負なら走り気味
+                    col_timing.metric(label="タイミングのずれ", value=f"{pitch_result['timing_offset_ms']:+.0f} ms")
+
+            offset = pitch_result.get("offset_semitones", 0.0)
+            if abs(offset) >= 0.3:
+                direction = "低く" if offset > 0 else "高く"
+                st.info(f"あなたの演奏はお手本より約 {abs(offset):.1f} 半音{direction}弾かれていたため（カポや半音下げチューニングなど）、そのずれを補正して採点しました。")
+
+            st.image(st.session_state.pitch_chart)
             st.info("青線がお手本、赤線があなたの演奏のピッチ（音の高さ）です。線が近いほど、タイミングと音程が合っていることを示します。")
 
+            # 音程のずれが大きかった音
+            segments = pitch_result.get("segments", [])
+            worst = sorted(segments, key=lambda seg: seg["error_cents"], reverse=True)[:3]
+            if worst:
+                st.markdown("##### 🎯 音程のずれが大きかった箇所")
+                for seg in worst:
+                    st.markdown(f"- {seg['start']:.1f}〜{seg['end']:.1f}秒 ({seg['note']}): 平均 {seg['error_cents']:.0f} セント")
+
             # AI講師からのアドバイス表示
             if st.session_state.practice_advice:
                 st.markdown("---")
@@ -0,0 +1,348 @@
+# asset_pipeline.py
+"""
+練習フレーズの音源アセットを make のように差分ビルドするパイプライン。
+
+フレーズごとに次のノードを順に実行する (→ は依存関係):
+
+    download (音源のダウンロード) → separate (音源分離) → trim (前後の無音の除去) → contour (お手本のピッチ輪郭)
+                                                                         → preview (再生用プレビューと波形のピーク)
+
+各ノードの「指紋」は、ノードのパラメータと依存ノードの出力ファイルの内容ハッシュから決まる。
+前回のビルドと指紋が同じで、出力ファイルも残っていて内容が変わっていなければ、そのノードは再実行しない。
+ビルドの状態は STATE_PATH に保存し、結果はアセット台帳 (asset_registry) に記録する。
+台帳の記録は scan などで消されることがあるため、再実行しないノードも台帳への記録 (Node.record) は毎回やり直す。
+フレーズ同士は独立しているので並列に処理し、曲を1つ追加しても他の曲のノードは再実行されない。
+
+    python asset_pipeline.py                   # 全ての練習フレーズ
+    python asset_pipeline.py "布袋寅泰" --jobs 2
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+
+from asset_registry import get_asset_registry, video_id_from_url
+from contour_cache import META_FILENAME, entry_path, file_content_hash
+from separation_worker import DEFAULT_MODEL, DEFAULT_OUTPUT_DIR, get_separation_worker
+from stem_store import (
+    PEAKS_SAMPLES_PER_PIXEL, PREVIEW_COMPRESSION, PREVIEW_SR, STEM_FORMAT, STEMS_TO_KEEP,
+    load_audio, open_stem_writer, preview_format, write_peaks, write_preview,
+)
+
+STATE_PATH = os.path.join('cache', 'asset_pipeline.json')
+PIPELINE_VERSION = 1
+# 前後の無音を除いたお手本の保存先 (<動画ID>.<形式>)。
+# separated_audio の外に置くのは、stem_store.compact_track が STEMS_TO_KEEP 以外のファイルを消すため
+REFERENCE_DIR = 'reference_audio'
+REFERENCE_STEM = "other"
+# 最大音量からこの dB 以上小さい区間を無音とみなす
+TRIM_TOP_DB = 40
+DEFAULT_PIPELINE_JOBS = 2
+
+
+@dataclass
+class Node:
+    """
+    パイプラインのノード。build は {依存ノード名: {ラベル: パス}} を受け取り、
+    出力ファイル {ラベル: パス} を返す。失敗した場合は例外を送出する。
+    record は (依存ノードの出力, 自分の出力) を受け取り、ノードが最新で build を呼ばない場合に
+    build が台帳などに書いた記録をやり直す (冪等であること)。None なら何もしない。
+    """
+    name: str
+    build: object
+    deps: tuple = ()
+    params: dict = field(default_factory=dict)
+    record: object = None
+
+
+@dataclass
+class NodeResult:
+    """ノードの実行結果。status は "built" / "fresh" (再実行不要) / "error" / "blocked" (依存ノードが失敗)"""
+    target: str
+    node: str
+    status: str
+    outputs: dict = field(default_factory=dict)
+    error: str = None
+    elapsed_sec: float = 0.0
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def _fingerprint(node, inputs):
+    payload = json.dumps(
+        {"version": PIPELINE_VERSION, "node": node.name, "params": node.params, "inputs": inputs},
+        sort_keys=True, ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _outputs_current(outputs):
+    """記録した出力ファイルが全て残っていて、内容が変わっていないか"""
+    try:
+        return all(file_content_hash(record["path"]) == record["sha256"] for record in outputs.values())
+    except OSError:
+        return False
+
+
+class Pipeline:
+    """ノードの指紋と出力の内容ハッシュを状態ファイルに記録し、古くなったノードだけを実行する"""
+
+    def __init__(self, state_path=STATE_PATH):
+        self.state_path = state_path
+        self._lock = threading.Lock()
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                self._state = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            self._state = {}
+
+    def _save(self):
+        directory = os.path.dirname(os.path.abspath(self.state_path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(self._state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def run(self, target, nodes, force=False):
+        """
+        1つのターゲット (練習フレーズ) のノードを依存関係の順に実行する。
+
+        :param target: ターゲットの名前 (状態ファイルのキーになる)
+        :param nodes: Node のリスト (依存ノードが先に並んでいること)
+        :param force: True なら指紋が同じでも全てのノードを実行する
+        :return: NodeResult のリスト
+        """
+        outputs = {}
+        results = []
+        for node in nodes:
+            started = time.perf_counter()
+            if any(dep not in outputs for dep in node.deps):
+                results.append(NodeResult(target, node.name, "blocked"))
+                continue
+
+            inputs = {dep: {label: record["sha256"] for label, record in outputs[dep].items()} for dep in node.deps}
+            fingerprint = _fingerprint(node, inputs)
+            state_key = f"{target}:{node.name}"
+            with self._lock:
+                entry = self._state.get(state_key)
+            if not force and entry and entry["fingerprint"] == fingerprint and _outputs_current(entry["outputs"]):
+                try:
+                    if node.record is not None:
+                        node.record({dep: _paths(outputs[dep]) for dep in node.deps}, _paths(entry["outputs"]))
+                except Exception as e:
+                    results.append(NodeResult(target, node.name, "error", error=f"{e.__class__.__name__}: {e}"))
+                    continue
+                outputs[node.name] = entry["outputs"]
+                results.append(NodeResult(target, node.name, "fresh", _paths(entry["outputs"])))
+                continue
+
+            try:
+                built = node.build({dep: _paths(outputs[dep]) for dep in node.deps})
+                records = {label: {"path": path, "sha256": file_content_hash(path)} for label, path in built.items()}
+            except Exception as e:
+                results.append(NodeResult(
+                    target, node.name, "error", error=f"{e.__class__.__name__}: {e}",
+                    elapsed_sec=round(time.perf_counter() - started, 3)
+                ))
+                continue
+            outputs[node.name] = records
+            with self._lock:
+                self._state[state_key] = {"fingerprint": fingerprint, "outputs": records}
+                self._save()
+            results.append(NodeResult(
+                target, node.name, "built", built, elapsed_sec=round(time.perf_counter() - started, 3)
+            ))
+        return results
+
+
+def _paths(records):
+    return {label: record["path"] for label, record in records.items()}
+
+
+def _silence_bounds(y, stem_path, top_db=TRIM_TOP_DB):
+    """(チャンネル数, サンプル数) の音声で、前後の無音を除いた区間 (開始, 終了) のサンプル番号"""
+    import librosa
+
+    _, (start, end) = librosa.effects.trim(y.mean(axis=0), top_db=top_db)
+    if end <= start:
+        raise ValueError(f"ステムが無音です: {stem_path}")
+    return start, end
+
+
+def _trim_silence(stem_path, video_id, top_db=TRIM_TOP_DB, output_dir=REFERENCE_DIR, fmt=STEM_FORMAT):
+    """ステムの前後の無音を除いてお手本として保存する。:return: (パス, 先頭を削った秒数)"""
+    y, sr = load_audio(stem_path, mono=False)
+    start, end = _silence_bounds(y, stem_path, top_db)
+    with open_stem_writer(output_dir, video_id, sr, y.shape[0], fmt) as f:
+        f.write(y[:, start:end].T)
+        path = f.name
+    return path, start / sr
+
+
+def phrase_nodes(guitarist, phrase, registry, engine=None, model_name=DEFAULT_MODEL, output_dir=DEFAULT_OUTPUT_DIR,
+                 extractor_factory=None):
+    """
+    練習フレーズ (data_loader.PRACTICE_PHRASES の値) のビルドに使うノードを作る。
+    各ノードは結果をアセット台帳にも記録する (最新で再実行しない場合も、消された記録は record で戻す)。
+    """
+    from pitch_analyzer import DEFAULT_ENGINE, _reference_params, load_reference_contour
+    from youtube_downloader import DEFAULT_FORMAT, download_audio
+
+    engine = engine or DEFAULT_ENGINE
+    url = phrase["youtube_url"]
+    video_id = video_id_from_url(url)
+    start_sec, end_sec = phrase.get("start_sec"), phrase.get("end_sec")
+
+    def download(inputs):
+        # 台帳に登録済みの音源 (タイトル名で保存された過去のダウンロードなど) があればそれを使う
+        asset = registry.get(video_id)
+        if asset and asset.get("audio") and os.path.exists(asset["audio"]["path"]):
+            return {"audio": asset["audio"]["path"]}
+        result = download_audio(url, file_format=DEFAULT_FORMAT, extractor_factory=extractor_factory)
+        if result.path is None:
+            raise RuntimeError(result.error)
+        registry.register(video_id, guitarist, phrase["title"], url, result.path)
+        return {"audio": result.path}
+
+    def separate(inputs):
+        job = get_separation_worker(model_name).separate(
+            inputs["download"]["audio"], output_dir=output_dir, start_sec=start_sec, end_sec=end_sec
+        )
+        if job.status != "done":
+            raise RuntimeError(job.error)
+        registry.record_stems(video_id, job.stems, model_name)
+        return dict(job.stems)
+
+    def record_separate(inputs, outputs):
+        registry.record_stems(video_id, outputs, model_name)
+
+    def trim(inputs):
+        path, offset_sec = _trim_silence(inputs["separate"][REFERENCE_STEM], video_id)
+        # お手本の先頭が練習区間の何秒目にあたるか (区間の開始 + 削った無音)
+        registry.record_reference(video_id, path, (start_sec or 0.0) + offset_sec)
+        return {"reference": path}
+
+    def record_trim(inputs, outputs):
+        path = outputs["reference"]
+        if registry.has_reference(video_id, path):
+            return
+        # 記録が消されている場合は、削った無音の長さだけをステムから求め直す
+        stem_path = inputs["separate"][REFERENCE_STEM]
+        y, sr = load_audio(stem_path, mono=False)
+        start, _ = _silence_bounds(y, stem_path)
+        registry.record_reference(video_id, path, (start_sec or 0.0) + start / sr)
+
+    def contour(inputs):
+        path = inputs["trim"]["reference"]
+        if load_reference_contour(path, engine=engine) is None:
+            raise RuntimeError(f"ピッチ輪郭を解析できませんでした: {path}")
+        entry_dir = entry_path(path, _reference_params(engine))
+        registry.record_contour(video_id, "reference", engine, os.path.basename(entry_dir))
+        return {"meta": os.path.join(entry_dir, META_FILENAME)}
+
+    def record_contour(inputs, outputs):
+        registry.record_contour(video_id, "reference", engine, os.path.basename(os.path.dirname(outputs["meta"])))
+
+    def preview(inputs):
+        # 練習タブのプレーヤーには元のステムではなく、小さな圧縮音声と波形のピークを渡す
+        path = inputs["trim"]["reference"]
+        base = os.path.splitext(path)[0]
+        preview_path, mime = write_preview(path, base + ".preview")
+        peaks_path = write_peaks(path, base + ".peaks.json")
+        registry.record_preview(video_id, preview_path, mime, peaks_path)
+        return {"preview": preview_path, "peaks": peaks_path}
+
+    def record_preview(inputs, outputs):
+        registry.record_preview(video_id, outputs["preview"], preview_format()[3], outputs["peaks"])
+
+    return [
+        Node("download", download, params={"video_id": video_id, "format": DEFAULT_FORMAT}),
+        Node("separate", separate, deps=("download",), params={
+            "model": model_name, "start_sec": start_sec, "end_sec": end_sec,
+            "stems": sorted(STEMS_TO_KEEP), "format": STEM_FORMAT,
+        }, record=record_separate),
+        Node("trim", trim, deps=("separate",), params={
+            "stem": REFERENCE_STEM, "top_db": TRIM_TOP_DB, "format": STEM_FORMAT,
+        }, record=record_trim),
+        Node("contour", contour, deps=("trim",), params=_reference_params(engine), record=record_contour),
+        Node("preview", preview, deps=("trim",), params={
+            "format": preview_format()[0], "sr": PREVIEW_SR, "compression": PREVIEW_COMPRESSION,
+            "samples_per_pixel": PEAKS_SAMPLES_PER_PIXEL,
+        }, record=record_preview),
+    ]
+
+
+def build_phrases(phrases=None, jobs=DEFAULT_PIPELINE_JOBS, force=False, engine=None, pipeline=None, registry=None,
+                  extractor_factory=None):
+    """
+    練習フレーズのアセットをビルドする。フレーズごとのノード列を最大 jobs 件並列に実行する。
+
+    :param phrases: {ギタリスト: フレーズ}。None なら data_loader.PRACTICE_PHRASES の全て
+    :return: {ギタリスト: [NodeResult, ...]}
+    """
+    if phrases is None:
+        from data_loader import PRACTICE_PHRASES as phrases
+    pipeline = pipeline or Pipeline()
+    registry = registry or get_asset_registry()
+
+    def build(guitarist):
+        phrase = phrases[guitarist]
+        video_id = video_id_from_url(phrase.get("youtube_url"))
+        if video_id is None:
+            return [NodeResult(guitarist, "download", "error", error="youtube_url から動画IDを取得できません")]
+        if registry.get(video_id) is None:
+            registry.register(video_id, guitarist, phrase["title"], phrase["youtube_url"])
+        nodes = phrase_nodes(guitarist, phrase, registry, engine=engine, extractor_factory=extractor_factory)
+        try:
+            return pipeline.run(video_id, nodes, force=force)
+        finally:
+            registry.save()
+
+    with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(phrases)))) as pool:
+        return dict(zip(phrases, pool.map(build, phrases)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="練習フレーズの音源 (ダウンロード・分離・お手本・ピッチ輪郭) を差分ビルドします。")
+    parser.add_argument("guitarists", nargs='*', help="ビルドするギタリスト。省略すると全ての練習フレーズ")
+    parser.add_argument("--jobs", type=int, default=DEFAULT_PIPELINE_JOBS, help="並列に処理するフレーズ数")
+    parser.add_argument("--force", action="store_true", help="最新のノードも実行し直す")
+    parser.add_argument("--engine", default=None, help="お手本のピッチ推定エンジン (既定: pitch_engines.DEFAULT_ENGINE)")
+    args = parser.parse_args(argv)
+
+    from data_loader import PRACTICE_PHRASES
+    unknown = [name for name in args.guitarists if name not in PRACTICE_PHRASES]
+    if unknown:
+        print(f"エラー: 練習フレーズが登録されていないギタリストです: {', '.join(unknown)}")
+        return 1
+    phrases = {name: PRACTICE_PHRASES[name] for name in (args.guitarists or PRACTICE_PHRASES)}
+
+    started = time.perf_counter()
+    failed = False
+    for guitarist, results in build_phrases(phrases, jobs=args.jobs, force=args.force, engine=args.engine).items():
+        print(f"{guitarist} / {phrases[guitarist]['title']}")
+        for result in results:
+            if result.status == "error":
+                failed = True
+                print(f"  ✗ {result.node}: {result.error}")
+            elif result.status == "blocked":
+                print(f"  - {result.node}: 依存ノードが失敗したため未実行")
+            elif result.status == "fresh":
+                print(f"  = {result.node}: 最新")
+            else:
+                print(f"  ✓ {result.node} ({result.elapsed_sec:.1f}秒)")
+    print(f"完了 ({time.perf_counter() - started:.1f}秒)")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
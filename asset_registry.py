@@ -0,0 +1,413 @@
+# asset_registry.py
+"""
+練習フレーズごとの音源アセット (ダウンロード音源・分離ステム・ピッチ輪郭キャッシュ) の台帳。
+
+アセットは YouTube の動画ID をキーに、ギタリスト・フレーズ名と、各ファイルのパスと内容ハッシュを記録する。
+台帳 (ASSET_REGISTRY, 既定: asset_registry.json) はプロセスごとに一度だけ読み込み、
+ギタリスト・フレーズ・動画ID・内容ハッシュからの参照は辞書で O(1) に引ける。
+ファイル名 (動画タイトル) の検索は台帳を作るとき (scan) に一度だけ行う。
+台帳は実行時に生成するファイルなのでリポジトリには含めない。無ければ最初の get_asset_registry で scan して作る。
+
+    registry = get_asset_registry()
+    reference_path = registry.reference_stem("B'z 松本孝弘")
+
+既存のダウンロード音源・分離結果から台帳を作り直すには:
+    python asset_registry.py scan
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import unicodedata
+from datetime import datetime, timezone
+from urllib.parse import parse_qs, urlparse
+
+from contour_cache import cache_key, file_content_hash
+from separation_worker import DEFAULT_MODEL, DEFAULT_OUTPUT_DIR, WINDOW_SEPARATOR, window_label
+from stem_store import find_stem
+
+REGISTRY_PATH = os.getenv("ASSET_REGISTRY", "asset_registry.json")
+REGISTRY_VERSION = 1
+DOWNLOAD_DIR = 'downloaded_audio'
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.ogg', '.m4a', '.flac', '.webm')
+STEM_NAMES = ("bass", "drums", "other", "vocals")
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def video_id_from_url(url):
+    """YouTube の URL (watch?v=... / youtu.be/... / shorts/...) から動画IDを取り出す。取れなければ None"""
+    if not url:
+        return None
+    parsed = urlparse(url)
+    if parsed.hostname and parsed.hostname.endswith("youtu.be"):
+        return parsed.path.strip("/").split("/")[0] or None
+    video_ids = parse_qs(parsed.query).get("v")
+    if video_ids:
+        return video_ids[0]
+    parts = parsed.path.strip("/").split("/")
+    if len(parts) >= 2 and parts[0] in ("shorts", "embed", "live"):
+        return parts[1]
+    return None
+
+
+def normalize_title(title):
+    """全角/半角や大文字/小文字、記号の表記ゆれを吸収したタイトル (ファイル名との照合用)"""
+    return unicodedata.normalize("NFKC", title).casefold().replace("’", "'")
+
+
+def _relpath(path):
+    # 台帳は OS をまたいで使えるよう、カレントディレクトリからの相対パスを '/' 区切りで保存する
+    return os.path.relpath(path).replace(os.sep, "/")
+
+
+def _file_record(path):
+    return {"path": _relpath(path), "sha256": file_content_hash(path)}
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class AssetRegistry:
+    """
+    音源アセットの台帳。エントリは次の形の辞書で、動画IDがキーになる。
+
+        {"video_id", "guitarist", "phrase", "youtube_url",
+         "audio": {"path", "sha256"} または None,
+         "stems": {ステム名: {"path", "sha256"}}, "model",
+         "reference": 前後の無音を除いたお手本 {"path", "sha256", "offset_sec"} または None,
+         "preview": お手本の再生用プレビューと波形のピーク {"path", "sha256", "mime", "peaks"} または None,
+         "contours": {"<ステム名>:<エンジン>": キャッシュキー}, "updated_at"}
+    """
+
+    def __init__(self, path=REGISTRY_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        self._mtime_ns = None
+        self._assets = {}
+        self._by_guitarist = {}
+        self._by_phrase = {}
+        self._by_content = {}
+        self.reload()
+
+    def reload(self):
+        """台帳ファイルを読み込み直し、参照用の索引を作る"""
+        with self._lock:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self._mtime_ns = os.stat(self.path).st_mtime_ns
+            except FileNotFoundError:
+                data = {}
+                self._mtime_ns = None
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"Error loading asset registry: {e}")
+                data = {}
+                self._mtime_ns = None
+            self._assets = data.get("assets", {}) if data.get("version") == REGISTRY_VERSION else {}
+            self._reindex()
+
+    def reload_if_changed(self):
+        """別プロセス (分離やスキャン) が台帳を更新していれば読み込み直す。確認は stat 1回だけ"""
+        try:
+            mtime_ns = os.stat(self.path).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        if mtime_ns != self._mtime_ns:
+            self.reload()
+
+    def _reindex(self):
+        self._by_guitarist = {}
+        self._by_phrase = {}
+        self._by_content = {}
+        for video_id, asset in self._assets.items():
+            # 同じギタリストに複数のアセットがある場合は最初に登録したものを使う
+            self._by_guitarist.setdefault(asset["guitarist"], video_id)
+            self._by_phrase[(asset["guitarist"], normalize_title(asset["phrase"]))] = video_id
+            if asset.get("audio"):
+                self._by_content[asset["audio"]["sha256"]] = video_id
+
+    def save(self):
+        """台帳を書き出す (一時ファイルに書いてから置き換える)"""
+        with self._lock:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({"version": REGISTRY_VERSION, "assets": self._assets}, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+            self._mtime_ns = os.stat(self.path).st_mtime_ns
+
+    def __len__(self):
+        return len(self._assets)
+
+    def __iter__(self):
+        return iter(list(self._assets.values()))
+
+    def get(self, video_id):
+        return self._assets.get(video_id)
+
+    def for_guitarist(self, guitarist):
+        video_id = self._by_guitarist.get(guitarist)
+        return self._assets.get(video_id) if video_id else None
+
+    def for_phrase(self, guitarist, phrase):
+        video_id = self._by_phrase.get((guitarist, normalize_title(phrase)))
+        return self._assets.get(video_id) if video_id else None
+
+    def find_by_content(self, content_hash):
+        """ダウンロード音源の内容ハッシュからアセットを引く"""
+        video_id = self._by_content.get(content_hash)
+        return self._assets.get(video_id) if video_id else None
+
+    def reference_stem(self, guitarist, stem="other"):
+        """ギタリストのお手本ステムのパス。未登録またはファイルが無ければ None"""
+        asset = self.for_guitarist(guitarist)
+        record = asset["stems"].get(stem) if asset else None
+        if record and os.path.exists(record["path"]):
+            return record["path"]
+        return None
+
+    def reference_audio(self, guitarist):
+        """
+        お手本の音源のパス。asset_pipeline が作った前後の無音を除いたお手本があればそれを、
+        無ければ other ステムを返す
+        """
+        asset = self.for_guitarist(guitarist)
+        record = asset.get("reference") if asset else None
+        if record and os.path.exists(record["path"]):
+            return record["path"]
+        return self.reference_stem(guitarist, "other")
+
+    def reference_preview(self, guitarist):
+        """
+        お手本の再生用プレビュー。asset_pipeline でビルド済みなら (パス, MIMEタイプ, ピークのパス)、
+        無ければ None (その場合は reference_audio の音源をそのまま再生する)
+        """
+        asset = self.for_guitarist(guitarist)
+        record = asset.get("preview") if asset else None
+        if record and os.path.exists(record["path"]):
+            return record["path"], record["mime"], record["peaks"]["path"]
+        return None
+
+    def register(self, video_id, guitarist, phrase, youtube_url=None, audio_path=None):
+        """アセットを登録 (既にあれば更新) して返す。audio_path を渡すと内容ハッシュも記録する"""
+        with self._lock:
+            asset = self._assets.setdefault(video_id, {
+                "video_id": video_id, "guitarist": guitarist, "phrase": phrase, "youtube_url": youtube_url,
+                "audio": None, "stems": {}, "model": None, "reference": None, "preview": None, "contours": {},
+            })
+            asset.update(guitarist=guitarist, phrase=phrase)
+            if youtube_url:
+                asset["youtube_url"] = youtube_url
+            if audio_path:
+                asset["audio"] = _file_record(audio_path)
+            asset["updated_at"] = _now()
+            self._reindex()
+            return asset
+
+    def record_stems(self, video_id, stems, model=DEFAULT_MODEL):
+        """分離したステム {ステム名: パス} を記録する。ステムの内容が変わった場合はお手本と輪郭キャッシュの記録を消す"""
+        with self._lock:
+            asset = self._assets[video_id]
+            records = {name: _file_record(path) for name, path in sorted(stems.items()) if os.path.exists(path)}
+            if records == asset["stems"] and asset["model"] == model:
+                return asset
+            if records != asset["stems"]:
+                asset["reference"] = None
+                asset["preview"] = None
+                asset["contours"] = {}
+            asset["stems"] = records
+            asset["model"] = model
+            asset["updated_at"] = _now()
+            return asset
+
+    def record_separation(self, input_path, stems, model=DEFAULT_MODEL, content_hash=None):
+        """
+        分離結果を、その入力音源を持つアセットに記録して保存する。
+        入力が台帳のどのアセットの音源でもなければ何もせず None を返す。
+        """
+        content_hash = content_hash or file_content_hash(input_path)
+        with self._lock:
+            asset = self.find_by_content(content_hash)
+            if asset is None:
+                return None
+            self.record_stems(asset["video_id"], stems, model)
+            self.save()
+            return asset
+
+    def has_reference(self, video_id, path):
+        """path (の現在の内容) がお手本として記録済みか"""
+        with self._lock:
+            record = self._assets[video_id].get("reference")
+            if record is None or not os.path.exists(path):
+                return False
+            return {"path": record["path"], "sha256": record["sha256"]} == _file_record(path)
+
+    def record_reference(self, video_id, path, offset_sec=0.0):
+        """
+        お手本 (ステムから前後の無音を除いたもの) を記録する。
+        :param offset_sec: お手本の先頭がステムの何秒目にあたるか
+        """
+        with self._lock:
+            asset = self._assets[video_id]
+            self._update(asset, "reference", dict(_file_record(path), offset_sec=round(float(offset_sec), 3)))
+            return asset
+
+    def record_preview(self, video_id, path, mime, peaks_path):
+        """お手本の再生用プレビューと波形のピークのファイルを記録する"""
+        with self._lock:
+            asset = self._assets[video_id]
+            self._update(asset, "preview", dict(_file_record(path), mime=mime, peaks=_file_record(peaks_path)))
+            return asset
+
+    def record_contour(self, video_id, stem, engine, key):
+        """お手本ステムのピッチ輪郭キャッシュのキー (contour_cache.cache_key) を記録する"""
+        with self._lock:
+            asset = self._assets[video_id]
+            self._update(asset, "contours", dict(asset["contours"], **{f"{stem}:{engine}": key}))
+            return asset
+
+    @staticmethod
+    def _update(asset, name, value):
+        # 記録し直しても内容が同じなら updated_at は変えない (asset_pipeline は最新のノードでも記録し直す)
+        if asset.get(name) != value:
+            asset[name] = value
+            asset["updated_at"] = _now()
+
+
+def get_asset_registry(path=REGISTRY_PATH):
+    """
+    プロセスで共有する台帳を返す。読み込みは初回だけで、以降はファイルが更新された場合のみ読み直す。
+    台帳ファイルが無ければ、既存のダウンロード音源・分離結果を scan して作る。
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None or _registry.path != path:
+            exists = os.path.exists(path)
+            _registry = AssetRegistry(path)
+            if not exists:
+                scan(_registry)
+        else:
+            _registry.reload_if_changed()
+        return _registry
+
+
+def _find_by_title(directory, title, want_dir, window=None):
+    """
+    directory 直下で、正規化したタイトルを名前に含むファイル (want_dir なら ディレクトリ) を探す。
+    ディレクトリは window (separation_worker.window_label) が一致するもの (None なら区間なしの分離) だけを対象にする
+    """
+    if not os.path.isdir(directory):
+        return None
+    needle = normalize_title(title)
+    suffix = None if window is None else WINDOW_SEPARATOR + window
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if needle not in normalize_title(name):
+            continue
+        if want_dir and os.path.isdir(path):
+            if name.endswith(suffix) if suffix else WINDOW_SEPARATOR not in name:
+                return path
+            continue
+        if not want_dir and name.lower().endswith(AUDIO_EXTENSIONS):
+            return path
+    return None
+
+
+def _separated_stems(output_dir, model_name, audio_hash, title, start_sec=None, end_sec=None):
+    """
+    分離マニフェスト (内容ハッシュ・モデル・区間) を優先し、無ければタイトルと区間でトラックのディレクトリを探す
+    """
+    if audio_hash:
+        from audio_separator import load_manifest, manifest_key
+        entry = load_manifest(output_dir).get(manifest_key(audio_hash, model_name, start_sec, end_sec))
+        if entry and all(os.path.exists(path) for path in entry["stems"].values()):
+            return entry["stems"]
+    track_dir = _find_by_title(
+        os.path.join(output_dir, model_name), title, want_dir=True, window=window_label(start_sec, end_sec)
+    )
+    if track_dir is None:
+        return {}
+    stems = {name: find_stem(track_dir, name) for name in STEM_NAMES}
+    return {name: path for name, path in stems.items() if path}
+
+
+def record_reference_contour(registry, video_id, engine=None, stem="other"):
+    """
+    お手本ステムのピッチ輪郭を解析 (キャッシュ済みなら読み込み) し、そのキャッシュキーを台帳に記録する。
+    :return: キャッシュキー。ステムが無いか解析に失敗した場合は None
+    """
+    from pitch_analyzer import DEFAULT_ENGINE, _reference_params, load_reference_contour
+    engine = engine or DEFAULT_ENGINE
+    record = registry.get(video_id)["stems"].get(stem)
+    if record is None or load_reference_contour(record["path"], engine=engine) is None:
+        return None
+    key = cache_key(record["sha256"], _reference_params(engine))
+    registry.record_contour(video_id, stem, engine, key)
+    return key
+
+
+def scan(registry, phrases=None, download_dir=DOWNLOAD_DIR, output_dir=DEFAULT_OUTPUT_DIR, model_name=DEFAULT_MODEL):
+    """
+    練習フレーズ (data_loader.PRACTICE_PHRASES) ごとに、既存のダウンロード音源と分離結果を探して台帳に登録する。
+    :return: 登録したアセットのリスト
+    """
+    if phrases is None:
+        from data_loader import PRACTICE_PHRASES as phrases
+    assets = []
+    for guitarist, phrase in phrases.items():
+        video_id = video_id_from_url(phrase.get("youtube_url"))
+        if video_id is None:
+            print(f"  ✗ {guitarist}: youtube_url から動画IDを取得できません")
+            continue
+        audio_path = _find_by_title(download_dir, phrase["title"], want_dir=False)
+        asset = registry.register(video_id, guitarist, phrase["title"], phrase.get("youtube_url"), audio_path)
+        audio_hash = asset["audio"]["sha256"] if asset["audio"] else None
+        stems = _separated_stems(
+            output_dir, model_name, audio_hash, phrase["title"], phrase.get("start_sec"), phrase.get("end_sec")
+        )
+        if stems:
+            registry.record_stems(video_id, stems, model_name)
+        assets.append(asset)
+    registry.save()
+    return assets
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="練習フレーズの音源アセット台帳を管理します。")
+    parser.add_argument("--registry", default=REGISTRY_PATH, help="台帳ファイルのパス")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    scan_parser = subparsers.add_parser("scan", help="既存のダウンロード音源・分離結果から台帳を作り直す")
+    scan_parser.add_argument("--download-dir", default=DOWNLOAD_DIR, help="ダウンロード音源のディレクトリ")
+    scan_parser.add_argument("--out", default=DEFAULT_OUTPUT_DIR, help="分離結果のディレクトリ")
+    scan_parser.add_argument("--model", default=DEFAULT_MODEL, help="demucs のモデル名")
+    scan_parser.add_argument("--contours", action="store_true", help="お手本のピッチ輪郭も解析してキャッシュする")
+    subparsers.add_parser("show", help="台帳の内容を表示する")
+    args = parser.parse_args(argv)
+
+    registry = AssetRegistry(args.registry)
+    if args.command == "scan":
+        scan(registry, download_dir=args.download_dir, output_dir=args.out, model_name=args.model)
+        if args.contours:
+            for asset in registry:
+                record_reference_contour(registry, asset["video_id"])
+            registry.save()
+        print(f"{len(registry)} 件のアセットを {args.registry} に記録しました。")
+
+    for asset in registry:
+        audio = asset["audio"]["path"] if asset["audio"] else "(未ダウンロード)"
+        stems = ", ".join(sorted(asset["stems"])) or "(未分離)"
+        print(f"  {asset['guitarist']} / {asset['phrase']} [{asset['video_id']}]")
+        print(f"    音源: {audio}")
+        print(f"    ステム: {stems}  輪郭キャッシュ: {len(asset['contours'])} 件")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
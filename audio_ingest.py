@@ -0,0 +1,197 @@
+# audio_ingest.py
+"""
+ユーザーの録音 (アップロードやブラウザ録音) を解析用の音声に取り込む。
+
+ファイル全体を読み込んでから変換するのではなく、ブロックごとにデコードしながら
+モノラルへのダウンミックスと解析用サンプルレートへのリサンプル (soxr のストリーム変換) を行う。
+サイズと長さは上限を超えた時点で打ち切るため、どんなファイルがアップロードされても
+1リクエストあたりのメモリと処理時間は上限で決まる。最後に前後の無音を取り除く。
+
+    audio = ingest_audio(uploaded_file)   # ファイルライクオブジェクト / パス / バイト列
+    audio.samples, audio.sr
+"""
+
+import io
+import os
+import tempfile
+from dataclasses import dataclass
+
+import numpy as np
+import soundfile as sf
+
+# 解析用のサンプルレート。お手本のステム (demucs の出力) と同じにして、フレームの長さを揃える
+INGEST_SR = 44100
+# アップロードの上限 (バイト) と、取り込む音声の長さの上限 (秒)
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "50")) * 1024 * 1024
+MAX_DURATION_SEC = float(os.getenv("MAX_RECORDING_SEC", "180"))
+# 一度にデコードするフレーム数
+BLOCK_FRAMES = 65536
+# 最大音量からこの dB 以上小さい前後の区間を無音として取り除く
+TRIM_TOP_DB = 40
+
+
+class AudioIngestError(ValueError):
+    """取り込めない音声 (上限超過・未対応の形式・無音など)。メッセージはそのままユーザーに表示できる"""
+
+
+@dataclass
+class IngestedAudio:
+    """取り込んだ音声 (モノラル float32)。trimmed_start_sec は先頭から取り除いた無音の長さ"""
+    samples: np.ndarray
+    sr: int
+    source_sr: int
+    source_channels: int
+    trimmed_start_sec: float = 0.0
+
+    @property
+    def duration_sec(self):
+        return len(self.samples) / self.sr
+
+
+def _source_size(source):
+    """ファイルパス・ファイルライクオブジェクト (Streamlit の UploadedFile を含む) のバイト数"""
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    size = getattr(source, "size", None)
+    if size is not None:
+        return size
+    position = source.tell()
+    source.seek(0, os.SEEK_END)
+    size = source.tell()
+    source.seek(position)
+    return size
+
+
+class _StreamResampler:
+    """ブロックごとにモノラルへダウンミックスし、サンプルレートを変換して溜める"""
+
+    def __init__(self, source_sr, target_sr, max_duration_sec):
+        self.source_sr = source_sr
+        self.target_sr = target_sr
+        self.max_duration_sec = max_duration_sec
+        self.max_frames = int(max_duration_sec * source_sr)
+        self.frames = 0
+        self.blocks = []
+        self._stream = None
+        if source_sr != target_sr:
+            import soxr
+            self._stream = soxr.ResampleStream(source_sr, target_sr, 1, dtype='float32', quality='HQ')
+
+    def add(self, block, last=False):
+        """block: (フレーム数, チャンネル数) の float32"""
+        self.frames += len(block)
+        if self.frames > self.max_frames:
+            raise AudioIngestError(f"録音が長すぎます。{self.max_duration_sec:.0f}秒以内の録音にしてください。")
+        mono = block.mean(axis=1, dtype=np.float32) if block.ndim == 2 else block.astype(np.float32)
+        if self._stream is not None:
+            mono = self._stream.resample_chunk(mono, last=last)
+        if len(mono):
+            self.blocks.append(mono)
+
+    def finish(self):
+        if self._stream is not None:
+            self.add(np.zeros((0, 1), dtype=np.float32), last=True)
+        return np.concatenate(self.blocks) if self.blocks else np.zeros(0, dtype=np.float32)
+
+
+def _decode_soundfile(source, target_sr, max_duration_sec):
+    """soundfile (libsndfile) で読める形式 (wav/flac/ogg/mp3 など) をブロックごとにデコードする"""
+    with sf.SoundFile(source) as f:
+        if f.frames > 0 and f.frames / f.samplerate > max_duration_sec:
+            raise AudioIngestError(f"録音が長すぎます。{max_duration_sec:.0f}秒以内の録音にしてください。")
+        resampler = _StreamResampler(f.samplerate, target_sr, max_duration_sec)
+        for block in f.blocks(blocksize=BLOCK_FRAMES, dtype='float32', always_2d=True):
+            resampler.add(block)
+        return resampler.finish(), f.samplerate, f.channels
+
+
+def _decode_audioread(source, target_sr, max_duration_sec):
+    """
+    libsndfile で読めない形式 (m4a など) は audioread (ffmpeg など) でデコードする。
+    audioread はパスしか受け付けないため、ファイルライクオブジェクトは一時ファイルに書き出す
+    (サイズは事前に上限を確認済み)。
+    """
+    import audioread
+
+    tmp_path = None
+    try:
+        if not isinstance(source, (str, os.PathLike)):
+            source.seek(0)
+            with tempfile.NamedTemporaryFile(suffix=".audio", delete=False) as tmp:
+                for chunk in iter(lambda: source.read(1 << 20), b''):
+                    tmp.write(chunk)
+                tmp_path = tmp.name
+        with audioread.audio_open(tmp_path or source) as f:
+            if f.duration and f.duration > max_duration_sec:
+                raise AudioIngestError(f"録音が長すぎます。{max_duration_sec:.0f}秒以内の録音にしてください。")
+            resampler = _StreamResampler(f.samplerate, target_sr, max_duration_sec)
+            for buffer in f:
+                block = np.frombuffer(buffer, dtype='<i2').astype(np.float32) / 32768.0
+                resampler.add(block.reshape(-1, f.channels))
+            return resampler.finish(), f.samplerate, f.channels
+    except audioread.NoBackendError:
+        raise AudioIngestError("この形式の音声は読み込めません。wav / mp3 / ogg / flac で保存してください。")
+    finally:
+        if tmp_path is not None:
+            os.remove(tmp_path)
+
+
+def trim_silence(samples, sr, top_db=TRIM_TOP_DB, frame_length=2048, hop_length=512):
+    """
+    前後の無音を取り除く。:return: (音声, 先頭から取り除いたサンプル数)
+    librosa.effects.trim と同じく、フレームの RMS が最大から top_db 以上小さい区間を無音とみなす。
+    フレームを配列に展開せず、ホップごとのエネルギーの移動和で求めるので、追加のメモリは音声1本分で済む。
+    """
+    if len(samples) == 0:
+        return samples, 0
+    starts = np.arange(0, len(samples), hop_length)
+    hop_energy = np.add.reduceat(np.square(samples, dtype=np.float32), starts).astype(np.float64)
+    hops_per_frame = max(1, frame_length // hop_length)
+    frame_energy = np.convolve(hop_energy, np.ones(hops_per_frame), mode='full')[:len(hop_energy)]
+    threshold = frame_energy.max() * 10.0 ** (-top_db / 10.0)
+    loud = np.flatnonzero(frame_energy > threshold)
+    if len(loud) == 0:
+        return samples[:0], 0
+    # フレーム k はホップ k-hops_per_frame+1 .. k のエネルギーの和
+    start = int(starts[max(0, loud[0] - hops_per_frame + 1)])
+    end = int(min(len(samples), starts[loud[-1]] + hop_length))
+    return samples[start:end], start
+
+
+def ingest_audio(source, sr=INGEST_SR, max_bytes=MAX_UPLOAD_BYTES, max_duration_sec=MAX_DURATION_SEC, trim=True):
+    """
+    録音を解析用の音声に取り込む。
+
+    :param source: ファイルパス、ファイルライクオブジェクト (UploadedFile など)、またはバイト列
+    :param sr: 出力のサンプルレート
+    :param max_bytes: 受け付けるファイルサイズの上限
+    :param max_duration_sec: 受け付ける長さの上限 (秒)。超えた時点でデコードを打ち切る
+    :param trim: 前後の無音を取り除く
+    :return: IngestedAudio
+    :raises AudioIngestError: 上限を超えた、読み込めない、または音が入っていない場合
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    if _source_size(source) > max_bytes:
+        raise AudioIngestError(f"ファイルが大きすぎます。{max_bytes / 1024 ** 2:.0f}MB以下のファイルにしてください。")
+
+    try:
+        if hasattr(source, "seek"):
+            source.seek(0)
+        samples, source_sr, channels = _decode_soundfile(source, sr, max_duration_sec)
+    except (RuntimeError, TypeError):
+        # soundfile で読めない形式
+        samples, source_sr, channels = _decode_audioread(source, sr, max_duration_sec)
+    finally:
+        if hasattr(source, "seek"):
+            source.seek(0)
+
+    start = 0
+    if trim:
+        samples, start = trim_silence(samples, sr)
+    if len(samples) == 0 or not np.any(samples):
+        raise AudioIngestError("音声が入っていません。録音をやり直してください。")
+    return IngestedAudio(
+        samples=np.ascontiguousarray(samples, dtype=np.float32), sr=sr, source_sr=source_sr,
+        source_channels=channels, trimmed_start_sec=start / sr,
+    )
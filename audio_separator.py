@@ -1,65 +1,273 @@
+import argparse
+import json
 import os
-import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
 
-def separate_audio(input_file_path, output_path='separated_audio'):
+from asset_registry import get_asset_registry
+from contour_cache import file_content_hash
+from separation_worker import DEFAULT_MODEL, get_separation_worker, window_label
+
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.ogg', '.m4a', '.flac')
+MANIFEST_FILENAME = 'manifest.json'
+# demucs (htdemucs) 1プロセスが1曲の分離に使うメモリの目安 (バイト)
+MEMORY_PER_WORKER = 3 * 1024 ** 3
+MAX_SEPARATION_WORKERS = 4
+
+
+def _print_progress(job):
+    print(f"  [{job.progress * 100:5.1f}%] {job.stage}")
+
+
+def separate_audio(input_file_path, output_path='separated_audio', model_name=DEFAULT_MODEL, start_sec=None, end_sec=None):
     """
-    demucs を使用して音声ファイルを「ボーカル」と「伴奏」の2つに分離する。
+    demucs を使用して音声ファイルを4つのステム(vocals, drums, bass, other)に分離する。
+    モデルは常駐ワーカー (separation_worker) が一度だけ読み込み、以降の呼び出しで再利用する。
 
     :param input_file_path: 分離する音声ファイルのパス
     :param output_path: 分離されたファイルを保存するディレクトリ
+    :param model_name: demucs のモデル名
+    :param start_sec: 分離する区間の開始 (秒)。None なら曲の先頭から (data_loader.PRACTICE_PHRASES の start_sec)
+    :param end_sec: 分離する区間の終了 (秒)。None なら曲の末尾まで
+    :return: SeparationJob (status, stems, error などを持つ)。入力が無い場合は None
     """
     if not os.path.exists(input_file_path):
         print(f"エラー: 入力ファイルが見つかりません: {input_file_path}")
-        return
+        return None
+
+    window = ""
+    if start_sec is not None or end_sec is not None:
+        window = f" ({start_sec or 0:.1f}秒〜{'末尾' if end_sec is None else f'{end_sec:.1f}秒'})"
+    print(f"'{input_file_path}'{window} の音源分離を開始します (demucs, 4-stems)...")
+    job = get_separation_worker(model_name).separate(
+        input_file_path, output_dir=output_path, on_progress=_print_progress, start_sec=start_sec, end_sec=end_sec
+    )
 
-    # demucsコマンドを組み立てる
-    # --out: 出力ディレクトリ指定
-    # 4ステム(vocals, drums, bass, other)に分離する
-    # 仮想環境のPythonを使用
-    command = [
-        'env/bin/python', '-m', 'demucs',
-        '--out', output_path,
-        input_file_path
-    ]
+    if job.status == "done":
+        print(f"音源分離が完了しました ({job.elapsed_sec:.1f}秒)。ファイルは '{output_path}' に保存されています。")
+        # 練習フレーズの音源であればアセット台帳のステムを更新する (区間を指定した分離も含む)
+        get_asset_registry().record_separation(input_file_path, job.stems, model_name)
+    elif job.error and job.error.startswith("ModuleNotFoundError"):
+        print("エラー: demucs または torch が見つかりません。demucsが正しくインストールされているか確認してください。")
+    else:
+        print(f"demucsの実行中にエラーが発生しました: {job.error}")
+    return job
+
+
+def find_inputs(source):
+    """
+    分離する音声ファイルの一覧を返す。
+
+    :param source: 音声ファイルを含むディレクトリ、または1行に1パスを書いたマニフェスト (.txt)。
+                   マニフェスト内の相対パスはマニフェストの場所を基準に解決する
+    """
+    if os.path.isdir(source):
+        return sorted(
+            os.path.join(source, name) for name in os.listdir(source)
+            if name.lower().endswith(AUDIO_EXTENSIONS)
+        )
+    base_dir = os.path.dirname(os.path.abspath(source))
+    with open(source, 'r', encoding='utf-8') as f:
+        paths = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    return [path if os.path.isabs(path) else os.path.join(base_dir, path) for path in paths]
 
-    print(f"'{input_file_path}' の音源分離を開始します (demucs, 4-stems)...")
 
+def default_separation_workers():
+    """CPUコア数と空きメモリから、同時に実行できる分離プロセス数を決める"""
+    cpu_workers = os.cpu_count() or 1
     try:
-        # demucs をサブプロセスとして実行
-        # stdoutとstderrをキャプチャして、より詳細な情報を表示
-        result = subprocess.run(command, check=True, capture_output=True, text=True, encoding='utf-8')
-        print(result.stdout)
-        if result.stderr:
-            print("----- エラー出力 -----")
-            print(result.stderr)
-        print(f"音源分離が完了しました。ファイルは '{output_path}' に保存されています。")
-
-    except subprocess.CalledProcessError as e:
-        print(f"demucsの実行中にエラーが発生しました。")
-        print(f"コマンド: {' '.join(e.cmd)}")
-        print(f"終了コード: {e.returncode}")
-        print("----- 標準出力 -----")
-        print(e.stdout)
-        print("----- 標準エラー出力 -----")
-        print(e.stderr)
-    except FileNotFoundError:
-        print("エラー: 'python -m demucs' コマンドが見つかりません。demucsが正しくインストールされているか確認してください。")
+        available = os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+        memory_workers = max(1, available // MEMORY_PER_WORKER)
+    except (ValueError, OSError, AttributeError):
+        memory_workers = 1
+    return max(1, min(cpu_workers, memory_workers, MAX_SEPARATION_WORKERS))
+
+
+def _manifest_path(output_path):
+    return os.path.join(output_path, MANIFEST_FILENAME)
+
+
+def load_manifest(output_path='separated_audio'):
+    """分離済みステムのマニフェスト {"<内容ハッシュ>:<モデル名>": エントリ} を読み込む"""
+    try:
+        with open(_manifest_path(output_path), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def save_manifest(manifest, output_path='separated_audio'):
+    """マニフェストを書き出す (一時ファイルに書いてから置き換える)"""
+    os.makedirs(output_path, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=output_path, suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, _manifest_path(output_path))
+
+
+def manifest_key(content_hash, model_name, start_sec=None, end_sec=None):
+    """マニフェストのキー。区間を指定した分離は曲全体の分離と別のエントリ (ステムのディレクトリも別) になる"""
+    key = f"{content_hash}:{model_name}"
+    label = window_label(start_sec, end_sec)
+    if label is not None:
+        key += f":{label}"
+    return key
+
+
+def _existing_stems(manifest, content_hash, model_name, start_sec=None, end_sec=None):
+    """同じ内容・同じモデル・同じ区間で分離済みのステムが全て残っていれば、そのエントリを返す"""
+    entry = manifest.get(manifest_key(content_hash, model_name, start_sec, end_sec))
+    if entry and entry.get("stems") and all(os.path.exists(path) for path in entry["stems"].values()):
+        return entry
+    return None
+
+
+def _init_separation_process(threads):
+    # 複数プロセスで分離する場合、torch のスレッド数をコア数に合わせて分け合う
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+
+def _separate_in_process(input_path, output_path, model_name, start_sec=None, end_sec=None):
+    """ワーカープロセスで1曲を分離する。プロセスごとの常駐ワーカーがモデルを使い回す"""
+    return get_separation_worker(model_name).separate(
+        input_path, output_dir=output_path, start_sec=start_sec, end_sec=end_sec
+    ).to_dict()
+
+
+def separate_batch(input_paths, output_path='separated_audio', model_name=DEFAULT_MODEL, workers=None, force=False,
+                   start_sec=None, end_sec=None):
+    """
+    複数の音声ファイルを並列に分離する。結果は完了した順に1件ずつ返す。
+    同じ内容のファイルを同じモデル・同じ区間で分離済みの場合はスキップする (force=True なら分離し直す)。
+    分離したステムは output_path/manifest.json に記録する。
+
+    :param workers: 同時に分離するプロセス数。None ならコア数と空きメモリから決める
+    :param start_sec: 全ての入力で分離する区間の開始 (秒)。None なら先頭から
+    :param end_sec: 全ての入力で分離する区間の終了 (秒)。None なら末尾まで
+    :return: 入力ごとの辞書 (input_path, content_hash, status, stems, error, elapsed_sec) のジェネレーター。
+             status は "done" / "skipped" / "error"
+    """
+    manifest = load_manifest(output_path)
+    pending = []
+    for input_path in input_paths:
+        try:
+            content_hash = file_content_hash(input_path)
+        except OSError as e:
+            yield {"input_path": input_path, "status": "error", "error": f"{e.__class__.__name__}: {e}"}
+            continue
+        entry = None if force else _existing_stems(manifest, content_hash, model_name, start_sec, end_sec)
+        if entry is not None:
+            yield {"input_path": input_path, "content_hash": content_hash, "status": "skipped", "stems": entry["stems"]}
+        else:
+            pending.append((input_path, content_hash))
+    if not pending:
+        return
+
+    # 同じ内容のファイルが複数あれば1回だけ分離する
+    unique = {}
+    for input_path, content_hash in pending:
+        unique.setdefault(content_hash, input_path)
+
+    workers = min(workers or default_separation_workers(), len(unique))
+    if workers <= 1:
+        results = (
+            (content_hash, _separate_in_process(input_path, output_path, model_name, start_sec, end_sec))
+            for content_hash, input_path in unique.items()
+        )
+        yield from _record_results(results, pending, manifest, output_path, model_name, start_sec, end_sec)
+        return
+
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_separation_process, initargs=(threads,)) as pool:
+        futures = {
+            pool.submit(_separate_in_process, input_path, output_path, model_name, start_sec, end_sec): (content_hash, input_path)
+            for content_hash, input_path in unique.items()
+        }
+
+        def completed():
+            for future in as_completed(futures):
+                content_hash, input_path = futures[future]
+                try:
+                    yield content_hash, future.result()
+                except Exception as e:
+                    yield content_hash, {"input_path": input_path, "status": "error", "error": f"{e.__class__.__name__}: {e}"}
+
+        yield from _record_results(completed(), pending, manifest, output_path, model_name, start_sec, end_sec)
+
+
+def _record_results(results, pending, manifest, output_path, model_name, start_sec=None, end_sec=None):
+    """分離結果をマニフェストに記録し、その内容を持つ全ての入力について結果を返す"""
+    inputs_by_hash = {}
+    for input_path, content_hash in pending:
+        inputs_by_hash.setdefault(content_hash, []).append(input_path)
+
+    for content_hash, job in results:
+        if job["status"] == "done":
+            manifest[manifest_key(content_hash, model_name, start_sec, end_sec)] = {
+                "input_path": job["input_path"],
+                "model": model_name,
+                "start_sec": start_sec,
+                "end_sec": end_sec,
+                "track_dir": job.get("track_dir"),
+                "stems": job["stems"],
+                "separated_at": datetime.now(timezone.utc).isoformat(),
+            }
+            save_manifest(manifest, output_path)
+            get_asset_registry().record_separation(job["input_path"], job["stems"], model_name, content_hash)
+        for input_path in inputs_by_hash[content_hash]:
+            yield {
+                "input_path": input_path, "content_hash": content_hash, "status": job["status"],
+                "stems": job.get("stems", {}), "error": job.get("error"), "elapsed_sec": job.get("elapsed_sec"),
+            }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="demucs で複数の音声ファイルをまとめて音源分離します。")
+    parser.add_argument("source", nargs='?', default="downloaded_audio",
+                        help="音声ファイルのディレクトリ、またはパスを1行ずつ書いたマニフェスト (.txt)")
+    parser.add_argument("--out", default="separated_audio", help="ステムの出力先ディレクトリ")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="demucs のモデル名")
+    parser.add_argument("--workers", type=int, default=None, help="同時に分離するプロセス数")
+    parser.add_argument("--force", action="store_true", help="分離済みでも分離し直す")
+    parser.add_argument("--start", type=float, default=None, help="分離する区間の開始 (秒)")
+    parser.add_argument("--end", type=float, default=None, help="分離する区間の終了 (秒)")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.source):
+        print(f"エラー: '{args.source}' が見つかりません。")
+        print("まず youtube_downloader.py を実行して、音声ファイルをダウンロードしてください。")
+        return 1
+    input_paths = find_inputs(args.source)
+    if not input_paths:
+        print(f"エラー: '{args.source}' に処理対象の音声ファイルが見つかりません。")
+        return 1
+
+    print(f"{len(input_paths)} 件の音声ファイルを処理します...")
+    started = time.perf_counter()
+    counts = {"done": 0, "skipped": 0, "error": 0}
+    results = separate_batch(
+        input_paths, args.out, args.model, workers=args.workers, force=args.force, start_sec=args.start, end_sec=args.end
+    )
+    for result in results:
+        counts[result["status"]] += 1
+        if result["status"] == "error":
+            print(f"  ✗ {result['input_path']}: {result['error']}")
+        elif result["status"] == "skipped":
+            print(f"  - {result['input_path']}: 分離済みのためスキップしました")
+        else:
+            print(f"  ✓ {result['input_path']} ({result['elapsed_sec']:.1f}秒)")
+    elapsed = time.perf_counter() - started
+    print(f"完了: 分離 {counts['done']} 件 / スキップ {counts['skipped']} 件 / エラー {counts['error']} 件 ({elapsed:.1f}秒)。"
+          f"マニフェスト: {_manifest_path(args.out)}")
+    return 1 if counts["error"] else 0
 
 
 if __name__ == '__main__':
-    download_dir = "downloaded_audio"
-    input_audio_file = None
-
-    # downloaded_audio ディレクトリ内の最初の .wav ファイルを探す
-    if os.path.exists(download_dir):
-        for file in os.listdir(download_dir):
-            if file.lower().endswith(".wav"):
-                input_audio_file = os.path.join(download_dir, file)
-                print(f"処理対象ファイルが見つかりました: {input_audio_file}")
-                break
-
-    if input_audio_file:
-        separate_audio(input_audio_file)
-    else:
-        print(f"エラー: '{download_dir}' ディレクトリに処理対象の.wavファイルが見つかりません。")
-        print("まず youtube_downloader.py を実行して、音声ファイルをダウンロードしてください。") 
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,189 @@
+# batch_scoring.py
+"""
+1つのお手本に対して多数の演奏(生徒の録音など)をまとめて採点するバッチ処理。
+
+お手本の輪郭は一度だけ読み込み(contour_cache)、各ワーカープロセスの初期化時に渡す。
+演奏ごとの輪郭抽出とアライメントはプロセスプールで並列に行い、
+完了した順にスコア・処理時間・(任意で)グラフをCSV/JSONLのレポートに書き出す。
+
+使い方:
+    python batch_scoring.py <お手本のwav> <演奏のディレクトリ or マニフェスト> --out report.csv [--plots plots/]
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from analysis_pool import ANALYSIS_WORKERS
+from audio_ingest import AudioIngestError, ingest_audio
+from pitch_analyzer import compare_pitch_contours, extract_user_contour, load_reference_contour
+from pitch_render import render_comparison_png
+
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.ogg', '.m4a', '.flac')
+REPORT_FIELDS = [
+    "take", "score", "pitch_score", "rhythm_score", "timing_offset_ms", "offset_semitones", "normalized_distance", "voiced_frames",
+    "extract_sec", "align_sec", "total_sec", "plot", "error",
+]
+
+# ワーカープロセスごとに保持するお手本の輪郭
+_worker_reference = None
+
+
+def find_takes(source):
+    """
+    採点する演奏ファイルの一覧を返す。
+
+    :param source: 音声ファイルを含むディレクトリ、またはマニフェスト
+                   (.txt: 1行に1パス / .csv: 'path' 列 / .jsonl: "path" キー)。
+                   マニフェスト内の相対パスはマニフェストの場所を基準に解決する
+    """
+    if os.path.isdir(source):
+        return sorted(
+            os.path.join(source, name) for name in os.listdir(source)
+            if name.lower().endswith(AUDIO_EXTENSIONS)
+        )
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    with open(source, 'r', encoding='utf-8') as f:
+        if source.lower().endswith('.csv'):
+            paths = [row["path"] for row in csv.DictReader(f)]
+        elif source.lower().endswith('.jsonl'):
+            paths = [json.loads(line)["path"] for line in f if line.strip()]
+        else:
+            paths = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    return [path if os.path.isabs(path) else os.path.join(base_dir, path) for path in paths]
+
+
+def _init_worker(reference_contour):
+    global _worker_reference
+    _worker_reference = reference_contour
+
+
+def _plot_path(take_path, plot_dir):
+    """演奏ごとのグラフのパス。別のディレクトリにある同名の演奏と重ならないよう、パスのハッシュを付ける"""
+    name = os.path.splitext(os.path.basename(take_path))[0]
+    digest = hashlib.sha1(os.path.abspath(take_path).encode('utf-8')).hexdigest()[:8]
+    return os.path.join(plot_dir, f"{name}-{digest}.png")
+
+
+def _score_take(take_path, engine, plot_dir=None):
+    """1つの演奏を採点してレポートの1行分を返す (ワーカープロセスで実行)"""
+    record = {"take": take_path}
+    started = time.perf_counter()
+    # 対話的な採点と同じく、audio_ingest で取り込んで (モノラル化・リサンプリング・無音の除去) から解析する
+    try:
+        audio = ingest_audio(take_path)
+    except AudioIngestError as e:
+        record["error"] = str(e)
+        return record
+    contour = extract_user_contour(audio, engine=engine, features=True)
+    extracted = time.perf_counter()
+    record["extract_sec"] = round(extracted - started, 4)
+    if contour is None:
+        record["error"] = "ピッチを抽出できませんでした。"
+        return record
+
+    result, message = compare_pitch_contours(contour, _worker_reference)
+    record["align_sec"] = round(time.perf_counter() - extracted, 4)
+    record["voiced_frames"] = int(contour["voiced_flag"].sum())
+    if result is None:
+        record["error"] = message
+    else:
+        record["score"] = round(result["score"], 2)
+        record["pitch_score"] = round(result["pitch_score"], 2)
+        if result.get("rhythm_score") is not None:
+            record["rhythm_score"] = round(result["rhythm_score"], 2)
+            record["timing_offset_ms"] = result["timing_offset_ms"]
+        record["normalized_distance"] = round(result["normalized_distance"], 4)
+        record["offset_semitones"] = result["offset_semitones"]
+        if plot_dir:
+            record["plot"] = _plot_path(take_path, plot_dir)
+            with open(record["plot"], 'wb') as f:
+                f.write(render_comparison_png(result))
+    record["total_sec"] = round(time.perf_counter() - started, 4)
+    return record
+
+
+def score_takes(reference_audio_path, take_paths, engine="acf", reference_engine="pyin", workers=None, plot_dir=None):
+    """
+    お手本を一度だけ読み込み、演奏を並列に採点する。結果は完了した順に1件ずつ返す。
+
+    :param reference_audio_path: お手本の音声ファイル (通常は separated_audio/htdemucs/*/other.wav)
+    :param take_paths: 採点する演奏ファイルのパスのリスト
+    :param engine: 演奏の解析に使うピッチ推定エンジン
+    :param reference_engine: お手本の解析に使うピッチ推定エンジン (結果はキャッシュされる)
+    :param workers: ワーカープロセス数。None なら analysis_pool.ANALYSIS_WORKERS
+    :param plot_dir: 指定した場合、演奏ごとの比較グラフをPNGで保存する
+    """
+    reference = load_reference_contour(reference_audio_path, engine=reference_engine)
+    if reference is None:
+        raise ValueError(f"お手本のピッチを抽出できませんでした: {reference_audio_path}")
+    # メモリマップのままではワーカーに渡せないので通常の配列にする
+    reference = {name: array[...] for name, array in reference.items()}
+    if plot_dir:
+        os.makedirs(plot_dir, exist_ok=True)
+
+    workers = workers or ANALYSIS_WORKERS
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(reference,)) as pool:
+        futures = {pool.submit(_score_take, path, engine, plot_dir): path for path in take_paths}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                yield {"take": futures[future], "error": f"{e.__class__.__name__}: {e}"}
+
+
+def write_report(records, report_path):
+    """レポートを書き出す。拡張子が .jsonl ならJSON Lines、それ以外はCSV。書き出した件数を返す"""
+    count = 0
+    with open(report_path, 'w', encoding='utf-8', newline='') as f:
+        if report_path.lower().endswith('.jsonl'):
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+                count += 1
+        else:
+            writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            for record in records:
+                writer.writerow(record)
+                f.flush()
+                count += 1
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="お手本に対して複数の演奏をまとめて採点します。")
+    parser.add_argument("reference", help="お手本の音声ファイル")
+    parser.add_argument("takes", help="演奏ファイルのディレクトリ、またはマニフェスト (.txt/.csv/.jsonl)")
+    parser.add_argument("--out", default="batch_report.csv", help="レポートの出力先 (.csv または .jsonl)")
+    parser.add_argument("--engine", default="acf", help="演奏の解析に使うピッチ推定エンジン")
+    parser.add_argument("--reference-engine", default="pyin", help="お手本の解析に使うピッチ推定エンジン")
+    parser.add_argument("--workers", type=int, default=None, help="ワーカープロセス数")
+    parser.add_argument("--plots", default=None, help="比較グラフ(PNG)の保存先ディレクトリ")
+    args = parser.parse_args(argv)
+
+    take_paths = find_takes(args.takes)
+    if not take_paths:
+        print(f"エラー: 採点対象の演奏が見つかりません: {args.takes}")
+        return 1
+
+    print(f"{len(take_paths)} 件の演奏を採点します...")
+    started = time.perf_counter()
+    records = score_takes(
+        args.reference, take_paths, engine=args.engine, reference_engine=args.reference_engine,
+        workers=args.workers, plot_dir=args.plots
+    )
+    count = write_report(records, args.out)
+    elapsed = time.perf_counter() - started
+    print(f"{count} 件を {elapsed:.1f} 秒で採点しました ({count / elapsed * 60:.1f} 件/分)。レポート: {args.out}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
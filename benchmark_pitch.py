@@ -0,0 +1,376 @@
+# benchmark_pitch.py
+"""
+pitch_analyzer の速度と精度を測るベンチマーク。
+
+ギターに近い合成信号 (倍音を含む減衰音・チョーキング・ビブラート・音符の並び) を
+正解の f0 付きでオフラインに生成し、次の項目を計測してJSONで出力する。
+
+- ピッチ推定エンジンごと: 処理時間, ピークメモリ, GPE (50セント超の誤差率), 有声判定の再現率/誤検出率
+- アライメント方式ごと: 処理時間, ピークメモリ, 揺らぎを加えた演奏に対するスコアの平均と標準偏差
+- エンジンごとのスコアの安定性: 同じ演奏の揺らぎ違いを音声から採点したときのスコアのばらつき
+
+使い方:
+    python benchmark_pitch.py --out bench.json [--quick] [--baseline 前回のbench.json]
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import librosa
+import numpy as np
+
+from alignment import dtw_align
+from phrase_index import PhraseIndex, candidate_windows
+from pitch_analyzer import HOP_LENGTH, PITCH_FMAX, PITCH_FMIN, _similarity_score
+from pitch_engines import FRAME_LENGTH, PITCH_ENGINES
+
+GPE_THRESHOLD_CENTS = 50.0
+# 曲全体の演奏に使う方式と、曲の一部の演奏に使う方式
+ALIGNMENT_MODES = ("full", "band", "multiscale")
+EXCERPT_ALIGNMENT_MODES = ("full_open", "multiscale_open", "phrase")
+
+
+# --- 合成信号 ---
+
+def _render(f0_per_sample, amplitude, sr, n_harmonics=12, seed=0):
+    """瞬時周波数と振幅包絡から、弦の音に近い倍音の多い信号を作る (f0=0 は無音)"""
+    phase = 2 * np.pi * np.cumsum(f0_per_sample) / sr
+    y = np.zeros_like(phase)
+    for k in range(1, n_harmonics + 1):
+        # 高次倍音ほど弱く、速く減衰する
+        y += (0.8 ** (k - 1)) * np.sin(k * phase) * amplitude ** (1 + 0.15 * k)
+    rng = np.random.default_rng(seed)
+    y += rng.normal(0, 1e-3, len(y))
+    return (0.3 * y / max(np.abs(y).max(), 1e-9)).astype(np.float32)
+
+
+def _pluck_envelope(n_samples, note_starts, sr, decay=3.0):
+    """各音符の頭でアタックし指数的に減衰する振幅包絡"""
+    env = np.zeros(n_samples)
+    for start, end in zip(note_starts[:-1], note_starts[1:]):
+        t = np.arange(end - start) / sr
+        env[start:end] = np.minimum(t / 0.005, 1.0) * np.exp(-decay * t)
+    return env
+
+
+def note_sequence_signal(midi_notes, note_seconds, sr, gap_seconds=0.0, seed=0):
+    """音符の並びを弾いた信号と、サンプルごとの正解 f0 (無音は 0) を返す"""
+    samples_per_note = int(note_seconds * sr)
+    gap = int(gap_seconds * sr)
+    f0 = np.zeros(len(midi_notes) * samples_per_note)
+    starts = np.arange(len(midi_notes) + 1) * samples_per_note
+    for i, note in enumerate(midi_notes):
+        f0[starts[i]:starts[i + 1] - gap] = librosa.midi_to_hz(note)
+    env = _pluck_envelope(len(f0), starts, sr) * (f0 > 0)
+    return _render(f0, env, sr, seed=seed), f0
+
+
+def bend_signal(start_midi, bend_semitones, seconds, sr, seed=0):
+    """1音を弾いてから半音数 bend_semitones だけチョーキングする信号"""
+    n = int(seconds * sr)
+    t = np.arange(n) / sr
+    # 前半でゆっくり持ち上げ、後半は到達した音程を保つ
+    bend = bend_semitones * np.clip((t - 0.2 * seconds) / (0.3 * seconds), 0, 1)
+    f0 = librosa.midi_to_hz(start_midi + bend)
+    env = np.exp(-0.8 * t) * np.minimum(t / 0.005, 1.0)
+    return _render(f0, env, sr, seed=seed), f0
+
+
+def vibrato_signal(midi, depth_semitones, rate_hz, seconds, sr, seed=0):
+    """ビブラートをかけた1音の信号"""
+    n = int(seconds * sr)
+    t = np.arange(n) / sr
+    f0 = librosa.midi_to_hz(midi + depth_semitones * np.sin(2 * np.pi * rate_hz * t))
+    env = np.exp(-0.5 * t) * np.minimum(t / 0.005, 1.0)
+    return _render(f0, env, sr, seed=seed), f0
+
+
+def melody(rng, n_notes, low=40, high=80, max_step=7):
+    """
+    ギターのフレーズに近い音符列 (前の音から最大 max_step 半音の範囲で動くランダムウォーク)。
+    音域全体から独立に選ぶと4音/秒で2〜3オクターブの跳躍が続き、遷移確率で跳躍を抑える pyin が
+    1音まるごとオクターブ下に留まるため、実際の演奏とかけ離れた GPE になる。
+    """
+    notes = [int(rng.integers(low + 12, high - 12))]
+    for _ in range(n_notes - 1):
+        notes.append(int(np.clip(notes[-1] + rng.integers(-max_step, max_step + 1), low, high)))
+    return np.array(notes)
+
+
+def make_cases(durations, sample_rates, seed=0):
+    """ベンチマークに使う合成信号の一覧 (名前, 信号, 正解f0, sr)"""
+    rng = np.random.default_rng(seed)
+    cases = []
+    for sr in sample_rates:
+        for seconds in durations:
+            notes = melody(rng, max(2, int(seconds * 4)))
+            y, f0 = note_sequence_signal(notes, seconds / len(notes), sr, gap_seconds=0.03, seed=seed)
+            cases.append((f"notes_{seconds}s_{sr}", y, f0, sr))
+        y, f0 = bend_signal(64, 2.0, 2.0, sr, seed=seed)
+        cases.append((f"bend_2s_{sr}", y, f0, sr))
+        y, f0 = vibrato_signal(69, 0.4, 5.5, 2.0, sr, seed=seed)
+        cases.append((f"vibrato_2s_{sr}", y, f0, sr))
+    return cases
+
+
+def frame_ground_truth(f0_per_sample, n_frames, hop_length=HOP_LENGTH):
+    """フレーム中心 (i * hop_length) の正解 f0"""
+    positions = np.minimum(np.arange(n_frames) * hop_length, len(f0_per_sample) - 1)
+    return f0_per_sample[positions]
+
+
+# --- 計測 ---
+
+def _measure(func, *args, repeats=1, **kwargs):
+    """
+    (戻り値, 処理時間の中央値[秒], ピークメモリ[MB]) を返す。
+    tracemalloc は numpy の処理を遅くするので、時間とメモリは別々に測る。
+    初回呼び出し (遅延インポートやFFTの準備) は計測に含めない。
+    """
+    func(*args, **kwargs)
+    times = []
+    result = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        times.append(time.perf_counter() - started)
+    tracemalloc.start()
+    func(*args, **kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, float(np.median(times)), peak / 1e6
+
+
+def pitch_errors(f0, voiced_flag, f0_true):
+    """推定結果と正解から GPE などの指標を求める"""
+    truth_voiced = f0_true > 0
+    both = truth_voiced & voiced_flag & ~np.isnan(f0)
+    cents = 1200 * np.abs(np.log2(f0[both] / f0_true[both])) if both.any() else np.zeros(0)
+    return {
+        "gpe": float(np.mean(cents > GPE_THRESHOLD_CENTS)) if len(cents) else None,
+        "fine_error_cents": float(np.mean(cents[cents <= GPE_THRESHOLD_CENTS])) if np.any(cents <= GPE_THRESHOLD_CENTS) else None,
+        "voicing_recall": float(np.mean(voiced_flag[truth_voiced])) if truth_voiced.any() else None,
+        "voicing_false_alarm": float(np.mean(voiced_flag[~truth_voiced])) if (~truth_voiced).any() else None,
+    }
+
+
+def benchmark_engines(cases, engines, repeats):
+    results = []
+    for name, y, f0_true, sr in cases:
+        for engine in engines:
+            estimate = PITCH_ENGINES[engine]
+            (f0, voiced_flag), seconds, peak_mb = _measure(
+                estimate, y, sr, PITCH_FMIN, PITCH_FMAX, HOP_LENGTH, FRAME_LENGTH, repeats=repeats
+            )
+            record = {
+                "case": name, "engine": engine, "sr": sr,
+                "duration_sec": round(len(y) / sr, 3),
+                "latency_sec": round(seconds, 5),
+                "realtime_factor": round(seconds / (len(y) / sr), 5),
+                "peak_memory_mb": round(peak_mb, 3),
+            }
+            record.update(pitch_errors(f0, voiced_flag, frame_ground_truth(f0_true, len(f0))))
+            results.append(record)
+            print(f"  {name:>20} {engine:>5}: {seconds * 1000:8.1f} ms  GPE={record['gpe']}")
+    return results
+
+
+def _warp(ref_midi, positions, rng):
+    """お手本の輪郭を positions で読み出し、音程の揺れと全体のずれを加える"""
+    take = np.interp(positions, np.arange(len(ref_midi)), ref_midi)
+    return take + rng.normal(0, 0.15, len(take)) + rng.uniform(-0.1, 0.1)
+
+
+def _whole_takes(ref_midi, n_takes, rng):
+    """曲全体をテンポを揺らしながら弾いた演奏の輪郭"""
+    n = len(ref_midi)
+    takes = []
+    for _ in range(n_takes):
+        length = int(n * rng.uniform(0.85, 1.15))
+        # ゆっくりしたテンポの揺れ (単調増加を保つ)
+        speed = 1 + 0.2 * np.sin(np.linspace(0, rng.uniform(2, 6) * np.pi, length))
+        positions = np.cumsum(speed)
+        positions = (positions - positions[0]) / (positions[-1] - positions[0]) * (n - 1)
+        takes.append(_warp(ref_midi, positions, rng))
+    return takes
+
+
+def _excerpt_takes(ref_midi, n_takes, rng):
+    """曲の一部 (お手本の約1/4) だけを弾いた演奏の輪郭"""
+    n = len(ref_midi)
+    takes = []
+    for _ in range(n_takes):
+        start = int(rng.integers(0, n - n // 4))
+        length = max(8, int(n // 4 * rng.uniform(0.85, 1.15)))
+        takes.append(_warp(ref_midi, np.linspace(start, start + n // 4 - 1, length), rng))
+    return takes
+
+
+def _align_with_mode(mode, take, ref_midi, index):
+    """演奏(query)をお手本(reference)にアライメントする"""
+    if mode == "full":
+        return dtw_align(take, ref_midi)
+    if mode == "band":
+        return dtw_align(take, ref_midi, band_radius=max(32, len(take) // 10))
+    if mode == "multiscale":
+        return dtw_align(take, ref_midi, multiscale=True)
+    if mode == "full_open":
+        return dtw_align(take, ref_midi, open_begin=True, open_end=True)
+    if mode == "multiscale_open":
+        return dtw_align(take, ref_midi, open_begin=True, open_end=True, multiscale=True)
+    # phrase: 索引で候補区間を絞ってからアライメントする (pitch_analyzer と同じ手順)
+    best = None
+    for lo, hi in candidate_windows(index, take):
+        result = dtw_align(take, ref_midi[lo:hi], open_begin=True, open_end=True, multiscale=True)
+        if best is None or result.normalizedDistance < best.normalizedDistance:
+            best = result
+    return best or dtw_align(take, ref_midi, open_begin=True, open_end=True, multiscale=True)
+
+
+def benchmark_alignment(ref_lengths, n_takes, seed=0):
+    """
+    アライメント方式ごとの処理時間・メモリ・スコアを測る。
+    曲全体の演奏 (whole) は端点固定の方式で、曲の一部の演奏 (excerpt) は端点を開いた方式で比べる。
+    """
+    rng = np.random.default_rng(seed)
+    results = []
+    for n_frames in ref_lengths:
+        ref_midi = np.repeat(rng.integers(45, 75, size=n_frames // 8 + 1), 8)[:n_frames].astype(float)
+        ref_midi += rng.normal(0, 0.05, n_frames)
+        index = PhraseIndex.build(ref_midi)
+        scenarios = (
+            ("whole", _whole_takes(ref_midi, n_takes, rng), ALIGNMENT_MODES),
+            ("excerpt", _excerpt_takes(ref_midi, n_takes, rng), EXCERPT_ALIGNMENT_MODES),
+        )
+        for scenario, takes, modes in scenarios:
+            for mode in modes:
+                scores, latencies, peaks = [], [], []
+                for take in takes:
+                    alignment, seconds, peak_mb = _measure(_align_with_mode, mode, take, ref_midi, index)
+                    scores.append(_similarity_score(alignment.normalizedDistance))
+                    latencies.append(seconds)
+                    peaks.append(peak_mb)
+                record = {
+                    "scenario": scenario, "mode": mode, "ref_frames": n_frames, "takes": n_takes,
+                    "latency_sec": round(float(np.median(latencies)), 5),
+                    "peak_memory_mb": round(float(np.max(peaks)), 3),
+                    "score_mean": round(float(np.mean(scores)), 3),
+                    "score_std": round(float(np.std(scores)), 3),
+                }
+                results.append(record)
+                print(f"  {n_frames:>6} frames {scenario:>7} {mode:>15}: {record['latency_sec'] * 1000:8.1f} ms  "
+                      f"{record['peak_memory_mb']:7.2f} MB  score={record['score_mean']:.1f}±{record['score_std']:.1f}")
+    return results
+
+
+def benchmark_score_stability(engines, sr, n_takes, seed=0):
+    """同じフレーズを揺らぎ違いで弾いた音声を各エンジンで採点し、スコアのばらつきを見る"""
+    from pitch_analyzer import compare_pitch_contours
+
+    rng = np.random.default_rng(seed)
+    notes = rng.integers(45, 75, size=24)
+    ref_y, _ = note_sequence_signal(notes, 0.25, sr, gap_seconds=0.02, seed=seed)
+    results = []
+    for engine in engines:
+        ref_contour = _contour_from_signal(ref_y, sr, engine)
+        ref_contour.update(_phrase_arrays(ref_contour))
+        scores = []
+        for i in range(n_takes):
+            tempo = rng.uniform(0.9, 1.1)
+            detune = rng.uniform(-0.1, 0.1)
+            # お手本の1/3を弾いた演奏 (アプリと同じくフレーズ索引で位置を探す長さ)
+            take_y, _ = note_sequence_signal(notes[8:16] + detune, 0.25 * tempo, sr, gap_seconds=0.02, seed=seed + i + 1)
+            result, _ = compare_pitch_contours(_contour_from_signal(take_y, sr, engine), ref_contour)
+            if result is not None:
+                scores.append(result["score"])
+        results.append({
+            "engine": engine, "sr": sr, "takes": n_takes,
+            "score_mean": round(float(np.mean(scores)), 3) if scores else None,
+            "score_std": round(float(np.std(scores)), 3) if scores else None,
+            "failed": n_takes - len(scores),
+        })
+        print(f"  {engine:>5}: score={results[-1]['score_mean']}±{results[-1]['score_std']}")
+    return results
+
+
+def _contour_from_signal(y, sr, engine):
+    f0, voiced_flag = PITCH_ENGINES[engine](y, sr, PITCH_FMIN, PITCH_FMAX, HOP_LENGTH, FRAME_LENGTH)
+    return {
+        "f0": f0.astype(np.float32),
+        "voiced_flag": voiced_flag.astype(bool),
+        "times": librosa.times_like(f0, sr=sr, hop_length=HOP_LENGTH).astype(np.float32),
+        "midi": librosa.hz_to_midi(f0).astype(np.float32),
+    }
+
+
+def _phrase_arrays(contour):
+    return PhraseIndex.build(contour["midi"][contour["voiced_flag"]]).to_arrays()
+
+
+def compare_with_baseline(report, baseline):
+    """前回のレポートと比べて、処理時間とGPEの変化を表示する"""
+    previous = {(r["case"], r["engine"]): r for r in baseline.get("engines", [])}
+    print("\n=== 前回との比較 (エンジン) ===")
+    for record in report["engines"]:
+        old = previous.get((record["case"], record["engine"]))
+        if not old:
+            continue
+        ratio = record["latency_sec"] / old["latency_sec"] if old["latency_sec"] else float('nan')
+        gpe_delta = (record["gpe"] or 0) - (old["gpe"] or 0)
+        flag = "  ⚠️" if ratio > 1.2 or gpe_delta > 0.02 else ""
+        print(f"  {record['case']:>20} {record['engine']:>5}: 時間 x{ratio:.2f}  GPE {gpe_delta:+.3f}{flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ピッチ推定とアライメントのベンチマークを実行します。")
+    parser.add_argument("--out", default="bench_pitch.json", help="結果のJSONの出力先")
+    parser.add_argument("--engines", nargs="+", default=list(PITCH_ENGINES), help="計測するエンジン")
+    parser.add_argument("--durations", nargs="+", type=float, default=[2.0, 10.0, 30.0], help="音符列の長さ (秒)")
+    parser.add_argument("--sample-rates", nargs="+", type=int, default=[22050, 44100, 48000], help="サンプルレート")
+    parser.add_argument("--repeats", type=int, default=3, help="処理時間を測る回数 (中央値を採用)")
+    parser.add_argument("--quick", action="store_true", help="短い信号と少ない条件で素早く実行する")
+    parser.add_argument("--baseline", default=None, help="比較する前回のJSON")
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        args.durations, args.sample_rates, args.repeats = [2.0], [22050], 1
+    ref_lengths = [500, 2000] if args.quick else [1000, 5000, 20000]
+    n_takes = 3 if args.quick else 8
+
+    report = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "librosa": librosa.__version__,
+            "hop_length": HOP_LENGTH,
+            "frame_length": FRAME_LENGTH,
+            "gpe_threshold_cents": GPE_THRESHOLD_CENTS,
+        }
+    }
+
+    print("=== ピッチ推定エンジン ===")
+    report["engines"] = benchmark_engines(make_cases(args.durations, args.sample_rates), args.engines, args.repeats)
+    print("=== アライメント ===")
+    report["alignment"] = benchmark_alignment(ref_lengths, n_takes)
+    print("=== スコアの安定性 ===")
+    report["score_stability"] = benchmark_score_stability(args.engines, args.sample_rates[0], n_takes)
+
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n結果を {args.out} に保存しました。")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            compare_with_baseline(report, json.load(f))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
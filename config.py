@@ -14,6 +14,8 @@ GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
 # モデル名
 EMBEDDING_MODEL = "models/embedding-001"
+# 埋め込みのバックエンド: "google" (EMBEDDING_MODEL をAPIで呼ぶ) / "local" (文字n-gramのハッシュ、オフライン)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "google")
 CHAT_MODEL = "gemini-2.5-flash"
 
 # Geminiの安全設定
@@ -0,0 +1,176 @@
+# contour_cache.py
+"""
+お手本音源のピッチ輪郭(f0・有声フラグ・時間軸・MIDI)をディスクにキャッシュするモジュール。
+
+キーは「ファイル内容のハッシュ + 解析パラメータ」で決まり、配列は .npy 形式で保存して
+メモリマップで読み込む。同じ音源でも解析パラメータ (エンジンなど) ごとに1件ずつエントリを保持するので、
+エンジンを切り替えても再解析しない。ステムの内容が変わると、同じパラメータの古いエントリだけが削除される。
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+
+# キャッシュの保存先 (separated_audio などと同じくカレントディレクトリ基準)
+CACHE_DIR = os.path.join('cache', 'contours')
+META_FILENAME = 'meta.json'
+# キャッシュ形式を変更した場合はこの値を上げて古いエントリを無効化する
+CACHE_VERSION = 1
+
+_HASH_BLOCK_SIZE = 1 << 20
+
+# (絶対パス, サイズ, 更新時刻) -> 内容ハッシュ。同一プロセス内での再ハッシュを避ける
+_content_hash_memo = {}
+_memo_lock = threading.Lock()
+
+
+def file_content_hash(path):
+    """ファイル内容のSHA-256を返す。サイズと更新時刻が同じ間はプロセス内で再計算しない。"""
+    abs_path = os.path.abspath(path)
+    stat = os.stat(abs_path)
+    memo_key = (abs_path, stat.st_size, stat.st_mtime_ns)
+    with _memo_lock:
+        cached = _content_hash_memo.get(memo_key)
+    if cached is not None:
+        return cached
+
+    digest = hashlib.sha256()
+    with open(abs_path, 'rb') as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    content_hash = digest.hexdigest()
+
+    with _memo_lock:
+        _content_hash_memo[memo_key] = content_hash
+    return content_hash
+
+
+def cache_key(content_hash, params):
+    """内容ハッシュと解析パラメータからキャッシュキーを生成する。"""
+    payload = json.dumps(
+        {"version": CACHE_VERSION, "content": content_hash, "params": params},
+        sort_keys=True, ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+def _source_dir(path, cache_dir):
+    """音源パスごとのキャッシュディレクトリ。エントリは常に最新の1件だけを保持する。"""
+    source_id = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, source_id)
+
+
+def _load_entry(entry_dir):
+    """エントリの配列をメモリマップで読み込む。壊れていれば None を返す。"""
+    try:
+        with open(os.path.join(entry_dir, META_FILENAME), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        return {
+            name: np.load(os.path.join(entry_dir, f"{name}.npy"), mmap_mode='r')
+            for name in meta["arrays"]
+        }
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _write_entry(source_dir, key, arrays, meta):
+    """一時ディレクトリに書き出してからリネームし、書きかけのエントリを残さない。"""
+    os.makedirs(source_dir, exist_ok=True)
+    entry_dir = os.path.join(source_dir, key)
+    tmp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=source_dir)
+    try:
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), np.ascontiguousarray(array))
+        with open(os.path.join(tmp_dir, META_FILENAME), 'w', encoding='utf-8') as f:
+            json.dump(dict(meta, arrays=sorted(arrays)), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_dir, entry_dir)
+    except OSError:
+        # 別プロセスが同じエントリを先に書き終えた場合など
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if not os.path.isdir(entry_dir):
+            raise
+    return entry_dir
+
+
+def _params_json(params):
+    """meta.json に保存したパラメータと比較できる形 (JSONで往復した値)"""
+    return json.loads(json.dumps(params, sort_keys=True, ensure_ascii=False, default=str))
+
+
+def drop_stale_entries(source_dir, keep_key, params=None):
+    """
+    音源の内容 (やキャッシュ形式) が変わって使われなくなったエントリを削除する。
+    params を指定した場合は、同じパラメータで作られた古いエントリだけを削除し、
+    別のパラメータ (エンジン) のエントリは残す。None ならキー以外の全てのエントリを削除する。
+    """
+    wanted = None if params is None else _params_json(params)
+    for name in os.listdir(source_dir):
+        if name == keep_key or name.startswith('.tmp-'):
+            continue
+        entry_dir = os.path.join(source_dir, name)
+        if wanted is not None:
+            try:
+                with open(os.path.join(entry_dir, META_FILENAME), 'r', encoding='utf-8') as f:
+                    if json.load(f).get("params") != wanted:
+                        continue
+            except (OSError, ValueError, AttributeError):
+                pass  # meta.json が読めないエントリは壊れているので削除する
+        shutil.rmtree(entry_dir, ignore_errors=True)
+
+
+def entry_path(path, params, cache_dir=CACHE_DIR):
+    """path と params に対応するエントリのディレクトリ (存在するとは限らない)。"""
+    return os.path.join(_source_dir(path, cache_dir), cache_key(file_content_hash(path), params))
+
+
+def load_cached(path, params, cache_dir=CACHE_DIR):
+    """
+    キャッシュ済みの配列 (メモリマップ) を返す。無いか壊れている場合は計算せずに None を返す。
+    解析を別プロセスに任せる前に、呼び出し元のプロセスでキャッシュを確認するために使う。
+    """
+    entry_dir = entry_path(path, params, cache_dir)
+    if not os.path.isdir(entry_dir):
+        return None
+    arrays = _load_entry(entry_dir)
+    if arrays is None:
+        shutil.rmtree(entry_dir, ignore_errors=True)
+    return arrays
+
+
+def load_or_compute(path, params, compute, cache_dir=CACHE_DIR):
+    """
+    キャッシュ済みの配列を返す。無ければ compute(path) で計算して保存する。
+
+    :param path: 解析対象の音声ファイルのパス
+    :param params: 解析パラメータ (fmin/fmax/hop/sr など)。キーの一部になる
+    :param compute: path を受け取り {名前: ndarray} を返す関数。失敗時は None
+    :return: {名前: ndarray(メモリマップ)}。計算に失敗した場合は None
+    """
+    key = cache_key(file_content_hash(path), params)
+    source_dir = _source_dir(path, cache_dir)
+    entry_dir = os.path.join(source_dir, key)
+
+    if os.path.isdir(entry_dir):
+        arrays = _load_entry(entry_dir)
+        if arrays is not None:
+            return arrays
+        shutil.rmtree(entry_dir, ignore_errors=True)
+
+    arrays = compute(path)
+    if arrays is None:
+        return None
+
+    meta = {"key": key, "source": os.path.abspath(path), "params": params}
+    try:
+        entry_dir = _write_entry(source_dir, key, arrays, meta)
+        drop_stale_entries(source_dir, key, params)
+    except OSError as e:
+        # キャッシュに書けなくても解析結果はそのまま返す
+        print(f"Error writing contour cache: {e}")
+        return arrays
+    return _load_entry(entry_dir) or arrays
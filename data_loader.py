@@ -7,18 +7,25 @@ import re
 import json # JSONを扱うためにインポート
 
 # 練習フレーズのデータ
+# start_sec / end_sec: 練習する区間 (秒)。音源分離はこの区間だけに対して行う。None の場合は曲の先頭/末尾まで
 PRACTICE_PHRASES = {
     "B'z 松本孝弘": {
         "title": "ultra soul",
         "youtube_url": "https://www.youtube.com/watch?v=P53EuU4-p8Y&list=RDP53EuU4-p8Y&start_radio=1",
+        "start_sec": None,
+        "end_sec": None,
     },
     "布袋寅泰": {
         "title": "スリル",
         "youtube_url": "https://www.youtube.com/watch?v=iGDNw605DsU&list=RDiGDNw605DsU&start_radio=1",
+        "start_sec": None,
+        "end_sec": None,
     },
     "結束バンド 後藤ひとり": {
         "title": "忘れてやらない",
         "youtube_url": "https://www.youtube.com/watch?v=NDjzwtJWJy0&list=RDNDjzwtJWJy0&start_radio=1",
+        "start_sec": None,
+        "end_sec": None,
     }
 }
 
@@ -0,0 +1,276 @@
+# embedding_service.py
+"""
+埋め込みベクトルのキャッシュ。RAGSystem と GuitarEquipmentAgent が同じインスタンスを共有する。
+
+キーは「正規化したテキスト + モデル名 (+ 文書/クエリの区別)」のハッシュで、ベクトルはローカルの SQLite に保存する。
+同じ機材の説明がカテゴリ別・すべて・エージェント用のインデックスに重複して含まれていても、
+埋め込みAPIを呼ぶのは一度も計算したことのないテキストだけで、それもまとめて (EMBED_BATCH_SIZE 件ずつ) 呼ぶ。
+
+config.EMBEDDING_BACKEND = "local" (環境変数 EMBEDDING_BACKEND) にすると、APIを使わずに
+文字 n-gram のハッシュで埋め込む (HashingEmbeddings)。ネットワークもAPIキーも不要で、
+数千チャンクでも数ミリ秒で埋め込めるので、オフラインでの起動や検索のテストに使える。
+
+    embeddings = get_embedding_service()          # langchain の Embeddings として使える
+    FAISS.from_documents(documents, embeddings)
+"""
+
+import functools
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# キャッシュの保存先 (contour_cache などと同じく cache/ 以下)
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE", os.path.join('cache', 'embeddings.sqlite3'))
+# 1回のAPI呼び出しで埋め込むテキストの最大数 (Gemini の batchEmbedContents の上限)
+EMBED_BATCH_SIZE = 100
+# ローカル埋め込み (文字 n-gram のハッシュ) の次元数と n-gram の長さ
+LOCAL_EMBEDDING_DIM = 1024
+LOCAL_NGRAM_RANGE = (1, 3)
+# 埋め込みの計算方法を変えた場合はこの値を上げる (モデル名に含まれ、保存済みのインデックスが作り直される)
+LOCAL_EMBEDDING_VERSION = 1
+
+_HASH_MULTIPLIER = np.uint64(0x100000001B3)
+_MIX_MULTIPLIER = np.uint64(0xFF51AFD7ED558CCD)
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def normalize_text(text):
+    """全角/半角と空白の表記ゆれを吸収したテキスト (キャッシュのキー、かつ実際に埋め込むテキスト)"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def embedding_key(text, model_name, kind="document"):
+    """正規化済みのテキストとモデル名からキャッシュのキーを生成する。kind は "document" か "query" """
+    return hashlib.sha256(f"{model_name}\0{kind}\0{text}".encode('utf-8')).hexdigest()
+
+
+def _google_embeddings(model_name):
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+    return GoogleGenerativeAIEmbeddings(model=model_name)
+
+
+def _mix(h):
+    """下位ビットまでよく混ざるようにする (MurmurHash3 の最終処理)"""
+    h = h ^ (h >> np.uint64(33))
+    h = h * _MIX_MULTIPLIER
+    return h ^ (h >> np.uint64(33))
+
+
+@functools.lru_cache(maxsize=None)
+def _fold_tables():
+    """
+    文字コードごとの正規化表 (NFKC + casefold、空白は半角スペース) と、濁点・半濁点の合成表。
+    NFKC で1文字になるもの (全角英数・半角カナ・大文字など) だけを置き換える。初回に一度だけ作る (数十ms)。
+    """
+    table = np.arange(0x10000, dtype=np.uint32)
+    for code in range(0x10000):
+        if 0xD800 <= code < 0xE000:
+            continue
+        char = chr(code)
+        if char.isspace():
+            table[code] = 0x20
+            continue
+        folded = unicodedata.normalize("NFKC", char).casefold()
+        if len(folded) == 1:
+            table[code] = ord(folded)
+    table[0] = 0  # テキストの区切り
+    # 半角カナの濁点・半濁点 (U+3099/U+309A) を直前のかなと合成した文字。合成できなければ 0
+    voiced = np.zeros((2, 0x100), dtype=np.uint32)
+    for code in range(0x3000, 0x3100):
+        for m, mark in enumerate("\u3099\u309a"):
+            composed = unicodedata.normalize("NFC", chr(code) + mark)
+            if len(composed) == 1:
+                voiced[m, code - 0x3000] = ord(composed)
+    return table, voiced
+
+
+def _fold_codes(codes):
+    """
+    文字コードの配列を normalize_text(text).casefold() 相当に正規化する (NumPy でまとめて処理する)。
+    unicodedata.normalize を大量の日本語テキストにかけるより1桁速い。
+    """
+    table, voiced = _fold_tables()
+    codes = np.where(codes < 0x10000, table[np.minimum(codes, 0xFFFF)], codes)
+    keep = np.ones(len(codes), dtype=bool)
+
+    marks = np.flatnonzero((codes[1:] == 0x3099) | (codes[1:] == 0x309A)) + 1
+    if len(marks):
+        previous = codes[marks - 1]
+        composable = (previous >= 0x3000) & (previous < 0x3100)
+        composed = np.zeros(len(marks), dtype=np.uint32)
+        composed[composable] = voiced[codes[marks[composable]] - 0x3099, previous[composable] - 0x3000]
+        merged = composed > 0
+        codes[marks[merged] - 1] = composed[merged]
+        keep[marks[merged]] = False
+
+    # 連続する空白は1つにする
+    space = codes == 0x20
+    keep[1:] &= ~(space[1:] & space[:-1])
+    return codes[keep]
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    文字 n-gram のハッシュによるローカル埋め込み (APIを使わない)。
+    日本語の製品名・説明は単語に分かち書きしなくても、カタカナ・英字の部分文字列 (「ディスト」「marshall」など)
+    がそのまま特徴になる。全角/半角・大文字/小文字は正規化してから n-gram を取り、出現数を log(1+tf) にして
+    L2 正規化する。バッチ全体をまとめて NumPy で処理し、テキストごとの Python のループは無い。
+    """
+
+    def __init__(self, dim=LOCAL_EMBEDDING_DIM, ngram_range=LOCAL_NGRAM_RANGE):
+        self.dim = dim
+        self.ngram_range = ngram_range
+        self.model_name = f"local-char-ngram-{ngram_range[0]}-{ngram_range[1]}-{dim}-v{LOCAL_EMBEDDING_VERSION}"
+
+    def embed_matrix(self, texts):
+        """texts を (テキスト数, dim) の float32 配列に埋め込む"""
+        n = len(texts)
+        # バッチ全体を1つの配列にして正規化する (テキストの区切りは NUL)
+        codes = _fold_codes(np.frombuffer("\0".join(texts).encode('utf-32-le'), dtype=np.uint32))
+        separator = codes == 0
+        owner = np.cumsum(separator)[~separator]
+        flat = codes[~separator].astype(np.uint64)
+
+        rows = []
+        for size in range(self.ngram_range[0], self.ngram_range[1] + 1):
+            windows = len(flat) - size + 1
+            if windows <= 0:
+                continue
+            # 長さの違う n-gram が同じハッシュにならないよう、長さを初期値に入れる
+            h = np.full(windows, np.uint64(size))
+            for k in range(size):
+                h = (h * _HASH_MULTIPLIER) ^ flat[k:k + windows]
+            # 2つのテキストにまたがる n-gram は除く
+            inside = owner[:windows] == owner[size - 1:]
+            buckets = (_mix(h[inside]) % np.uint64(self.dim)).astype(np.int64)
+            rows.append(owner[:windows][inside] * self.dim + buckets)
+
+        flat_index = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+        vectors = np.bincount(flat_index, minlength=n * self.dim).astype(np.float32).reshape(n, self.dim)
+        np.log1p(vectors, out=vectors)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors
+
+    def embed_documents(self, texts):
+        return self.embed_matrix(list(texts)).tolist()
+
+    def embed_query(self, text):
+        return self.embed_matrix([text])[0].tolist()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    ディスクキャッシュ付きの埋め込み。キャッシュに無いテキストだけを base でまとめて埋め込む。
+    stats には、このプロセスでのキャッシュのヒット数・ミス数・API呼び出し回数を記録する。
+    """
+
+    def __init__(self, model_name, base=None, path=EMBEDDING_CACHE_PATH, batch_size=EMBED_BATCH_SIZE):
+        """
+        :param model_name: 埋め込みモデル名。キーの一部になる
+        :param base: 実際に埋め込む Embeddings。省略時は Google の埋め込みモデル (初回のミス時に作成)
+        :param path: SQLite ファイルのパス
+        """
+        self.model_name = model_name
+        self.path = path
+        self.batch_size = batch_size
+        self.stats = {"hits": 0, "misses": 0, "calls": 0}
+        self._base = base
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, model TEXT, dim INTEGER, vector BLOB)"
+        )
+        self._db.commit()
+
+    @property
+    def base(self):
+        if self._base is None:
+            self._base = _google_embeddings(self.model_name)
+        return self._base
+
+    def _lookup(self, keys):
+        found = {}
+        # SQLite のパラメータ数の上限を超えないよう分けて問い合わせる
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self._db.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+            )
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def _store(self, items):
+        self._db.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, model, dim, vector) VALUES (?, ?, ?, ?)",
+            [(key, self.model_name, len(vector), np.asarray(vector, dtype=np.float32).tobytes())
+             for key, vector in items]
+        )
+        self._db.commit()
+
+    def _embed(self, texts, kind):
+        normalized = [normalize_text(text) for text in texts]
+        keys = [embedding_key(text, self.model_name, kind) for text in normalized]
+        with self._lock:
+            vectors = self._lookup(sorted(set(keys)))
+            # 重複を除いたミスだけを、順番を保ってまとめて埋め込む
+            missing = {key: text for key, text in zip(keys, normalized) if key not in vectors}
+            self.stats["hits"] += len(keys) - sum(1 for key in keys if key in missing)
+            self.stats["misses"] += len(missing)
+            missing_keys, missing_texts = list(missing), list(missing.values())
+            for start in range(0, len(missing_texts), self.batch_size):
+                batch = missing_texts[start:start + self.batch_size]
+                if kind == "query":
+                    # クエリ用の埋め込み (task_type が異なる) は1件ずつしか呼べない
+                    embedded = [self.base.embed_query(text) for text in batch]
+                    self.stats["calls"] += len(batch)
+                else:
+                    embedded = self.base.embed_documents(batch)
+                    self.stats["calls"] += 1
+                batch_keys = missing_keys[start:start + self.batch_size]
+                self._store(zip(batch_keys, embedded))
+                vectors.update((key, np.asarray(vector, dtype=np.float32)) for key, vector in zip(batch_keys, embedded))
+        return [vectors[key].tolist() for key in keys]
+
+    def embed_documents(self, texts):
+        return self._embed(list(texts), "document")
+
+    def embed_query(self, text):
+        return self._embed([text], "query")[0]
+
+
+def get_embedding_service(model_name=None, path=EMBEDDING_CACHE_PATH, backend=None):
+    """
+    プロセスで共有する埋め込みを返す (バックエンドとモデル名ごとに1つ)。
+    返り値の model_name 属性は保存済みインデックスのキーに使う。
+
+    :param model_name: APIの埋め込みモデル名。既定値は config.EMBEDDING_MODEL
+    :param backend: "google" (API + ディスクキャッシュ) か "local" (HashingEmbeddings)。既定値は config.EMBEDDING_BACKEND
+    """
+    if model_name is None or backend is None:
+        import config
+        model_name = model_name or config.EMBEDDING_MODEL
+        backend = backend or config.EMBEDDING_BACKEND
+    if backend not in ("google", "local"):
+        raise ValueError(f"未対応の埋め込みバックエンドです: {backend} (google / local)")
+
+    with _services_lock:
+        key = ("local",) if backend == "local" else (backend, model_name, path)
+        service = _services.get(key)
+        if service is None:
+            # ローカル埋め込みはキャッシュを引くより計算し直すほうが速いので、ディスクキャッシュを通さない
+            service = HashingEmbeddings() if backend == "local" else CachedEmbeddings(model_name, path=path)
+            _services[key] = service
+        return service
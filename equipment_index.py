@@ -0,0 +1,192 @@
+# equipment_index.py
+"""
+全ギタリスト・全カテゴリの機材をまとめた1つのベクトルインデックス。
+
+ドキュメントは (ギタリスト, カテゴリ) の順に並べてから追加するので、どの組み合わせも
+インデックス上の連続した区間になる。ギタリストとカテゴリは列ごとの配列 (メタデータ) として持ち、
+絞り込み検索は区間 (IDSelectorRange)、連続しない組み合わせはビットマップ (IDSelectorBitmap) で行う。
+カテゴリ別・「すべて」・エージェント用にインデックスを分けないため、メモリは機材の数だけに比例する。
+
+    index = get_equipment_index(embeddings, EMBEDDING_MODEL)
+    index.search("ハードロック 歪み", k=5, guitarist="B'z 松本孝弘", category="エフェクター")
+    index.hybrid_search("Firebird", k=5, guitarist="B'z 松本孝弘")   # BM25 + ベクトル (製品名そのものなら埋め込み不要)
+    index.as_retriever("B'z 松本孝弘", "すべて")
+"""
+
+import threading
+from typing import Any, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from lexical_index import LexicalIndex, reciprocal_rank_fusion
+from vector_index import load_or_build_index
+
+# 並び順 (この順に区間が並ぶ)。ここに無いカテゴリは末尾にまとめる
+CATEGORIES = ["ギター", "アンプ", "エフェクター"]
+# 「すべて」は絞り込みなし (ギタリストのみ)
+ALL_CATEGORIES = "すべて"
+# RAG用のチャンク分割
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 50
+INDEX_NAME = "equipment"
+# ハイブリッド検索で融合する前に、BM25 とベクトル検索のそれぞれから取る件数 (k の何倍か、最低何件か)
+HYBRID_DEPTH_FACTOR = 4
+HYBRID_MIN_DEPTH = 20
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def _validate(guitarist, documents):
+    for i, doc in enumerate(documents):
+        if not isinstance(doc.page_content, str):
+            raise TypeError(
+                f"データ検証エラー: ギタリスト '{guitarist}' のデータに問題があります。\n"
+                f"ドキュメントNo.{i} の page_content が文字列ではなく、{type(doc.page_content)} 型になっています。\n"
+                f"問題のデータ内容: {doc.page_content}\n"
+                f"data_loader.py または元のデータファイルを確認してください。"
+            )
+
+
+def _text_splitter():
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+
+
+class EquipmentIndex:
+    """全機材のベクトルインデックスと、ギタリスト・カテゴリの列"""
+
+    def __init__(self, documents_by_guitarist, embeddings, model_name, text_splitter=None, index_dir=None):
+        """
+        :param documents_by_guitarist: {ギタリスト名: [Document]} (data_loader.get_equipment_data の戻り値)
+        :param embeddings: 埋め込みモデル (embedding_service の共有インスタンスなど)
+        :param model_name: 埋め込みモデル名 (保存済みインデックスのキー)
+        :param text_splitter: チャンク分割。None ならチャンク分割しない
+        """
+        self.guitarists = list(documents_by_guitarist)
+        self.embeddings = embeddings
+
+        rows = []
+        for g, guitarist in enumerate(self.guitarists):
+            documents = documents_by_guitarist[guitarist]
+            _validate(guitarist, documents)
+            if text_splitter is not None:
+                documents = text_splitter.split_documents(documents)
+            for doc in documents:
+                category = doc.metadata.get("category")
+                c = CATEGORIES.index(category) if category in CATEGORIES else len(CATEGORIES)
+                rows.append((g, c, Document(page_content=doc.page_content, metadata=dict(doc.metadata, guitarist=guitarist))))
+        # 安定ソートなので、同じ区間の中では元の (ファイルの) 順番を保つ
+        rows.sort(key=lambda row: (row[0], row[1]))
+
+        self.documents = [row[2] for row in rows]
+        self.guitarist_codes = np.array([row[0] for row in rows], dtype=np.int16)
+        self.category_codes = np.array([row[1] for row in rows], dtype=np.int16)
+        self.index = None
+        if self.documents:
+            kwargs = {} if index_dir is None else {"index_dir": index_dir}
+            self.index = load_or_build_index(INDEX_NAME, self.documents, embeddings, model_name, **kwargs).index
+        # 同じ並び (文書ID) の BM25 インデックス。構築は埋め込みと違ってすぐ終わるので保存しない
+        self.lexical = LexicalIndex(self.documents)
+
+    def __len__(self):
+        return len(self.documents)
+
+    def mask(self, guitarist=None, category=None):
+        """条件に合う行の真偽値配列。category は1つの名前か名前のリスト (「すべて」/None は絞り込みなし)"""
+        mask = np.ones(len(self.documents), dtype=bool)
+        if guitarist is not None:
+            if guitarist not in self.guitarists:
+                return np.zeros_like(mask)
+            mask &= self.guitarist_codes == self.guitarists.index(guitarist)
+        if category is not None and category != ALL_CATEGORIES:
+            categories = [category] if isinstance(category, str) else list(category)
+            codes = [CATEGORIES.index(c) for c in categories if c in CATEGORIES]
+            mask &= np.isin(self.category_codes, codes)
+        return mask
+
+    def _selector(self, mask):
+        """mask に合う行だけを検索する SearchParameters (全件なら None)"""
+        import faiss
+
+        ids = np.flatnonzero(mask)
+        if len(ids) == len(mask):
+            return None
+        if ids[-1] - ids[0] + 1 == len(ids):
+            selector = faiss.IDSelectorRange(int(ids[0]), int(ids[-1]) + 1)
+        else:
+            bits = np.packbits(mask, bitorder='little')
+            selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bits))
+            selector.referenced_bits = bits  # 検索が終わるまでビット列を解放させない
+        return faiss.SearchParameters(sel=selector)
+
+    def _vector_search(self, query, k, mask):
+        """mask の範囲から query に近い順に (文書ID, L2距離) を最大 k 件返す"""
+        n = int(mask.sum())
+        if self.index is None or n == 0:
+            return []
+        vector = np.asarray([self.embeddings.embed_query(query)], dtype=np.float32)
+        distances, ids = self.index.search(vector, min(k, n), params=self._selector(mask))
+        return [(int(i), float(d)) for i, d in zip(ids[0], distances[0]) if i >= 0]
+
+    def search_with_scores(self, query, k=5, guitarist=None, category=None):
+        """絞り込んだ範囲から query に近い順に (Document, L2距離) を最大 k 件返す (ベクトル検索のみ)"""
+        return [(self.documents[i], d) for i, d in self._vector_search(query, k, self.mask(guitarist, category))]
+
+    def search(self, query, k=5, guitarist=None, category=None):
+        return [doc for doc, _ in self.search_with_scores(query, k, guitarist, category)]
+
+    def hybrid_search(self, query, k=5, guitarist=None, category=None):
+        """
+        BM25 とベクトル検索の結果を Reciprocal Rank Fusion でまとめて最大 k 件返す。
+        クエリが製品名そのもの (または1製品だけの型番) の場合は埋め込みを使わず、
+        一致した機材 (足りなければ BM25 の上位) を返す。
+        """
+        mask = self.mask(guitarist, category)
+        if not mask.any():
+            return []
+        depth = max(k * HYBRID_DEPTH_FACTOR, HYBRID_MIN_DEPTH)
+        lexical_ids = [doc_id for doc_id, _ in self.lexical.search(query, depth, mask)]
+
+        exact = self.lexical.name_matches(query, mask)
+        if exact:
+            matched = set(exact)
+            ranked = exact + [doc_id for doc_id in lexical_ids if doc_id not in matched]
+        else:
+            vector_ids = [doc_id for doc_id, _ in self._vector_search(query, depth, mask)]
+            # 同点 (BM25 とベクトルで1位と2位が入れ替わっている場合など) は語句が一致する BM25 側を優先する
+            ranked = reciprocal_rank_fusion([lexical_ids, vector_ids])
+        return [self.documents[doc_id] for doc_id in ranked[:k]]
+
+    def as_retriever(self, guitarist, category=ALL_CATEGORIES, k=5, hybrid=True):
+        return EquipmentRetriever(equipment_index=self, guitarist=guitarist, category=category, k=k, hybrid=hybrid)
+
+
+class EquipmentRetriever(BaseRetriever):
+    """共有インデックスをギタリスト・カテゴリで絞り込んで検索するリトリーバー"""
+    equipment_index: Any
+    guitarist: Optional[str] = None
+    category: Optional[str] = None
+    k: int = 5
+    hybrid: bool = True
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        if self.hybrid:
+            return self.equipment_index.hybrid_search(query, self.k, self.guitarist, self.category)
+        return self.equipment_index.search(query, self.k, self.guitarist, self.category)
+
+
+def get_equipment_index(embeddings, model_name):
+    """
+    プロセスで共有する機材インデックスを返す (RAGSystem と GuitarEquipmentAgent で1つ)。
+    機材データは data_loader から全ギタリスト分を読み込み、チャンク分割する。
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            from data_loader import EQUIPMENT_FILES, get_equipment_data
+            documents = {guitarist: get_equipment_data(guitarist) for guitarist in EQUIPMENT_FILES}
+            _index = EquipmentIndex(documents, embeddings, model_name, text_splitter=_text_splitter())
+        return _index
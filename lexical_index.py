@@ -0,0 +1,136 @@
+# lexical_index.py
+"""
+機材カタログの転置インデックス (BM25) と、ベクトル検索との順位の融合 (Reciprocal Rank Fusion)。
+
+ベクトル検索だけでは「Tak Matsumoto DC」「Firebird」のような型番・製品名の完全一致を取りこぼすので、
+語彙による検索を組み合わせる。トークンは英数字の単語と、日本語 (かな・漢字) の文字バイグラム。
+BM25 の重みは構築時に (トークン → 文書ID, 重み) の形で計算しておくので、検索はクエリのトークンごとに
+配列を足し合わせるだけで済む (マイクロ秒単位)。クエリが製品名そのもの (または1製品だけの型番) なら
+埋め込みを使わずに返せる。
+
+    lexical = LexicalIndex(documents)
+    lexical.search("firebird", k=5)            # [(文書ID, BM25スコア), ...]
+    reciprocal_rank_fusion([vector_ids, lexical_ids])
+"""
+
+import re
+
+import numpy as np
+
+from embedding_service import normalize_text
+
+# BM25 のパラメータ (一般的な既定値)
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Reciprocal Rank Fusion の定数 (順位 r の文書に 1 / (RRF_K + r) を加える)
+RRF_K = 60
+# 型番の一致で埋め込みを省略するクエリの最短の長さ (「dc」1語だけなどでは省略しない)
+MIN_NAME_QUERY_LENGTH = 3
+
+_LATIN_WORD = re.compile(r"[a-z0-9]+")
+# 型番とみなすクエリ (数字を含む1語。「JCM800」「2203」「TS-9」など)
+_MODEL_NUMBER = re.compile(r"[a-z0-9\-]*[0-9][a-z0-9\-]*")
+_JAPANESE_RUN = re.compile(r"[^\W\x00-\x7f]+")
+
+
+def normalize(text):
+    """検索用の正規化 (全角/半角・大文字/小文字・空白)"""
+    return normalize_text(text).casefold()
+
+
+def tokenize(text):
+    """英数字は単語、日本語は文字バイグラム (1文字だけの語はその文字) に分ける"""
+    text = normalize(text)
+    tokens = _LATIN_WORD.findall(text)
+    for run in _JAPANESE_RUN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """
+    複数の順位リスト (文書IDのリスト、良い順) を Reciprocal Rank Fusion で1つにまとめる。
+    スコアが同じ文書は、rankings の先のリストで先に出てきたものを上にする。
+    :return: 融合後のスコアの高い順の文書IDのリスト
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=lambda doc_id: -scores[doc_id])
+
+
+class LexicalIndex:
+    """Document のリストに対する BM25 の転置インデックス。文書IDはリストの添字"""
+
+    def __init__(self, documents, k1=BM25_K1, b=BM25_B):
+        self.size = len(documents)
+        postings = {}
+        lengths = np.zeros(self.size, dtype=np.float32)
+        self._names = {}
+        for doc_id, doc in enumerate(documents):
+            tokens = tokenize(doc.page_content)
+            lengths[doc_id] = len(tokens)
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                postings.setdefault(token, []).append((doc_id, count))
+            name = doc.metadata.get("name")
+            if name:
+                self._names.setdefault(normalize(name), []).append(doc_id)
+
+        # トークンごとに (文書ID, その文書での BM25 の重み) を計算しておく
+        average_length = max(float(lengths.mean()), 1.0) if self.size else 1.0
+        self._weights = {}
+        for token, entries in postings.items():
+            ids = np.array([doc_id for doc_id, _ in entries], dtype=np.int64)
+            tf = np.array([count for _, count in entries], dtype=np.float32)
+            idf = np.log(1.0 + (self.size - len(ids) + 0.5) / (len(ids) + 0.5))
+            norm = k1 * (1.0 - b + b * lengths[ids] / average_length)
+            self._weights[token] = (ids, (idf * tf * (k1 + 1.0) / (tf + norm)).astype(np.float32))
+
+    def scores(self, query):
+        """全文書に対する query の BM25 スコアの配列"""
+        scores = np.zeros(self.size, dtype=np.float32)
+        for token in set(tokenize(query)):
+            posting = self._weights.get(token)
+            if posting is not None:
+                ids, weights = posting
+                scores[ids] += weights
+        return scores
+
+    def search(self, query, k=5, mask=None):
+        """BM25 スコアの高い順に (文書ID, スコア) を最大 k 件返す。mask があればその範囲だけ"""
+        scores = self.scores(query)
+        if mask is not None:
+            scores[~mask] = 0.0
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        order = candidates[np.argsort(-scores[candidates], kind='stable')]
+        return [(int(doc_id), float(scores[doc_id])) for doc_id in order]
+
+    def name_matches(self, query, mask=None):
+        """
+        製品名が一致する文書IDのリスト (BM25 スコア順)。次のどちらかなら一致とみなす。
+        - 正規化したクエリが製品名全体と等しい (「Gibson Tak Matsumoto Firebird」など)
+        - クエリが型番で、それを単語単位で含む製品名が1つだけ (「JCM800」など)
+        「Gibson」「Marshall」のような多くの製品名に含まれうる語は一致とみなさず、ベクトル検索に回す
+        """
+        text = normalize(query)
+        matched = self._names.get(text)
+        if matched is None and len(text) >= MIN_NAME_QUERY_LENGTH and _MODEL_NUMBER.fullmatch(text):
+            phrase = re.compile(r"(?<![a-z0-9])" + re.escape(text) + r"(?![a-z0-9])")
+            names = [name for name in self._names if phrase.search(name)]
+            if len(names) == 1:
+                matched = self._names[names[0]]
+        if not matched:
+            return []
+        if mask is not None:
+            matched = [doc_id for doc_id in matched if mask[doc_id]]
+        scores = self.scores(query)
+        return sorted(set(matched), key=lambda doc_id: (-scores[doc_id], doc_id))
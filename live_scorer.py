@@ -0,0 +1,288 @@
+# live_scorer.py
+"""
+演奏中にリアルタイムで採点するストリーミング採点器。
+
+音声をブロック (例: 1024 サンプル) ごとに受け取ってリングバッファに溜め、フレームが揃うたびに
+ピッチを推定する (pitch_engines の acf と同じ窓・同じパワースペクトルの自己相関)。
+推定したピッチはキャッシュ済みのお手本の輪郭に対してオンラインDTWでアライメントする。
+DTWは1行 (お手本の長さ分) の累積コストだけを持ち、現在位置の周囲の窓だけを更新するので、
+メモリは演奏の長さに依存せず、1フレームあたりの計算量も窓の幅で決まる。
+
+    scorer = LiveScorer(load_reference_contour("reference_audio/<動画ID>.flac"), input_sr=48000)
+    for block in audio_blocks:
+        for update in scorer.feed(block):
+            print(update.position_sec, update.pitch_error, update.score)
+
+WAVファイルを実時間で流して確認するには:
+    python live_scorer.py take.wav reference_audio/<動画ID>.flac --realtime
+"""
+
+import argparse
+import collections
+import sys
+import time
+from dataclasses import dataclass
+
+import numpy as np
+import soundfile as sf
+
+from pitch_analyzer import HOP_LENGTH, PITCH_FMAX, PITCH_FMIN, _similarity_score, load_reference_contour
+from pitch_engines import FRAME_LENGTH, acf_pitch_from_power
+
+# リングバッファの長さ (秒)。1回に渡されるブロックはこれより短く分けて処理する
+RING_SECONDS = 2.0
+# 最初にこのフレーム数 (有声) の間は、お手本全体から開始位置を探す
+WARMUP_FRAMES = 20
+# 追従中に更新する窓: 現在位置から前後何秒か
+WINDOW_BACK_SEC = 0.5
+WINDOW_AHEAD_SEC = 2.0
+# 直近のピッチ誤差の平均がこの半音数を超えたら、見失ったとみなしてお手本全体から探し直す
+RELOCK_ERROR_SEMITONES = 3.0
+RELOCK_FRAMES = 40
+
+
+@dataclass
+class LiveUpdate:
+    """
+    1フレームごとの採点結果。
+    time_sec は演奏の先頭からの時刻、position_sec は対応するお手本の時刻 (まだ追従していなければ None)。
+    pitch_error はお手本との音程差 (半音、正ならお手本より高い)。score はここまでの音程スコア (0〜100)。
+    """
+    time_sec: float
+    voiced: bool
+    user_midi: float = None
+    position_sec: float = None
+    ref_midi: float = None
+    pitch_error: float = None
+    score: float = None
+
+
+class RingBuffer:
+    """固定長の音声バッファ。先頭からの通算サンプル位置で読み出す"""
+
+    def __init__(self, capacity):
+        self.capacity = int(capacity)
+        self.total = 0
+        self._data = np.zeros(self.capacity, dtype=np.float32)
+
+    def append(self, samples):
+        n = len(samples)
+        if n > self.capacity:
+            self.total += n - self.capacity
+            samples, n = samples[-self.capacity:], self.capacity
+        position = self.total % self.capacity
+        first = min(n, self.capacity - position)
+        self._data[position:position + first] = samples[:first]
+        self._data[:n - first] = samples[first:]
+        self.total += n
+
+    def read(self, start, n):
+        """通算位置 start から n サンプルを返す (まだ上書きされていない範囲のみ)"""
+        if start < self.total - self.capacity or start + n > self.total:
+            raise ValueError("リングバッファに残っていない範囲です。")
+        return np.take(self._data, np.arange(start, start + n), mode='wrap')
+
+
+class LiveScorer:
+    """ブロック単位の音声を受け取り、お手本に対する現在位置と音程のずれを逐次返す"""
+
+    def __init__(self, reference_contour, input_sr=None, offset_semitones=0.0,
+                 hop_length=HOP_LENGTH, frame_length=FRAME_LENGTH, sr=None):
+        """
+        :param reference_contour: お手本の輪郭 (pitch_analyzer.load_reference_contour の戻り値)
+        :param input_sr: 入力音声のサンプルレート。お手本と異なればストリームのままリサンプルする
+        :param sr: お手本を解析したサンプルレート。None なら輪郭の時間軸 (2フレーム以上必要) から求める
+        :param offset_semitones: 演奏側の既知のずれ (半音下げチューニングなら -1)。誤差の計算前に補正する
+        """
+        voiced = np.asarray(reference_contour["voiced_flag"], dtype=bool)
+        times = np.asarray(reference_contour["times"], dtype=np.float64)
+        self.ref_midi = np.asarray(reference_contour["midi"], dtype=np.float64)[voiced]
+        self.ref_times = times[voiced]
+        if len(self.ref_midi) == 0:
+            raise ValueError("お手本に有声のフレームがありません。")
+        if sr is None:
+            if len(times) < 2:
+                raise ValueError("お手本の輪郭が1フレームしかないため、サンプルレート (sr) を指定してください。")
+            # お手本の輪郭の時間軸 (ホップ長 / サンプルレート) から解析のサンプルレートを求める
+            sr = int(round(hop_length / (times[1] - times[0])))
+        self.sr = int(sr)
+        self.hop_length = hop_length
+        self.frame_length = frame_length
+        self.offset_semitones = offset_semitones
+
+        self._resampler = None
+        if input_sr is not None and input_sr != self.sr:
+            import soxr
+            self._resampler = soxr.ResampleStream(input_sr, self.sr, 1, dtype='float32', quality='HQ')
+
+        self._ring = RingBuffer(max(int(RING_SECONDS * self.sr), 4 * frame_length))
+        # フレーム i の中心が通算位置 i * hop_length + frame_length // 2 に来るよう、先頭に無音を置く
+        # (librosa.stft の center=True と同じ位置)
+        self._ring.append(np.zeros(frame_length // 2, dtype=np.float32))
+        self._window = np.hanning(frame_length + 1)[:-1].astype(np.float32)
+        self._next_frame = 0
+        # librosa のサブモジュールは初回使用時に読み込まれる (数秒かかる) ので、最初のブロックが遅れないよう先に済ませる
+        acf_pitch_from_power(np.zeros((frame_length + 1, 1)), self.sr, PITCH_FMIN, PITCH_FMAX, frame_length)
+
+        frames_per_sec = self.sr / hop_length
+        self._back = int(WINDOW_BACK_SEC * frames_per_sec)
+        self._ahead = int(WINDOW_AHEAD_SEC * frames_per_sec)
+        # 累積コストの1行 (先頭2列は j-1, j-2 を参照するための番兵)
+        self._row = np.full(len(self.ref_midi) + 2, np.inf)
+        self._row_lo, self._row_hi = 0, 0
+        self._recent_errors = collections.deque(maxlen=RELOCK_FRAMES)
+        self._restart()
+
+    def _restart(self):
+        """お手本全体から開始位置を探し直す"""
+        self._row[self._row_lo + 2:self._row_hi + 2] = np.inf
+        self._row_lo, self._row_hi = 0, 0
+        self._voiced_frames = 0
+        self._position = None
+        self._recent_errors.clear()
+
+    def feed(self, block):
+        """
+        音声のブロックを受け取り、新しく揃ったフレームの LiveUpdate のリストを返す。
+        :param block: (サンプル数,) または (サンプル数, チャンネル数) の音声
+        """
+        block = np.asarray(block, dtype=np.float32)
+        if block.ndim == 2:
+            block = block.mean(axis=1)
+        if self._resampler is not None:
+            block = self._resampler.resample_chunk(block)
+        updates = []
+        step = self._ring.capacity - self.frame_length
+        for start in range(0, len(block), step):
+            self._ring.append(block[start:start + step])
+            updates.extend(self._process_ready_frames())
+        return updates
+
+    def flush(self):
+        """入力の終わり。リサンプラーに残ったサンプルと、末尾 (無音で埋める) のフレームを処理する"""
+        updates = []
+        if self._resampler is not None:
+            updates.extend(self.feed(self._resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True)))
+            self._resampler = None
+        updates.extend(self.feed(np.zeros(self.frame_length // 2, dtype=np.float32)))
+        return updates
+
+    def _process_ready_frames(self):
+        n_ready = (self._ring.total - self.frame_length) // self.hop_length + 1 - self._next_frame
+        if n_ready <= 0:
+            return []
+        start = self._next_frame * self.hop_length
+        samples = self._ring.read(start, (n_ready - 1) * self.hop_length + self.frame_length)
+        frames = np.lib.stride_tricks.sliding_window_view(samples, self.frame_length)[::self.hop_length]
+        power = np.abs(np.fft.rfft(frames * self._window, n=2 * self.frame_length, axis=1)) ** 2
+        f0, voiced_flag = acf_pitch_from_power(power.T, self.sr, PITCH_FMIN, PITCH_FMAX, self.frame_length)
+
+        updates = []
+        for k in range(n_ready):
+            frame = self._next_frame + k
+            update = LiveUpdate(time_sec=frame * self.hop_length / self.sr, voiced=bool(voiced_flag[k]))
+            if update.voiced:
+                update.user_midi = float(12.0 * np.log2(f0[k] / 440.0) + 69.0)
+                self._align(update)
+            updates.append(update)
+        self._next_frame += n_ready
+        return updates
+
+    def _align(self, update):
+        """オンラインDTW: 1フレーム分だけ累積コストの行を進め、現在位置と誤差を求める"""
+        midi = update.user_midi - self.offset_semitones
+        m = len(self.ref_midi)
+        if self._position is None or self._voiced_frames < WARMUP_FRAMES:
+            lo, hi = 0, m
+        else:
+            lo, hi = max(0, self._position - self._back), min(m, self._position + self._ahead)
+
+        cost = np.abs(midi - self.ref_midi[lo:hi])
+        if self._position is None:
+            new = cost  # 開始位置は自由 (open_begin)
+        else:
+            row = self._row
+            # g[j] = cost[j] + min(g'[j], g'[j-1], g'[j-2])  (alignment.py の漸化式と同じ)
+            new = cost + np.minimum(np.minimum(row[lo + 2:hi + 2], row[lo + 1:hi + 1]), row[lo:hi])
+        self._row[self._row_lo + 2:self._row_hi + 2] = np.inf
+        self._row[lo + 2:hi + 2] = new
+        self._row_lo, self._row_hi = lo, hi
+        self._voiced_frames += 1
+
+        best = int(np.argmin(new))
+        if not np.isfinite(new[best]):
+            # 窓の中に到達できる列が無い (長い中断の後など)
+            self._restart()
+            return
+        self._position = lo + best
+        update.position_sec = float(self.ref_times[self._position])
+        update.ref_midi = float(self.ref_midi[self._position])
+        update.pitch_error = float(midi - update.ref_midi)
+        update.score = _similarity_score(new[best] / self._voiced_frames)
+
+        self._recent_errors.append(abs(update.pitch_error))
+        if len(self._recent_errors) == RELOCK_FRAMES and np.mean(self._recent_errors) > RELOCK_ERROR_SEMITONES:
+            self._restart()
+
+
+def score_wav(path, reference_contour, block_size=1024, realtime=False, on_update=None):
+    """
+    WAV (soundfile で読める音声) をブロックごとに LiveScorer に流す。
+
+    :param block_size: 1回に渡すサンプル数 (入力のサンプルレート基準)
+    :param realtime: True ならブロックの長さだけ待ちながら流し、実際の演奏と同じ間隔にする
+    :param on_update: LiveUpdate を受け取る関数 (任意)
+    :return: (LiveUpdate のリスト, ブロックあたりの処理時間 [秒] の配列)
+    """
+    updates, latencies = [], []
+    with sf.SoundFile(path) as f:
+        scorer = LiveScorer(reference_contour, input_sr=f.samplerate)
+        block_sec = block_size / f.samplerate
+        started = time.perf_counter()
+        for k, block in enumerate(f.blocks(blocksize=block_size, dtype='float32', always_2d=True)):
+            if realtime:
+                time.sleep(max(0.0, started + k * block_sec - time.perf_counter()))
+            t0 = time.perf_counter()
+            new_updates = scorer.feed(block)
+            latencies.append(time.perf_counter() - t0)
+            updates.extend(new_updates)
+            if on_update is not None:
+                for update in new_updates:
+                    on_update(update)
+        updates.extend(scorer.flush())
+    return updates, np.asarray(latencies)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="録音をブロックごとに流してリアルタイム採点を確認します。")
+    parser.add_argument("take", help="演奏の音声ファイル")
+    parser.add_argument("reference", help="お手本の音声ファイル (ピッチ輪郭はキャッシュを使う)")
+    parser.add_argument("--engine", default="pyin", help="お手本のピッチ推定エンジン")
+    parser.add_argument("--block-size", type=int, default=1024, help="1回に渡すサンプル数")
+    parser.add_argument("--realtime", action="store_true", help="実時間の間隔で流す")
+    args = parser.parse_args(argv)
+
+    reference_contour = load_reference_contour(args.reference, engine=args.engine)
+    if reference_contour is None:
+        print(f"エラー: お手本のピッチ輪郭を取得できません: {args.reference}")
+        return 1
+
+    last_printed = [-1.0]
+
+    def report(update):
+        if update.score is not None and update.time_sec - last_printed[0] >= 0.5:
+            last_printed[0] = update.time_sec
+            print(f"  {update.time_sec:6.2f}s  お手本 {update.position_sec:6.2f}s  "
+                  f"ずれ {update.pitch_error:+5.2f} 半音  スコア {update.score:5.1f}")
+
+    updates, latencies = score_wav(args.take, reference_contour, args.block_size, args.realtime, report)
+    scored = [update for update in updates if update.score is not None]
+    print(f"フレーム {len(updates)} (採点 {len(scored)})  ブロックあたりの処理時間: "
+          f"平均 {latencies.mean() * 1000:.2f} ms / 最大 {latencies.max() * 1000:.2f} ms")
+    if scored:
+        print(f"最終スコア: {scored[-1].score:.1f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,173 @@
+# phrase_index.py
+"""
+お手本のピッチ輪郭に対するフレーズ索引。
+
+有声フレームのMIDI列を音符イベント(半音に丸めた音高が一定の区間)に分割し、
+連続する音程(半音差)の n-gram を整数コードにして昇順に並べておく。
+ユーザー演奏の n-gram を二分探索で引き、一致した位置から開始位置の候補を投票で求めるため、
+検索コストはお手本の長さにほぼ依存しない。音程差を使うので移調にも影響されない。
+
+索引は配列だけで構成され、contour_cache にお手本の輪郭と一緒に保存できる。
+"""
+
+import numpy as np
+
+PHRASE_INDEX_VERSION = 1
+NGRAM_SIZES = (3, 2)
+# 音符とみなす最短フレーム数
+MIN_NOTE_FRAMES = 3
+MAX_INTERVAL = 24
+# 開始位置の投票をまとめる幅 (フレーム)
+VOTE_BIN_FRAMES = 16
+
+_INTERVAL_BASE = 2 * MAX_INTERVAL + 1
+_ARRAY_PREFIX = "phrase_"
+
+
+def note_events(midi):
+    """
+    MIDI列を音符イベントに分割する。
+
+    :return: (開始フレーム, 長さ, 音高) の配列の組
+    """
+    midi = np.asarray(midi, dtype=np.float64)
+    if len(midi) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+    rounded = np.round(midi).astype(np.int64)
+    boundaries = np.flatnonzero(np.diff(rounded)) + 1
+    starts = np.concatenate([[0], boundaries])
+    lengths = np.diff(np.concatenate([starts, [len(rounded)]]))
+    pitches = rounded[starts]
+
+    # 短すぎる区間(ノイズや装飾的な揺れ)を捨て、同じ音高が続く場合は1音にまとめる
+    keep = lengths >= MIN_NOTE_FRAMES
+    starts, lengths, pitches = starts[keep], lengths[keep], pitches[keep]
+    if len(pitches) > 1:
+        new_note = np.concatenate([[True], np.diff(pitches) != 0])
+        ends = starts + lengths
+        group = np.cumsum(new_note) - 1
+        merged_ends = np.zeros(group[-1] + 1, dtype=np.int64)
+        np.maximum.at(merged_ends, group, ends)
+        starts, pitches = starts[new_note], pitches[new_note]
+        lengths = merged_ends - starts
+    return starts, lengths, pitches
+
+
+def _ngram_codes(pitches, n):
+    """音高列から音程 n-gram の整数コードを作る。コード[k] は音符 k から始まる n-gram。"""
+    if len(pitches) <= n:
+        return np.zeros(0, dtype=np.int64)
+    intervals = np.clip(np.diff(pitches), -MAX_INTERVAL, MAX_INTERVAL) + MAX_INTERVAL
+    windows = np.lib.stride_tricks.sliding_window_view(intervals, n)
+    weights = _INTERVAL_BASE ** np.arange(n, dtype=np.int64)
+    return windows.astype(np.int64) @ weights
+
+
+class PhraseIndex:
+    """お手本の音程 n-gram 索引"""
+
+    def __init__(self, note_starts, note_pitches, ngram_codes, ngram_notes, n_frames):
+        self.note_starts = np.asarray(note_starts, dtype=np.int64)
+        self.note_pitches = np.asarray(note_pitches, dtype=np.int64)
+        # {n: (昇順のコード, 対応する音符番号)}
+        self.ngram_codes = {n: np.asarray(c, dtype=np.int64) for n, c in ngram_codes.items()}
+        self.ngram_notes = {n: np.asarray(k, dtype=np.int64) for n, k in ngram_notes.items()}
+        self.n_frames = int(n_frames)
+
+    @classmethod
+    def build(cls, midi):
+        """有声フレームのMIDI列から索引を作る。"""
+        starts, _, pitches = note_events(midi)
+        codes, notes = {}, {}
+        for n in NGRAM_SIZES:
+            ngram = _ngram_codes(pitches, n)
+            order = np.argsort(ngram, kind='stable')
+            codes[n], notes[n] = ngram[order], order
+        return cls(starts, pitches, codes, notes, len(midi))
+
+    def to_arrays(self):
+        """contour_cache に保存するための配列の辞書"""
+        arrays = {
+            f"{_ARRAY_PREFIX}note_starts": self.note_starts,
+            f"{_ARRAY_PREFIX}note_pitches": self.note_pitches,
+            f"{_ARRAY_PREFIX}n_frames": np.array([self.n_frames], dtype=np.int64),
+        }
+        for n in self.ngram_codes:
+            arrays[f"{_ARRAY_PREFIX}codes_{n}"] = self.ngram_codes[n]
+            arrays[f"{_ARRAY_PREFIX}notes_{n}"] = self.ngram_notes[n]
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """to_arrays() の結果から復元する。索引が含まれていなければ None"""
+        try:
+            codes = {n: arrays[f"{_ARRAY_PREFIX}codes_{n}"] for n in NGRAM_SIZES}
+            notes = {n: arrays[f"{_ARRAY_PREFIX}notes_{n}"] for n in NGRAM_SIZES}
+            return cls(
+                arrays[f"{_ARRAY_PREFIX}note_starts"], arrays[f"{_ARRAY_PREFIX}note_pitches"],
+                codes, notes, int(arrays[f"{_ARRAY_PREFIX}n_frames"][0])
+            )
+        except KeyError:
+            return None
+
+    def candidate_starts(self, user_midi, top_k=3):
+        """
+        ユーザー演奏が始まるお手本上の位置(有声フレーム番号)の候補を、得票の多い順に返す。
+        一致する n-gram が無ければ空のリストを返す。
+        """
+        user_starts, _, user_pitches = note_events(user_midi)
+        votes, weights = [], []
+        for n in NGRAM_SIZES:
+            codes = self.ngram_codes[n]
+            query = _ngram_codes(user_pitches, n)
+            if len(codes) == 0 or len(query) == 0:
+                continue
+            left = np.searchsorted(codes, query, side='left')
+            right = np.searchsorted(codes, query, side='right')
+            counts = right - left
+            if counts.sum() == 0:
+                continue
+            # 一致した (ユーザーの音符, お手本の音符) の組を展開する
+            user_notes = np.repeat(np.arange(len(query)), counts)
+            posting = np.concatenate([np.arange(l, r) for l, r in zip(left, right) if r > l])
+            ref_notes = self.ngram_notes[n][posting]
+            votes.append(self.note_starts[ref_notes] - user_starts[user_notes])
+            weights.append(np.full(len(ref_notes), n, dtype=np.float64))
+        if not votes:
+            return []
+
+        offsets = np.concatenate(votes)
+        weights = np.concatenate(weights)
+        # お手本の先頭より前から始まる組は、偶然の一致なので捨てる
+        valid = offsets >= -VOTE_BIN_FRAMES
+        if not valid.any():
+            return []
+        offsets = np.clip(offsets[valid], 0, max(self.n_frames - 1, 0))
+        bins = offsets // VOTE_BIN_FRAMES
+        scores = np.bincount(bins, weights=weights[valid])
+        best_bins = np.argsort(scores)[::-1][:top_k]
+        best_bins = best_bins[scores[best_bins] > 0]
+        # ビン内の最小の開始位置を候補とする
+        return [int(offsets[bins == b].min()) for b in best_bins]
+
+
+def candidate_windows(index, user_midi, top_k=3, stretch=1.5, padding=None):
+    """
+    候補となるお手本上の区間 [start, end) (有声フレーム番号) を返す。
+    ユーザー演奏が最大 stretch 倍遅く弾かれても収まるよう余裕を持たせる。
+    """
+    user_len = len(user_midi)
+    if padding is None:
+        padding = max(VOTE_BIN_FRAMES, user_len // 4)
+    windows = []
+    for start in index.candidate_starts(user_midi, top_k=top_k):
+        lo = max(0, start - padding)
+        hi = min(index.n_frames, start + int(stretch * user_len) + padding)
+        if hi - lo <= user_len // 2:
+            continue
+        # 既存の候補と半分以上重なる区間はアライメントしても結果がほぼ同じなので省く
+        if any(min(hi, h) - max(lo, l) > (hi - lo) // 2 for l, h in windows):
+            continue
+        windows.append((lo, hi))
+    return windows
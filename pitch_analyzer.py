@@ -1,120 +1,487 @@
 import librosa
-import librosa.display
-import matplotlib.pyplot as plt
-import matplotlib.ticker as mticker
 import numpy as np
-import io
-from dtw import dtw
+import functools
 
-def _extract_pitch(audio_source, is_path=False):
+from alignment import AlignmentResult, dtw_align_batch
+from analysis_pool import run_parallel
+from audio_ingest import AudioIngestError, IngestedAudio, ingest_audio
+from contour_cache import load_cached, load_or_compute
+from phrase_index import PHRASE_INDEX_VERSION, PhraseIndex, candidate_windows, note_events
+from pitch_engines import DEFAULT_ENGINE, FRAME_LENGTH, acf_pitch_from_power, get_engine
+from pitch_render import comparison_figure, pitch_figure
+from stem_store import load_audio
+
+# --- 解析パラメータ ---
+# お手本輪郭のキャッシュキーにも含まれるため、変更するとキャッシュは自動的に作り直される
+PITCH_FMIN = float(librosa.note_to_hz('E2'))
+PITCH_FMAX = float(librosa.note_to_hz('E6'))
+HOP_LENGTH = 512  # pyinのデフォルト値(frame_length/4 = 2048/4 = 512)
+ANALYSIS_SR = None  # None: ファイルのネイティブなサンプルレートを使用
+
+# お手本がユーザー演奏のこの倍数より長い場合、フレーズ索引で候補区間を絞ってからアライメントする
+PHRASE_SEARCH_MIN_RATIO = 2.0
+PHRASE_SEARCH_TOP_K = 3
+
+# --- 移調・チューニングのずれ ---
+# ピッチクラスのヒストグラムのビン幅 (セント)
+OFFSET_BIN_CENTS = 10
+# ヒストグラムから選び、アライメントで比べるずれの候補数 (ずれ 0 は常に候補に加える)
+OFFSET_CANDIDATES = 3
+# 候補同士の最小間隔 (セント)
+OFFSET_MIN_SEPARATION_CENTS = 50
+
+# --- リズム・音量の特徴量 ---
+# 1回だけ計算したSTFTから全ての特徴量を求める (acf ではピッチも同じSTFTから求めるので変換は1回で済む。
+# pyin/yin はピッチを時間領域で推定するため、特徴量を求める場合はSTFTが別に1回かかる)
+FEATURES_VERSION = 1
+N_MELS = 128
+# お手本とユーザーのオンセットが一致したとみなす時間差 (秒)
+ONSET_TOLERANCE_SEC = 0.07
+# 総合スコアにおけるピッチの重み (残りがリズム)
+PITCH_SCORE_WEIGHT = 0.7
+
+
+def _pitch_params(engine=DEFAULT_ENGINE):
+    """キャッシュキーに使う解析パラメータ"""
+    return {
+        "algorithm": engine,
+        "frame_length": FRAME_LENGTH,
+        "fmin": PITCH_FMIN,
+        "fmax": PITCH_FMAX,
+        "hop_length": HOP_LENGTH,
+        "sr": ANALYSIS_SR if ANALYSIS_SR is not None else "native",
+    }
+
+
+@functools.lru_cache(maxsize=8)
+def _mel_basis(sr, n_fft):
+    return librosa.filters.mel(sr=sr, n_fft=n_fft, n_mels=N_MELS).astype(np.float32)
+
+
+def _spectral_features(power, sr):
     """
-    音声ソースからピッチ(f0)と時間(times)を抽出する内部関数。
-    sr=Noneでファイルのネイティブなサンプルレートを自動検出して使用する。
+    STFTのパワースペクトルからオンセット強度・オンセット時刻・音量(dB)を求める。
+    音量は窓やゼロ詰めの影響を含む相対値で、演奏同士の比較に使う。
+    """
+    n_fft = 2 * (power.shape[0] - 1)
+    mel_db = librosa.power_to_db(_mel_basis(sr, n_fft) @ power)
+    # STFTが既に center=True なので、librosa の既定のずらし (center=True) はかけない
+    onset_strength = librosa.onset.onset_strength(S=mel_db, sr=sr, hop_length=HOP_LENGTH, center=False)
+    onset_frames = librosa.onset.onset_detect(
+        onset_envelope=onset_strength, sr=sr, hop_length=HOP_LENGTH, units='frames'
+    )
+    # librosa.feature.rms(S=...) と同じ計算をパワーから直接行う (両端のビンは片側分のみ)
+    energy = 2 * power.sum(axis=0) - power[0] - power[-1]
+    rms = np.sqrt(energy) / n_fft
+    return {
+        "onset_strength": onset_strength.astype(np.float32),
+        "onset_times": librosa.frames_to_time(onset_frames, sr=sr, hop_length=HOP_LENGTH).astype(np.float32),
+        "rms_db": librosa.amplitude_to_db(rms, ref=1.0).astype(np.float32),
+    }
+
+
+def _extract_contour(audio_source, engine=DEFAULT_ENGINE, features=False):
+    """
+    音声ソースからピッチ輪郭(f0, voiced_flag, times, midi)を全フレーム分抽出する。
+    engine は pitch_engines.PITCH_ENGINES のキー ("pyin", "yin", "acf")。
+    無声フレームの f0/midi は NaN。失敗した場合は None を返す。
+
+    :param features: True の場合、同じ音声から1回だけ計算したSTFTを使って
+                     onset_strength, onset_times, rms_db も加えた特徴量の辞書を返す。
+                     engine が "acf" ならピッチもこのSTFTから求める。"pyin"/"yin" はSTFTを
+                     再利用できないので、特徴量のためのSTFTがピッチ推定とは別にかかる
     """
     try:
-        # ネイティブなサンプルレートで音声を読み込む
-        y, sr = librosa.load(audio_source, sr=None)
-
-        # pYINアルゴリズムでピッチを推定
-        # hop_lengthはpyinのデフォルト値(win_length/4 = 2048/4 = 512)
-        f0, voiced_flag, _ = librosa.pyin(
-            y,
-            fmin=float(librosa.note_to_hz('E2')),
-            fmax=float(librosa.note_to_hz('E6')),
-            sr=sr # 検出したsrを使用
-        )
-        
+        # ネイティブなサンプルレートで音声を読み込む (ステムは stem_store 経由で FLAC/WAV を読む)
+        y, sr = load_audio(audio_source, sr=ANALYSIS_SR)
+    except Exception as e:
+        print(f"Error extracting pitch: {e}")
+        return None
+    return _contour_from_samples(y, sr, engine=engine, features=features)
+
+
+def _contour_from_samples(y, sr, engine=DEFAULT_ENGINE, features=False):
+    """
+    読み込み済みのモノラル音声からピッチ輪郭を抽出する。引数と戻り値は _extract_contour と同じ。
+    STFTは features=True の場合だけ計算し、ピッチに再利用するのは acf だけ
+    (pyin/yin はリズム・音量の特徴量にだけ使う)。
+    """
+    estimate = get_engine(engine)
+    try:
+        power = None
+        if features:
+            power = np.abs(librosa.stft(
+                y, n_fft=2 * FRAME_LENGTH, win_length=FRAME_LENGTH,
+                hop_length=HOP_LENGTH, window='hann', center=True
+            )) ** 2
+
+        if power is not None and engine == "acf":
+            f0, voiced_flag = acf_pitch_from_power(power, sr, PITCH_FMIN, PITCH_FMAX, FRAME_LENGTH)
+        else:
+            f0, voiced_flag = estimate(
+                y, sr, PITCH_FMIN, PITCH_FMAX, HOP_LENGTH, frame_length=FRAME_LENGTH
+            )
+
         # 正しいサンプルレートとホップ長で時間軸を生成
-        times = librosa.times_like(f0, sr=sr, hop_length=512)
-        
-        # 有声区間のみを返す
-        voiced_indices = np.where(voiced_flag)
-        return f0[voiced_indices], times[voiced_indices]
-        
+        times = librosa.times_like(f0, sr=sr, hop_length=HOP_LENGTH)
+
+        contour = {
+            "f0": f0.astype(np.float32),
+            "voiced_flag": voiced_flag.astype(bool),
+            "times": times.astype(np.float32),
+            "midi": librosa.hz_to_midi(f0).astype(np.float32),
+        }
+        if power is not None:
+            contour.update(_spectral_features(power, sr))
+        return contour
+
     except Exception as e:
         print(f"Error extracting pitch: {e}")
+        return None
+
+
+def _voiced(contour):
+    """輪郭から有声区間の (f0, times) を取り出す。"""
+    if contour is None:
         return None, None
+    voiced_indices = np.where(contour["voiced_flag"])
+    return np.asarray(contour["f0"][voiced_indices], dtype=float), np.asarray(contour["times"][voiced_indices], dtype=float)
+
 
-def analyze_pitch_and_create_graph(audio_bytes):
+def _extract_pitch(audio_source, is_path=False, engine=DEFAULT_ENGINE):
     """
-    単一のオーディオデータからピッチを抽出し、グラフを生成する。
+    音声ソースからピッチ(f0)と時間(times)を抽出する内部関数。
+    有声区間のみを返す。
+    """
+    return _voiced(_extract_contour(audio_source, engine=engine))
+
+
+def _extract_reference_contour(audio_source, engine=DEFAULT_ENGINE):
+    """お手本用: ピッチ輪郭とリズム・音量の特徴量に、有声区間のフレーズ索引を加えたもの"""
+    contour = _extract_contour(audio_source, engine=engine, features=True)
+    if contour is None:
+        return None
+    voiced_midi = contour["midi"][contour["voiced_flag"]]
+    contour.update(PhraseIndex.build(voiced_midi).to_arrays())
+    return contour
+
+
+def extract_user_contour(user_audio, engine=DEFAULT_ENGINE, features=True):
+    """
+    ユーザーの演奏からピッチ輪郭を抽出する (プロセスプールに渡すためのトップレベル関数)。
+    対話的な採点とバッチ採点 (batch_scoring) で同じ前処理・解析になるよう、演奏の解析は必ずこの関数を通す。
+    user_audio は取り込み済みの IngestedAudio、またはパス・バイト列・ファイルライクオブジェクト。
+    後者は audio_ingest で上限を確認しながらモノラル・解析用のサンプルレートに変換してから解析する。
+    """
+    if not isinstance(user_audio, IngestedAudio):
+        try:
+            user_audio = ingest_audio(user_audio)
+        except AudioIngestError as e:
+            print(f"Error ingesting audio: {e}")
+            return None
+    return _contour_from_samples(user_audio.samples, user_audio.sr, engine=engine, features=features)
+
+
+def _reference_params(engine=DEFAULT_ENGINE):
+    """お手本の輪郭キャッシュのキーに使う解析パラメータ (特徴量・フレーズ索引を含む)"""
+    return dict(_pitch_params(engine), phrase_index=PHRASE_INDEX_VERSION, features=FEATURES_VERSION, n_mels=N_MELS)
+
+
+def load_reference_contour(reference_audio_path, engine=DEFAULT_ENGINE):
+    """
+    お手本音源のピッチ輪郭をディスクキャッシュ経由で取得する。
+    音源の内容か解析パラメータ(エンジンを含む)が変わった場合のみ再解析する。
+    """
+    try:
+        return load_or_compute(
+            reference_audio_path, _reference_params(engine),
+            functools.partial(_extract_reference_contour, engine=engine)
+        )
+    except OSError as e:
+        print(f"Error loading reference contour: {e}")
+        return None
+
+
+def _cached_reference_contour(reference_audio_path, engine=DEFAULT_ENGINE):
+    """キャッシュ済みのお手本の輪郭 (メモリマップ) を返す。未解析なら None (解析はしない)"""
+    try:
+        return load_cached(reference_audio_path, _reference_params(engine))
+    except OSError:
+        return None
+
+
+def _pitch_class_histogram(midi):
+    """オクターブを無視した音高の分布 (OFFSET_BIN_CENTS 刻み、合計 1)"""
+    n_bins = 1200 // OFFSET_BIN_CENTS
+    bins = np.round(np.mod(np.asarray(midi) * 100, 1200) / OFFSET_BIN_CENTS).astype(np.int64) % n_bins
+    hist = np.bincount(bins, minlength=n_bins).astype(np.float64)
+    return hist / max(hist.sum(), 1.0)
+
+
+def _estimate_offsets(user_midi, ref_midi, top_k=OFFSET_CANDIDATES):
+    """
+    ユーザー演奏をお手本に合わせるために足す音程のずれ (半音, 小数可) の候補を返す。
+    ピッチクラスのヒストグラムの循環相互相関が大きい順に選び、
+    オクターブは中央値の差に最も近いものにする。先頭は常に 0。
+    """
+    n_bins = 1200 // OFFSET_BIN_CENTS
+    # corr[k]: ユーザーを k ビン上げたときのお手本との分布の重なり
+    corr = np.fft.irfft(
+        np.fft.rfft(_pitch_class_histogram(ref_midi)) * np.conj(np.fft.rfft(_pitch_class_histogram(user_midi))),
+        n=n_bins
+    )
+    median_diff = float(np.median(ref_midi) - np.median(user_midi))
+    min_separation = OFFSET_MIN_SEPARATION_CENTS // OFFSET_BIN_CENTS
+
+    offsets, picked = [0.0], []
+    for k in np.argsort(corr)[::-1]:
+        if len(picked) >= top_k:
+            break
+        if any(min(abs(k - p), n_bins - abs(k - p)) < min_separation for p in picked):
+            continue
+        picked.append(int(k))
+        semitones = k * OFFSET_BIN_CENTS / 100
+        semitones = round(semitones + 12 * round((median_diff - semitones) / 12), 2)
+        if semitones != 0:
+            offsets.append(semitones)
+    return offsets
+
+
+def _align_windows(shifted, offsets, ref_midi, windows):
+    """
+    ずれを足したユーザー演奏 (shifted) の全フレームを、お手本の各区間 [start, end) にアライメントし、
+    距離が最小の (AlignmentResult, ずれ) を返す。どの区間でもパスが見つからなければ (None, 0.0)。
+    """
+    best, best_offset = None, 0.0
+    for start, end in windows:
+        try:
+            alignments = dtw_align_batch(shifted, ref_midi[start:end], open_begin=True, open_end=True, multiscale=True)
+        except ValueError:
+            continue
+        for offset, alignment in zip(offsets, alignments):
+            if best is None or alignment.normalizedDistance < best.normalizedDistance:
+                best_offset = float(offset)
+                best = AlignmentResult(
+                    index1=alignment.index2 + start, index2=alignment.index1,
+                    distance=alignment.distance, normalizedDistance=alignment.normalizedDistance
+                )
+    return best, best_offset
+
+
+def _align_pitches(user_midi, ref_midi, phrase_index=None, offsets=(0.0,)):
+    """
+    ユーザー演奏とお手本のMIDI列をアライメントする。
+    offsets の各ずれをユーザー演奏に足したものを一度にアライメントし、距離が最小のものを選ぶ。
+    (index1 がお手本側、index2 がユーザー側のフレーム番号になる AlignmentResult, 選ばれたずれ) を返す。
+
+    お手本がユーザー演奏より十分長く索引がある場合だけ、ユーザー演奏を query にしてお手本の候補区間と
+    両端を開いて照合する (お手本の一部分を練習した演奏として採点する)。
+    それ以外はお手本を query にして全区間をユーザー演奏にマッピングするので、
+    お手本の一部しか弾いていない演奏や、音程が変わらない演奏は弾いていない区間の分だけ距離が大きくなる。
+    """
+    offsets = np.asarray(offsets, dtype=np.float64)
+    if phrase_index is not None and len(ref_midi) >= PHRASE_SEARCH_MIN_RATIO * len(user_midi):
+        # 短い演奏は、索引で見つけた候補区間だけに対してユーザー演奏全体をアライメントする
+        # 索引は音程差で引くので半音単位の移調には影響されないが、
+        # 半音未満のずれは音符への丸め方が変わるため、ずれごとに引いた候補区間を合わせて使う
+        shifted = user_midi[None, :] + offsets[:, None]
+        windows = sorted({
+            window for midi in shifted
+            for window in candidate_windows(phrase_index, midi, top_k=PHRASE_SEARCH_TOP_K)
+        })
+        best, best_offset = _align_windows(shifted, offsets, ref_midi, windows)
+        if best is not None:
+            return best, best_offset
+
+    # お手本(query)を基準に、ユーザー演奏(reference)をアライメントする
+    # これにより、お手本の全区間に対してユーザー演奏がマッピングされる
+    # 多重解像度で解くため、コスト行列全体は確保しない
+    # (ユーザーにずれを足す代わりに、お手本からずれを引いて同じ距離を求める)
+    alignments = dtw_align_batch(
+        ref_midi[None, :] - offsets[:, None], user_midi, open_begin=True, open_end=True, multiscale=True
+    )
+    best = int(np.argmin([alignment.normalizedDistance for alignment in alignments]))
+    return alignments[best], float(offsets[best])
+
+
+def analyze_pitch(audio_bytes, engine=DEFAULT_ENGINE):
+    """
+    単一のオーディオデータからピッチを抽出する。
+    有声区間の times, f0 を持つ辞書を返す。抽出できなければ None。
     """
-    f0, times = _extract_pitch(io.BytesIO(audio_bytes))
-    
+    f0, times = _voiced(extract_user_contour(audio_bytes, engine=engine, features=False))
     if f0 is None or times is None:
         return None
+    return {"times": times, "f0": f0}
 
-    fig, ax = plt.subplots(figsize=(10, 4))
-    ax.plot(times, f0, 'o', markersize=2, label='Pitch (f0)')
-    ax.set_title('Pitch Analysis')
-    ax.set_xlabel('Time (s)')
-    ax.set_ylabel('Frequency (Hz)')
-    ax.set_yscale('log')
-    ax.yaxis.set_major_formatter(mticker.FuncFormatter(lambda x, pos: f"{int(x)}"))
-    
-    # ギターの開放弦の周波数を参考にグリッド表示
-    E2 = float(librosa.note_to_hz('E2')); A2 = float(librosa.note_to_hz('A2')); D3 = float(librosa.note_to_hz('D3')); G3 = float(librosa.note_to_hz('G3')); B3 = float(librosa.note_to_hz('B3')); E4 = float(librosa.note_to_hz('E4'))
-    ax.axhline(y=E2, color='r', linestyle='--', linewidth=0.5, label='E2'); ax.axhline(y=A2, color='g', linestyle='--', linewidth=0.5, label='A2'); ax.axhline(y=D3, color='b', linestyle='--', linewidth=0.5, label='D3'); ax.axhline(y=G3, color='c', linestyle='--', linewidth=0.5, label='G3'); ax.axhline(y=B3, color='m', linestyle='--', linewidth=0.5, label='B3'); ax.axhline(y=E4, color='y', linestyle='--', linewidth=0.5, label='E4')
-    
-    ax.legend(loc='upper right')
-    ax.grid(True, which="both", ls="--", linewidth=0.5)
-    plt.tight_layout()
-    return fig
-
-def compare_pitches_and_create_graph(user_audio_bytes, reference_audio_path):
+
+def analyze_pitch_and_create_graph(audio_bytes, engine=DEFAULT_ENGINE):
     """
-    ユーザーの演奏とお手本演奏のピッチを比較し、グラフとスコアを生成する。
+    単一のオーディオデータからピッチを抽出し、グラフを生成する。
     """
-    user_f0, user_times = _extract_pitch(io.BytesIO(user_audio_bytes))
-    ref_f0, ref_times = _extract_pitch(reference_audio_path, is_path=True)
+    result = analyze_pitch(audio_bytes, engine=engine)
+    if result is None:
+        return None
+    return pitch_figure(result)
+
+def _similarity_score(normalized_distance):
+    """正規化DTW距離を100点満点のスコアに変換する"""
+    # 100点満点に変換し、採点基準を甘くする
+    # スコアを平方根で変換してより甘い評価にし、さらに基準点を上げる
+    adjusted_score = np.sqrt(normalized_distance) * 50  # 平方根で変換して影響を和らげる
+    return float(max(20, 100 - adjusted_score))  # 最低20点保証
+
+
+def compare_pitch_contours(user_contour, ref_contour, transposition=True):
+    """
+    抽出済みのピッチ輪郭同士を比較する (グラフは作らない)。
+
+    :param transposition: True の場合、移調 (カポや半音下げチューニング) やチューニングのずれを
+                          推定して補正してから採点する。補正量は offset_semitones に入る
+
+    :return: (結果の辞書, メッセージ)。結果の辞書は score, pitch_score, normalized_distance、
+             お手本の時間軸にワーピングした ref_times, ref_midi, user_midi と、
+             音符ごとの誤差 segments を持つ。user_midi はずれを補正した値。両方の輪郭にオンセットがある場合は
+             rhythm_score などのリズムの指標も持ち、score はピッチとリズムの総合スコアになる。
+             失敗した場合は (None, エラーメッセージ)
+    """
+    user_f0, user_times = _voiced(user_contour)
+    ref_f0, ref_times = _voiced(ref_contour)
 
     if user_f0 is None or ref_f0 is None or len(user_f0) == 0 or len(ref_f0) == 0 or user_times is None or ref_times is None:
         return None, "ピッチを抽出できませんでした。もう一度録音してみてください。"
 
     user_midi = librosa.hz_to_midi(user_f0)
     ref_midi = librosa.hz_to_midi(ref_f0)
-    
-    # DTWの実行
-    # お手本(query)を基準に、ユーザー演奏(reference)をアライメントする
-    # これにより、お手本の全区間に対してユーザー演奏がマッピングされる
-    alignment = dtw(ref_midi, user_midi, keep_internals=True, open_begin=True, open_end=True, step_pattern='asymmetric')
 
-    score = getattr(alignment, 'normalizedDistance', None)
-    if score is None:
+    # ずれの候補をヒストグラムで絞り、候補だけをまとめてアライメントする
+    offsets = _estimate_offsets(user_midi, ref_midi) if transposition else [0.0]
+
+    # DTWの実行 (お手本が長い場合はフレーズ索引で候補区間に絞る)
+    try:
+        alignment, offset = _align_pitches(user_midi, ref_midi, PhraseIndex.from_arrays(ref_contour), offsets)
+    except ValueError as e:
+        print(f"Error aligning pitches: {e}")
         return None, "アライメントスコアを計算できませんでした。"
-    
-    # 100点満点に変換し、採点基準を甘くする
-    # スコアを平方根で変換してより甘い評価にし、さらに基準点を上げる
-    adjusted_score = np.sqrt(score) * 50  # 平方根で変換して影響を和らげる
-    similarity_score = max(20, 100 - adjusted_score)  # 最低20点保証
-    
-    fig, ax = plt.subplots(figsize=(12, 6))
-    
-    # ワーピングパスを取得
-    wp_ref = getattr(alignment, 'index1', None)
-    wp_user = getattr(alignment, 'index2', None)
-    
-    if wp_ref is None or wp_user is None:
-        return None, "ワーピングパスを計算できませんでした。"
-
-    # 1. お手本演奏のピッチを、ワーピング後の時間軸でプロット
-    # これにより、X軸がお手本の時間全体に広がる
-    ax.plot(ref_times[wp_ref], ref_midi[wp_ref], 'o-', label='Reference Pitch', color='dodgerblue', markersize=3)
-    
-    # 2. ユーザーの演奏を、同じワーピング後のお手本の時間軸でプロット
-    ax.plot(ref_times[wp_ref], user_midi[wp_user], 'o-', label='Your Pitch', color='tomato', markersize=3, alpha=0.7)
-
-    ax.set_title(f'Pitch Comparison (Similarity Score: {similarity_score:.1f} / 100)')
-    ax.set_xlabel('Time (s)')
-    ax.set_ylabel('Pitch (MIDI Note Number)')
-    ax.legend()
-    ax.grid(True, linestyle='--', linewidth=0.5)
-
-    @mticker.FuncFormatter
-    def midi_formatter(x, pos):
-        return librosa.midi_to_note(x)
-    ax.yaxis.set_major_formatter(midi_formatter)
-
-    plt.tight_layout()
-
-    return fig, f"{similarity_score:.1f}" 
\ No newline at end of file
+
+    similarity_score = _similarity_score(alignment.normalizedDistance)
+    user_midi = user_midi + offset
+
+    # ワーピングパス (index1: お手本, index2: ユーザー)
+    wp_ref, wp_user = alignment.index1, alignment.index2
+    result = {
+        "score": similarity_score,
+        "pitch_score": similarity_score,
+        "normalized_distance": float(alignment.normalizedDistance),
+        "offset_semitones": round(offset, 2),
+        "ref_times": ref_times[wp_ref],
+        "ref_midi": ref_midi[wp_ref],
+        "user_midi": user_midi[wp_user],
+    }
+    result["segments"] = _segment_errors(result["ref_times"], result["ref_midi"], result["user_midi"])
+
+    # 両方にオンセットがあれば、ピッチのワーピングパスでユーザーのオンセットをお手本の時間に写してリズムを採点する
+    if "onset_times" in user_contour and "onset_times" in ref_contour:
+        rhythm = _rhythm_errors(
+            np.asarray(user_contour["onset_times"]), np.asarray(ref_contour["onset_times"]),
+            user_times[wp_user], result["ref_times"]
+        )
+        if rhythm is not None:
+            result.update(rhythm)
+            result["score"] = PITCH_SCORE_WEIGHT * similarity_score + (1 - PITCH_SCORE_WEIGHT) * rhythm["rhythm_score"]
+    return result, f"{result['score']:.1f}"
+
+
+def _rhythm_errors(user_onsets, ref_onsets, path_user_times, path_ref_times):
+    """
+    ワーピングパスでユーザーのオンセットをお手本の時間軸に写し、お手本のオンセットと対応付ける。
+    rhythm_score (一致率のF値 x 100), onset_precision, onset_recall,
+    timing_offset_ms (一致したオンセットの平均のずれ。正なら遅れ) を返す。
+    アライメントされた区間にお手本のオンセットが無ければ None。
+    """
+    tolerance = ONSET_TOLERANCE_SEC
+    ref_onsets = ref_onsets[(ref_onsets >= path_ref_times[0] - tolerance) & (ref_onsets <= path_ref_times[-1] + tolerance)]
+    if len(ref_onsets) == 0:
+        return None
+    user_onsets = user_onsets[(user_onsets >= path_user_times[0] - tolerance) & (user_onsets <= path_user_times[-1] + tolerance)]
+
+    # パスは同じユーザー時刻が続くことがあるので、各時刻の最初の対応だけを使って補間する
+    path_user_times, first = np.unique(path_user_times, return_index=True)
+    warped = np.interp(user_onsets, path_user_times, path_ref_times[first])
+
+    # 時間差の小さい組から順に、1対1で対応付ける
+    diffs = warped[None, :] - ref_onsets[:, None]
+    ref_used, user_used, offsets = set(), set(), []
+    for flat in np.argsort(np.abs(diffs), axis=None):
+        r, u = np.unravel_index(flat, diffs.shape)
+        if abs(diffs[r, u]) > tolerance:
+            break
+        if r in ref_used or u in user_used:
+            continue
+        ref_used.add(r)
+        user_used.add(u)
+        offsets.append(diffs[r, u])
+
+    matched = len(offsets)
+    precision = matched / len(user_onsets) if len(user_onsets) else 0.0
+    recall = matched / len(ref_onsets)
+    f_measure = 2 * precision * recall / (precision + recall) if matched else 0.0
+    return {
+        "rhythm_score": 100 * f_measure,
+        "onset_precision": round(precision, 3),
+        "onset_recall": round(recall, 3),
+        "timing_offset_ms": round(float(np.mean(offsets)) * 1000, 1) if offsets else None,
+    }
+
+
+def _segment_errors(ref_times, ref_midi, user_midi):
+    """
+    お手本の音符ごとのピッチ誤差を求める。
+    各要素は start, end (秒), note (お手本の音名), error_cents (平均の絶対誤差) を持つ辞書。
+    """
+    starts, lengths, pitches = note_events(ref_midi)
+    errors = np.abs(user_midi - ref_midi) * 100
+    segments = []
+    for start, length, pitch in zip(starts, lengths, pitches):
+        end = start + length
+        segments.append({
+            "start": round(float(ref_times[start]), 3),
+            "end": round(float(ref_times[end - 1]), 3),
+            "note": librosa.midi_to_note(int(pitch)),
+            "error_cents": round(float(errors[start:end].mean()), 1),
+        })
+    return segments
+
+
+def compare_pitches(user_audio, reference_audio_path, engine=DEFAULT_ENGINE, reference_engine=DEFAULT_ENGINE):
+    """
+    ユーザーの演奏とお手本演奏のピッチを比較する (グラフは作らない)。
+
+    user_audio は audio_ingest.ingest_audio で取り込んだ IngestedAudio (またはバイト列)。
+    engine はユーザー演奏の解析に、reference_engine はお手本の解析に使うエンジン。
+    対話的な採点では engine に高速な "acf"/"yin" を、お手本には精度の高い "pyin" を使う想定。
+
+    :return: compare_pitch_contours と同じ (結果の辞書, メッセージ)
+    """
+    # お手本はキャッシュ済みの輪郭をこのプロセスでメモリマップし、プロセス間でコピーしない
+    ref_contour = _cached_reference_contour(reference_audio_path, engine=reference_engine)
+    if ref_contour is not None:
+        user_contour = extract_user_contour(user_audio, engine=engine, features=True)
+    else:
+        # 未解析の場合のみ、ユーザー演奏とお手本の解析を共有プロセスプールで並列に実行する
+        user_contour, ref_contour = run_parallel([
+            (extract_user_contour, (user_audio,), {"engine": engine, "features": True}),
+            (load_reference_contour, (reference_audio_path,), {"engine": reference_engine}),
+        ])
+    return compare_pitch_contours(user_contour, ref_contour)
+
+
+def compare_pitches_and_create_graph(user_audio, reference_audio_path, engine=DEFAULT_ENGINE, reference_engine=DEFAULT_ENGINE):
+    """
+    ユーザーの演奏とお手本演奏のピッチを比較し、グラフとスコアを生成する。
+    描画は pitch_render に任せる。グラフが不要な場合は compare_pitches を使うこと。
+    """
+    result, message = compare_pitches(user_audio, reference_audio_path, engine=engine, reference_engine=reference_engine)
+    if result is None:
+        return None, message
+    return comparison_figure(result), message
@@ -0,0 +1,168 @@
+# pitch_engines.py
+"""
+ピッチ推定エンジン。
+
+全てのエンジンは同じインターフェース
+    engine(y, sr, fmin, fmax, hop_length, frame_length) -> (f0, voiced_flag)
+を持ち、フレームは librosa.pyin と同じく center=True (フレーム i の中心 = i * hop_length)
+で並ぶ。無声フレームの f0 は NaN。
+
+- pyin: librosa.pyin (確率的YIN + Viterbi)。最も正確だが最も遅い。お手本の事前解析向け。
+- yin:  フレームをまとめてFFTで計算するYIN。Viterbi平滑化なし。
+- acf:  STFTのパワースペクトルから自己相関を求める(ウィーナー=ヒンチンの定理)。最速。
+"""
+
+import librosa
+import numpy as np
+
+DEFAULT_ENGINE = "pyin"
+FRAME_LENGTH = 2048
+
+# YINの判定しきい値 (累積平均正規化差分関数)
+YIN_THRESHOLD = 0.1
+YIN_VOICING_THRESHOLD = 0.25
+# 正規化自己相関のピーク判定
+ACF_VOICING_THRESHOLD = 0.5
+ACF_PEAK_RATIO = 0.9
+# これより小さいフレームは無音として扱う (dBFS)
+SILENCE_DB = -50.0
+
+
+def _frames(y, frame_length, hop_length):
+    """librosa.pyin と同じ位置(中心揃え・ゼロ詰め)でフレームを切り出す。shape=(n_frames, frame_length)"""
+    padding = frame_length // 2
+    y_padded = np.pad(y, (padding, padding), mode='constant')
+    n_frames = 1 + len(y) // hop_length
+    return np.lib.stride_tricks.sliding_window_view(y_padded, frame_length)[::hop_length][:n_frames]
+
+
+def _parabolic_offset(values, idx):
+    """
+    values[:, idx-1], values[:, idx], values[:, idx+1] を通る放物線の頂点の位置ずれを返す。
+    idx は各行の整数インデックス (境界は呼び出し側で除外しておくこと)。
+    """
+    rows = np.arange(values.shape[0])
+    left = values[rows, idx - 1]
+    center = values[rows, idx]
+    right = values[rows, idx + 1]
+    denom = left - 2 * center + right
+    with np.errstate(divide='ignore', invalid='ignore'):
+        offset = np.where(np.abs(denom) > 1e-12, 0.5 * (left - right) / denom, 0.0)
+    return np.clip(offset, -1.0, 1.0)
+
+
+def _lag_range(sr, fmin, fmax, frame_length):
+    min_lag = max(1, int(np.floor(sr / fmax)))
+    max_lag = min(frame_length - 2, int(np.ceil(sr / fmin)))
+    return min_lag, max_lag
+
+
+def pyin_engine(y, sr, fmin, fmax, hop_length, frame_length=FRAME_LENGTH):
+    """librosa.pyin によるピッチ推定 (従来の実装)"""
+    f0, voiced_flag, _ = librosa.pyin(
+        y, fmin=fmin, fmax=fmax, sr=sr,
+        frame_length=frame_length, hop_length=hop_length
+    )
+    return f0, voiced_flag
+
+
+def yin_engine(y, sr, fmin, fmax, hop_length, frame_length=FRAME_LENGTH):
+    """全フレームを一括で処理するYIN。差分関数はFFTによる相互相関から求める。"""
+    min_lag, max_lag = _lag_range(sr, fmin, fmax, frame_length)
+    win_length = frame_length - max_lag - 1
+    frames = _frames(np.asarray(y, dtype=np.float64), frame_length, hop_length)
+
+    # d(tau) = e(0) + e(tau) - 2 * sum_j x[j] x[j+tau]   (j = 0 .. win_length-1)
+    n_fft = 1 << int(np.ceil(np.log2(frame_length + win_length)))
+    spec_full = np.fft.rfft(frames, n=n_fft, axis=1)
+    spec_head = np.fft.rfft(frames[:, :win_length], n=n_fft, axis=1)
+    cross = np.fft.irfft(spec_full * np.conj(spec_head), n=n_fft, axis=1)[:, :max_lag + 2]
+
+    energy = np.cumsum(np.pad(frames ** 2, ((0, 0), (1, 0))), axis=1)
+    lags = np.arange(max_lag + 2)
+    energy_lag = energy[:, lags + win_length] - energy[:, lags]
+    diff = np.maximum(energy_lag[:, :1] + energy_lag - 2 * cross, 0.0)
+
+    # 累積平均正規化差分関数 (CMNDF)
+    cumulative = np.cumsum(diff[:, 1:], axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cmndf = diff[:, 1:] * lags[1:] / cumulative
+    cmndf = np.concatenate([np.ones((len(frames), 1)), np.nan_to_num(cmndf, nan=1.0, posinf=1.0)], axis=1)
+
+    # しきい値を下回る最初の極小値。無ければ探索範囲内の最小値
+    search = cmndf[:, min_lag:max_lag + 1]
+    local_min = np.zeros_like(search, dtype=bool)
+    local_min[:, 1:-1] = (search[:, 1:-1] <= search[:, :-2]) & (search[:, 1:-1] < search[:, 2:])
+    below = local_min & (search < YIN_THRESHOLD)
+    first_below = np.argmax(below, axis=1)
+    best = np.where(below.any(axis=1), first_below, np.argmin(search, axis=1))
+    best = np.clip(best, 1, search.shape[1] - 2)
+
+    lag = min_lag + best + _parabolic_offset(search, best)
+    aperiodicity = search[np.arange(len(search)), best]
+    rms = np.sqrt(energy_lag[:, 0] / win_length)
+
+    voiced_flag = (aperiodicity < YIN_VOICING_THRESHOLD) & (librosa.amplitude_to_db(rms, ref=1.0) > SILENCE_DB)
+    f0 = np.where(voiced_flag, sr / lag, np.nan)
+    return f0, voiced_flag
+
+
+def _window_autocorrelation(frame_length, n_fft):
+    window = librosa.filters.get_window('hann', frame_length, fftbins=True)
+    acf = np.fft.irfft(np.abs(np.fft.rfft(window, n=n_fft)) ** 2, n=n_fft)[:frame_length]
+    return acf / acf[0], float(np.sum(window ** 2))
+
+
+def acf_pitch_from_power(power, sr, fmin, fmax, frame_length=FRAME_LENGTH):
+    """
+    STFTのパワースペクトル (n_fft//2+1, n_frames) からピッチを推定する。
+    n_fft は 2 * frame_length 以上 (循環相関による折り返しを避けるため) であること。
+    """
+    n_fft = 2 * (power.shape[0] - 1)
+    min_lag, max_lag = _lag_range(sr, fmin, fmax, frame_length)
+    acf = np.fft.irfft(power.T, n=n_fft, axis=1)[:, :max_lag + 2]
+    window_acf, window_energy = _window_autocorrelation(frame_length, n_fft)
+
+    energy = acf[:, :1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        normalized = np.nan_to_num(acf / energy / window_acf[:max_lag + 2])
+
+    # 最大ピークの ACF_PEAK_RATIO 倍以上ある最初の極大値 (オクターブ下の誤検出を防ぐ)
+    search = normalized[:, min_lag:max_lag + 1]
+    local_max = np.zeros_like(search, dtype=bool)
+    local_max[:, 1:-1] = (search[:, 1:-1] >= search[:, :-2]) & (search[:, 1:-1] > search[:, 2:])
+    strong = local_max & (search >= ACF_PEAK_RATIO * search.max(axis=1, keepdims=True))
+    best = np.where(strong.any(axis=1), np.argmax(strong, axis=1), np.argmax(search, axis=1))
+    best = np.clip(best, 1, search.shape[1] - 2)
+
+    lag = min_lag + best + _parabolic_offset(search, best)
+    clarity = search[np.arange(len(search)), best]
+    rms = np.sqrt(np.maximum(energy[:, 0], 0.0) / window_energy)
+
+    voiced_flag = (clarity > ACF_VOICING_THRESHOLD) & (librosa.amplitude_to_db(rms, ref=1.0) > SILENCE_DB)
+    f0 = np.where(voiced_flag, sr / lag, np.nan)
+    return f0, voiced_flag
+
+
+def acf_engine(y, sr, fmin, fmax, hop_length, frame_length=FRAME_LENGTH):
+    """STFT(ゼロ詰め2倍長)のパワースペクトルから自己相関を求めて一括推定する。"""
+    stft = librosa.stft(
+        np.asarray(y, dtype=np.float32), n_fft=2 * frame_length, win_length=frame_length,
+        hop_length=hop_length, window='hann', center=True
+    )
+    return acf_pitch_from_power(np.abs(stft) ** 2, sr, fmin, fmax, frame_length)
+
+
+PITCH_ENGINES = {
+    "pyin": pyin_engine,
+    "yin": yin_engine,
+    "acf": acf_engine,
+}
+
+
+def get_engine(name):
+    """エンジン名から推定関数を取得する。"""
+    try:
+        return PITCH_ENGINES[name]
+    except KeyError:
+        raise ValueError(f"未知のピッチ推定エンジンです: {name} (利用可能: {', '.join(PITCH_ENGINES)})")
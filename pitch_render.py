@@ -0,0 +1,186 @@
+# pitch_render.py
+"""
+ピッチ分析結果の描画レイヤー。
+
+pitch_analyzer は数値データ(辞書)だけを返し、グラフはここで作る。
+長い系列は LTTB (Largest-Triangle-Three-Buckets) で間引いてから描画し、
+PNGのバイト列として返す。pyplot を使わず Figure を直接作るため、
+描画後に Figure がどこにも残らない。同じ結果の再描画はキャッシュから返す。
+"""
+
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+
+import librosa
+import matplotlib.ticker as mticker
+import numpy as np
+from matplotlib.figure import Figure
+
+# 描画・保存する系列の最大点数
+MAX_POINTS = 1000
+PNG_DPI = 80
+_PNG_CACHE_SIZE = 64
+
+_png_cache = OrderedDict()
+_png_cache_lock = threading.Lock()
+
+
+def lttb_indices(x, y, n_out):
+    """
+    LTTB で残す点のインデックスを返す。先頭と末尾は常に残る。
+    n_out 以下の長さの系列は全ての点を返す。
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # 先頭と末尾を除いた点を n_out-2 個のバケツに分け、各バケツから1点ずつ選ぶ
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.intp)
+    selected = np.empty(n_out, dtype=np.intp)
+    selected[0], selected[-1] = 0, n - 1
+    prev = 0
+    for b in range(n_out - 2):
+        start, end = edges[b], max(edges[b + 1], edges[b] + 1)
+        next_start, next_end = end, max(edges[b + 2] if b + 2 < len(edges) else n, end + 1)
+        # 次のバケツの平均点と直前に選んだ点が作る三角形の面積が最大の点を選ぶ
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        area = np.abs(
+            (x[prev] - avg_x) * (y[start:end] - y[prev])
+            - (x[prev] - x[start:end]) * (avg_y - y[prev])
+        )
+        prev = start + int(np.argmax(area))
+        selected[b + 1] = prev
+    return selected
+
+
+def downsample(x, *series, max_points=MAX_POINTS):
+    """
+    共通のX軸を持つ系列をまとめて間引く。各系列の LTTB 結果の和集合を残すため、
+    どの系列の山や谷も失われない。
+    """
+    x = np.asarray(x)
+    keep = np.unique(np.concatenate([
+        lttb_indices(x, np.nan_to_num(np.asarray(s, dtype=np.float64)), max_points // max(len(series), 1))
+        for s in series
+    ]))
+    return (x[keep],) + tuple(np.asarray(s)[keep] for s in series)
+
+
+def compact_result(result, max_points=MAX_POINTS):
+    """
+    セッションに保持するための軽量な結果を返す。
+    系列は間引いて float32 にし、スコアや区間ごとの誤差はそのまま残す。
+    """
+    compact = {key: value for key, value in result.items() if not isinstance(value, np.ndarray)}
+    if "ref_times" in result:
+        ref_times, ref_midi, user_midi = downsample(
+            result["ref_times"], result["ref_midi"], result["user_midi"], max_points=max_points
+        )
+        compact.update(ref_times=ref_times, ref_midi=ref_midi, user_midi=user_midi)
+    elif "times" in result:
+        times, f0 = downsample(result["times"], result["f0"], max_points=max_points)
+        compact.update(times=times, f0=f0)
+    return {
+        key: value.astype(np.float32) if isinstance(value, np.ndarray) else value
+        for key, value in compact.items()
+    }
+
+
+def pitch_figure(result):
+    """analyze_pitch の結果 (times, f0) からピッチ分析グラフを作成する"""
+    times, f0 = downsample(result["times"], result["f0"])
+
+    fig = Figure(figsize=(10, 4))
+    ax = fig.subplots()
+    ax.plot(times, f0, 'o', markersize=2, label='Pitch (f0)')
+    ax.set_title('Pitch Analysis')
+    ax.set_xlabel('Time (s)')
+    ax.set_ylabel('Frequency (Hz)')
+    ax.set_yscale('log')
+    ax.yaxis.set_major_formatter(mticker.FuncFormatter(lambda x, pos: f"{int(x)}"))
+
+    # ギターの開放弦の周波数を参考にグリッド表示
+    for note, color in (('E2', 'r'), ('A2', 'g'), ('D3', 'b'), ('G3', 'c'), ('B3', 'm'), ('E4', 'y')):
+        ax.axhline(y=float(librosa.note_to_hz(note)), color=color, linestyle='--', linewidth=0.5, label=note)
+
+    ax.legend(loc='upper right')
+    ax.grid(True, which="both", ls="--", linewidth=0.5)
+    fig.tight_layout()
+    return fig
+
+
+def comparison_figure(result):
+    """compare_pitch_contours の結果から比較グラフを作成する"""
+    ref_times, ref_midi, user_midi = downsample(result["ref_times"], result["ref_midi"], result["user_midi"])
+
+    fig = Figure(figsize=(12, 6))
+    ax = fig.subplots()
+
+    # 1. お手本演奏のピッチを、ワーピング後の時間軸でプロット
+    ax.plot(ref_times, ref_midi, '-', label='Reference Pitch', color='dodgerblue', linewidth=1.5)
+
+    # 2. ユーザーの演奏を、同じワーピング後のお手本の時間軸でプロット
+    # 移調・チューニングのずれを補正した場合は、その量を凡例に示す
+    offset = result.get("offset_semitones", 0.0)
+    user_label = f'Your Pitch ({offset:+.1f} semitones)' if abs(offset) >= 0.05 else 'Your Pitch'
+    ax.plot(ref_times, user_midi, '-', label=user_label, color='tomato', linewidth=1.2, alpha=0.7)
+
+    ax.set_title(f'Pitch Comparison (Similarity Score: {result["score"]:.1f} / 100)')
+    ax.set_xlabel('Time (s)')
+    ax.set_ylabel('Pitch (MIDI Note Number)')
+    ax.legend()
+    ax.grid(True, linestyle='--', linewidth=0.5)
+    ax.yaxis.set_major_formatter(mticker.FuncFormatter(lambda x, pos: librosa.midi_to_note(x)))
+
+    fig.tight_layout()
+    return fig
+
+
+def figure_to_png(fig, dpi=PNG_DPI):
+    """Figure をPNGのバイト列にする"""
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', dpi=dpi)
+    return buffer.getvalue()
+
+
+def _result_digest(kind, result):
+    digest = hashlib.sha1(kind.encode('utf-8'))
+    for key in sorted(result):
+        value = result[key]
+        digest.update(key.encode('utf-8'))
+        if isinstance(value, np.ndarray):
+            digest.update(np.ascontiguousarray(value, dtype=np.float32).tobytes())
+        else:
+            digest.update(repr(value).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _render_cached(kind, result, make_figure):
+    key = _result_digest(kind, result)
+    with _png_cache_lock:
+        if key in _png_cache:
+            _png_cache.move_to_end(key)
+            return _png_cache[key]
+
+    png = figure_to_png(make_figure(result))
+
+    with _png_cache_lock:
+        _png_cache[key] = png
+        while len(_png_cache) > _PNG_CACHE_SIZE:
+            _png_cache.popitem(last=False)
+    return png
+
+
+def render_pitch_png(result):
+    """ピッチ分析グラフをPNGで返す (同じ結果はキャッシュから返す)"""
+    return _render_cached("pitch", result, pitch_figure)
+
+
+def render_comparison_png(result):
+    """比較グラフをPNGで返す (同じ結果はキャッシュから返す)"""
+    return _render_cached("comparison", result, comparison_figure)
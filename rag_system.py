@@ -4,21 +4,18 @@
 # import sys
 # sys.modules["sqlite3"] = sys.modules.pop("pysqlite3")
 
-from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
+from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_community.vectorstores import FAISS
 from langchain_core.documents import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-# BM25とEnsembleRetrieverを一時的に無効化
-# from langchain.retrievers import BM25Retriever, EnsembleRetriever 
 from langchain_core.retrievers import BaseRetriever
 from typing import List, Dict
 from langchain_core.runnables import RunnableLambda, RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser
 
 # 設定情報をconfig.pyからインポート
-from config import GOOGLE_API_KEY, EMBEDDING_MODEL, CHAT_MODEL, SAFETY_SETTINGS
-from data_loader import get_equipment_data # data_loaderを直接使用
+from config import GOOGLE_API_KEY, EMBEDDING_MODEL, EMBEDDING_BACKEND, CHAT_MODEL, SAFETY_SETTINGS
+from embedding_service import get_embedding_service
+from equipment_index import ALL_CATEGORIES, CATEGORIES, get_equipment_index
 
 # RAG x Agentsシステムをインポート
 from agent_system import GuitarEquipmentAgent
@@ -43,62 +40,30 @@ class RAGSystem:
             max_tokens=300,  # 応答長を制限して高速化
             timeout=10  # タイムアウトを短縮
         )
-        self.embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-        self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-        
+        # 埋め込みはエージェントと共有し、同じテキストはプロセス・デプロイをまたいで一度しか埋め込まない
+        self.embeddings = get_embedding_service(EMBEDDING_MODEL, backend=EMBEDDING_BACKEND)
+        # 全機材を1つにまとめたインデックス (エージェントと共有)
+        self.equipment_index = get_equipment_index(self.embeddings, self.embeddings.model_name)
+
         self.retrievers_by_guitarist = self._initialize_all_retrievers()
         
         # RAG x Agentsシステムを初期化
         self.agent_system = GuitarEquipmentAgent()
         # print(f"RAGSystem v{self.version} の初期化が完了しました。")
 
-    def _create_retriever(self, documents: List[Document]) -> BaseRetriever:
-        """【デバッグ用】FAISS Retrieverのみを構築する"""
-        if not documents:
-            class EmptyRetriever(BaseRetriever):
-                def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]: return []
-            return EmptyRetriever()
-
-        # FAISSによるセマンティック検索のみを行う
-        return FAISS.from_documents(documents, self.embeddings).as_retriever(search_kwargs={"k": 5})
-
     def _initialize_all_retrievers(self) -> Dict[str, Dict[str, BaseRetriever]]:
         """
-        全ギタリストのデータを読み込み、カテゴリ別にリトリーバーを構築する。
+        ギタリスト・カテゴリ別のリトリーバーを作る。
+        インデックスは全機材で1つだけ持ち、各リトリーバーはその中をギタリストとカテゴリで絞り込んで検索する。
+        検索は BM25 とベクトル検索のハイブリッド (製品名そのもの・1製品だけの型番のクエリは埋め込みを使わない)。
         """
-        all_retrievers = {}
-        for guitarist in self.guitarist_options:
-            documents = get_equipment_data(guitarist)
-
-            # --- データ検証ステップを追加 ---
-            for i, doc in enumerate(documents):
-                if not isinstance(doc.page_content, str):
-                    error_msg = (
-                        f"データ検証エラー: ギタリスト '{guitarist}' のデータに問題があります。\n"
-                        f"ドキュメントNo.{i} の page_content が文字列ではなく、{type(doc.page_content)} 型になっています。\n"
-                        f"問題のデータ内容: {doc.page_content}\n"
-                        f"data_loader.py または元のデータファイルを確認してください。"
-                    )
-                    raise TypeError(error_msg)
-            # --- データ検証ここまで ---
-            
-            chunked_documents = self.text_splitter.split_documents(documents)
-            
-            docs_by_category: Dict[str, List[Document]] = {"ギター": [], "アンプ": [], "エフェクター": []}
-            for doc in chunked_documents:
-                category = doc.metadata.get("category")
-                if category in docs_by_category:
-                    docs_by_category[category].append(doc)
-            docs_by_category["すべて"] = chunked_documents
-
-            guitarist_retrievers = {
-                # デバッグ用に単純化されたRetriever作成関数を呼ぶ
-                category: self._create_retriever(docs)
-                for category, docs in docs_by_category.items()
+        return {
+            guitarist: {
+                category: self.equipment_index.as_retriever(guitarist, category, k=5)
+                for category in [*CATEGORIES, ALL_CATEGORIES]
             }
-            all_retrievers[guitarist] = guitarist_retrievers
-            # print(f"  - {guitarist} のリトリーバーを構築しました。")
-        return all_retrievers
+            for guitarist in self.guitarist_options
+        }
 
     def create_rag_chain(self, guitarist: str, use_agent: bool = False):
         """
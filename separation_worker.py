@@ -0,0 +1,384 @@
+# separation_worker.py
+"""
+demucs のモデルを一度だけ読み込み、音源分離のジョブをキューで順に処理する常駐ワーカー。
+
+`python -m demucs` をファイルごとに起動すると、そのたびにインタプリタの起動・torch のインポート・
+モデルの読み込みが発生する。このワーカーはプロセス内のスレッドでモデルを保持し続けるため、
+複数の曲を分離してもモデルの読み込みは最初の1回だけで済む。
+
+    worker = get_separation_worker()
+    job = worker.submit("downloaded_audio/song.wav", on_progress=lambda job: print(job.stage, job.progress))
+    job.wait()
+    print(job.status, job.stems, job.error)
+
+出力のディレクトリ構成は demucs のCLIと同じ (<output_dir>/<model>/<曲名>/<stem>) で、
+保存するステムと形式 (FLAC / 16bit WAV) は stem_store の設定に従う。
+区間を指定した分離は曲全体の分離を上書きしないよう、<曲名>@<開始>-<終了> (track_dir_name) に保存する。
+
+start_sec/end_sec を指定すると、その区間 (前後に WINDOW_PADDING_SECONDS の余裕を付ける) だけを
+読み込んで分離する。長い入力は CHUNK_SECONDS ごとに読み込み・分離し、重なり部分をクロスフェードで
+つなぎながら (overlap-add) 順にファイルへ書き出すため、ピークメモリは入力の長さに依存しない。
+分離前の音量の正規化 (demucs のCLIと同じ) は、チャンクごとではなく区間全体の平均・標準偏差で行う。
+"""
+
+import atexit
+import itertools
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from stem_store import STEMS_TO_KEEP, open_stem_writer
+
+DEFAULT_MODEL = "htdemucs"
+DEFAULT_OUTPUT_DIR = 'separated_audio'
+
+# 一度に読み込んで分離する長さと、隣り合うチャンクの重なり (秒)
+CHUNK_SECONDS = 30.0
+CHUNK_OVERLAP_SECONDS = 2.0
+# 区間を指定した場合に前後へ加える余裕 (秒)。区間の端でもモデルが前後の文脈を使えるようにする
+WINDOW_PADDING_SECONDS = 2.0
+
+# 区間を指定した分離のディレクトリ名で、曲名と区間を区切る文字
+WINDOW_SEPARATOR = "@"
+
+_STOP = object()
+_job_ids = itertools.count(1)
+
+
+@dataclass
+class SeparationJob:
+    """
+    音源分離ジョブの状態と結果。
+
+    status は "queued" / "running" / "done" / "error"。
+    stage は処理中の段階 ("loading_model", "separating", "saving") で、
+    progress は 0.0〜1.0 の進捗。成功すると stems に {ステム名: 出力パス} が入る。
+    start_sec/end_sec が None の場合は曲の先頭/末尾まで分離する。
+    """
+    input_path: str
+    output_dir: str = DEFAULT_OUTPUT_DIR
+    start_sec: float = None
+    end_sec: float = None
+    job_id: int = field(default_factory=lambda: next(_job_ids))
+    status: str = "queued"
+    stage: str = "queued"
+    progress: float = 0.0
+    stems: dict = field(default_factory=dict)
+    track_dir: str = None
+    error: str = None
+    elapsed_sec: float = None
+    on_progress: object = field(default=None, repr=False)
+    _done: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """ジョブの完了 (成功または失敗) を待つ。タイムアウトした場合は False"""
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        """レポートやマニフェスト用の辞書"""
+        return {
+            "job_id": self.job_id, "input_path": self.input_path, "output_dir": self.output_dir,
+            "start_sec": self.start_sec, "end_sec": self.end_sec,
+            "status": self.status, "stems": dict(self.stems), "track_dir": self.track_dir, "error": self.error,
+            "elapsed_sec": self.elapsed_sec,
+        }
+
+
+class SeparationWorker:
+    """demucs のモデルを保持し、キューに入ったジョブを1件ずつ処理するワーカー"""
+
+    def __init__(self, model_name=DEFAULT_MODEL, device=None, keep_stems=STEMS_TO_KEEP):
+        """
+        :param model_name: demucs の学習済みモデル名
+        :param device: "cuda" / "cpu"。None なら利用可能ならGPUを使う
+        :param keep_stems: 保存するステム名。既定は stem_store.STEMS_TO_KEEP
+        """
+        self.model_name = model_name
+        self.device = device
+        self.keep_stems = tuple(keep_stems)
+        self._model = None
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """ワーカースレッドを起動する (submit 時にも自動で起動する)"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="separation-worker", daemon=True)
+                self._thread.start()
+        return self
+
+    def submit(self, input_path, output_dir=DEFAULT_OUTPUT_DIR, on_progress=None, start_sec=None, end_sec=None):
+        """
+        分離ジョブをキューに入れ、すぐに SeparationJob を返す。
+
+        :param on_progress: 進捗が更新されるたびに job を引数に呼ばれる関数 (ワーカースレッドから呼ばれる)
+        :param start_sec: 分離する区間の開始 (秒)。None なら曲の先頭から
+        :param end_sec: 分離する区間の終了 (秒)。None なら曲の末尾まで
+        """
+        job = SeparationJob(
+            input_path=input_path, output_dir=output_dir, start_sec=start_sec, end_sec=end_sec,
+            on_progress=on_progress
+        )
+        self.start()
+        self._queue.put(job)
+        return job
+
+    def separate(self, input_path, output_dir=DEFAULT_OUTPUT_DIR, on_progress=None, start_sec=None, end_sec=None, timeout=None):
+        """分離ジョブを投入して完了まで待ち、SeparationJob を返す"""
+        job = self.submit(input_path, output_dir=output_dir, on_progress=on_progress, start_sec=start_sec, end_sec=end_sec)
+        job.wait(timeout)
+        return job
+
+    def close(self, wait=True):
+        """キューに残ったジョブを処理してからワーカーを停止する"""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread.is_alive():
+            self._queue.put(_STOP)
+            if wait:
+                thread.join()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is _STOP:
+                return
+            started = time.perf_counter()
+            job.status = "running"
+            try:
+                self._process(job)
+                job.status = "done"
+                self._report(job, "done", 1.0)
+            except Exception as e:
+                job.status = "error"
+                job.error = f"{e.__class__.__name__}: {e}"
+                print(f"Error separating '{job.input_path}': {job.error}")
+                self._report(job, "error", job.progress)
+            finally:
+                job.elapsed_sec = round(time.perf_counter() - started, 3)
+                job._done.set()
+
+    def _report(self, job, stage, progress):
+        job.stage, job.progress = stage, progress
+        if job.on_progress is not None:
+            try:
+                job.on_progress(job)
+            except Exception as e:
+                print(f"Error in separation progress callback: {e}")
+
+    def _load_model(self):
+        """モデルを読み込む (ワーカースレッドで最初のジョブの前に1回だけ)"""
+        import torch
+        from demucs.pretrained import get_model
+
+        if self.device is None:
+            self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        model = get_model(self.model_name)
+        model.to(self.device)
+        model.eval()
+        self._model = model
+
+    def _process(self, job):
+        if not os.path.exists(job.input_path):
+            raise FileNotFoundError(f"入力ファイルが見つかりません: {job.input_path}")
+        if self._model is None:
+            self._report(job, "loading_model", 0.0)
+            self._load_model()
+
+        import torch
+        from demucs.apply import apply_model
+        from demucs.audio import AudioFile
+
+        model = self._model
+        sr = model.samplerate
+        audio_file = AudioFile(job.input_path)
+
+        # 分離する範囲 (前後の余裕を含む) と、書き出す範囲 (指定された区間) をサンプル数で求める
+        duration = audio_file.duration()
+        start_sec = max(0.0, job.start_sec or 0.0)
+        end_sec = min(duration, job.end_sec) if job.end_sec is not None else duration
+        if end_sec <= start_sec:
+            raise ValueError(f"分離する区間が空です: {start_sec:.2f}〜{end_sec:.2f}秒 (曲の長さ {duration:.2f}秒)")
+        window_start = max(0.0, start_sec - WINDOW_PADDING_SECONDS)
+        window_end = min(duration, end_sec + WINDOW_PADDING_SECONDS)
+        n_window = int(round((window_end - window_start) * sr))
+
+        # 保存するステム (stem_store.STEMS_TO_KEEP) だけ書き込み先を開き、それ以外は捨てる
+        track_dir = os.path.join(job.output_dir, self.model_name, track_dir_name(job.input_path, job.start_sec, job.end_sec))
+        sinks = [
+            open_stem_writer(track_dir, name, sr, model.audio_channels) if name in self.keep_stems else None
+            for name in model.sources
+        ]
+        writer = OverlapAddWriter(
+            sinks, overlap=int(CHUNK_OVERLAP_SECONDS * sr),
+            trim_start=int(round((start_sec - window_start) * sr)),
+            trim_end=int(round((end_sec - window_start) * sr)),
+        )
+        chunk_size = int(CHUNK_SECONDS * sr)
+        chunks = chunk_bounds(n_window, chunk_size, int(CHUNK_OVERLAP_SECONDS * sr))
+
+        def read(lo, hi):
+            wav = audio_file.read(
+                seek_time=window_start + lo / sr, duration=(hi - lo) / sr,
+                streams=0, samplerate=sr, channels=model.audio_channels
+            )
+            # 読み込み誤差で長さが1〜2サンプルずれることがあるので、チャンクの長さに揃える
+            return torch.nn.functional.pad(wav[:, :hi - lo], (0, max(0, (hi - lo) - wav.shape[-1])))
+
+        try:
+            # demucs のCLIと同じく、音量を正規化してから分離し、元に戻す。
+            # 統計量をチャンクごとに求めるとチャンクの境目で音量が段差になるため、先に区間全体を1回読んで求める
+            self._report(job, "separating", 0.0)
+            mean, std = normalization_stats(
+                read(lo, hi).mean(0).numpy() for lo, hi in chunk_bounds(n_window, chunk_size, 0)
+            )
+            for k, (lo, hi) in enumerate(chunks):
+                self._report(job, "separating", 0.05 + 0.9 * k / len(chunks))
+                wav = read(lo, hi)
+                with torch.no_grad():
+                    sources = apply_model(
+                        model, ((wav - mean) / std)[None], device=self.device, split=True, overlap=0.25, progress=False
+                    )[0]
+                writer.add((sources * std + mean).cpu().numpy())
+            self._report(job, "saving", 0.95)
+            writer.close()
+        finally:
+            for sink in sinks:
+                if sink is not None:
+                    sink.close()
+        job.stems.update((name, sink.name) for name, sink in zip(model.sources, sinks) if sink is not None)
+        job.track_dir = track_dir
+
+
+def window_label(start_sec=None, end_sec=None):
+    """分離する区間を表す文字列 (例: "12.5-45", "0-end")。区間を指定しない場合は None"""
+    if start_sec is None and end_sec is None:
+        return None
+    end = "end" if end_sec is None else f"{end_sec:g}"
+    return f"{start_sec or 0:g}-{end}"
+
+
+def track_dir_name(input_path, start_sec=None, end_sec=None):
+    """ステムを保存するディレクトリ名。曲名 (入力ファイル名) に、区間を指定した場合は '@<区間>' を付ける"""
+    name = os.path.splitext(os.path.basename(input_path))[0]
+    label = window_label(start_sec, end_sec)
+    return name if label is None else f"{name}{WINDOW_SEPARATOR}{label}"
+
+
+def chunk_bounds(n_samples, chunk_size, overlap):
+    """
+    長さ n_samples を、隣と overlap サンプルずつ重なる chunk_size 以下のチャンクに分ける。
+    最後のチャンクも overlap より長くなるように分割数を決める。[(開始, 終了), ...] を返す。
+    """
+    if n_samples <= chunk_size:
+        return [(0, n_samples)]
+    hop = chunk_size - overlap
+    n_chunks = -(-(n_samples - overlap) // hop)
+    return [(k * hop, min(k * hop + chunk_size, n_samples)) for k in range(n_chunks)]
+
+
+def normalization_stats(blocks):
+    """
+    モノラルのブロックを順に受け取り、全体の平均と標準偏差 (torch.std と同じ不偏推定 + 1e-8) を返す。
+    和と二乗和だけを float64 で足し合わせるので、全体を一度にメモリに載せる必要はない。
+    """
+    count, total, total_sq = 0, 0.0, 0.0
+    for block in blocks:
+        block = np.asarray(block, dtype=np.float64)
+        count += block.size
+        total += float(block.sum())
+        total_sq += float(np.square(block).sum())
+    if count == 0:
+        return 0.0, 1e-8
+    mean = total / count
+    variance = max(0.0, total_sq - count * mean * mean) / max(count - 1, 1)
+    return mean, float(np.sqrt(variance)) + 1e-8
+
+
+class OverlapAddWriter:
+    """
+    chunk_bounds の順に分離したチャンク (ステム数 × チャンネル数 × サンプル数) を受け取り、
+    重なり部分をクロスフェードでつないで、確定した部分から順に書き出す。書き込み先が None のステムは捨てる。
+    保持するのは直前のチャンクの重なり部分だけなので、メモリは曲の長さに依存しない。
+    """
+
+    def __init__(self, sinks, overlap, trim_start=0, trim_end=None):
+        """
+        :param sinks: ステムごとの書き込み先 (write((サンプル数, チャンネル数)) を持つもの。soundfile.SoundFile など)
+        :param overlap: 隣り合うチャンクの重なり (サンプル数)
+        :param trim_start: 書き出す範囲の開始 (最初のチャンクの先頭からのサンプル数)
+        :param trim_end: 書き出す範囲の終了。None なら最後まで
+        """
+        self.sinks = sinks
+        self.overlap = overlap
+        self.trim_start = trim_start
+        self.trim_end = trim_end
+        self._tail = None
+        self._position = 0
+        # 重なり部分の重み (和が常に1になる)
+        self._fade_in = np.linspace(0.0, 1.0, overlap + 2, dtype=np.float32)[1:-1]
+
+    def add(self, block):
+        block = np.asarray(block, dtype=np.float32)
+        if self._tail is not None:
+            head = block[..., :self.overlap]
+            block = block.copy()
+            block[..., :self.overlap] = self._tail * (1.0 - self._fade_in) + head * self._fade_in
+        # 重なり部分は次のチャンクと混ぜてから書き出す
+        split = max(0, block.shape[-1] - self.overlap)
+        self._emit(block[..., :split])
+        self._tail = block[..., split:]
+
+    def close(self):
+        if self._tail is not None:
+            self._emit(self._tail)
+            self._tail = None
+
+    def _emit(self, block):
+        start, end = self._position, self._position + block.shape[-1]
+        self._position = end
+        lo = max(start, self.trim_start)
+        hi = end if self.trim_end is None else min(end, self.trim_end)
+        if hi <= lo:
+            return
+        for sink, source in zip(self.sinks, block[..., lo - start:hi - start]):
+            if sink is not None:
+                sink.write(source.T)
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_separation_worker(model_name=DEFAULT_MODEL):
+    """共有のワーカーを返す。初回呼び出し時に作成し、モデル名が変わった場合は作り直す。"""
+    global _worker
+    with _worker_lock:
+        if _worker is None or _worker.model_name != model_name:
+            if _worker is not None:
+                _worker.close()
+            _worker = SeparationWorker(model_name=model_name)
+        return _worker
+
+
+def shutdown_separation_worker():
+    """共有のワーカーを停止する。"""
+    global _worker
+    with _worker_lock:
+        if _worker is not None:
+            _worker.close(wait=False)
+            _worker = None
+
+
+atexit.register(shutdown_separation_worker)
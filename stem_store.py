@@ -0,0 +1,259 @@
+# stem_store.py
+"""
+分離したステムの保存と読み込み。
+
+demucs は4つのステム (bass, drums, other, vocals) を出力するが、アプリが使うのはギターを含む
+other だけなので、STEMS_TO_KEEP に含まれるステムだけを保存する。保存形式は可逆圧縮の FLAC
+(既定) か 16bit PCM の WAV。読み込みは soundfile でシークして必要な区間だけをデコードする。
+
+再生用には、モノラル・低サンプルレートの圧縮音声 (プレビュー) と、波形表示用のピーク
+(一定サンプルごとの最小値・最大値) を別ファイルで用意する。解析には元のステムを使う。
+
+設定は環境変数で変更できる:
+    STEMS_TO_KEEP=other,vocals  保存するステム (カンマ区切り)
+    STEM_FORMAT=wav             保存形式 ("flac" / "wav")
+
+既存の分離結果を変換するには:
+    python stem_store.py separated_audio
+"""
+
+import argparse
+import functools
+import io
+import json
+import os
+import sys
+
+import numpy as np
+import soundfile as sf
+
+STEMS_TO_KEEP = tuple(name.strip() for name in os.getenv("STEMS_TO_KEEP", "other").split(",") if name.strip())
+STEM_FORMAT = os.getenv("STEM_FORMAT", "flac").lower()
+
+_FORMATS = {
+    # 形式名: (拡張子, soundfile の format, MIMEタイプ)
+    "flac": (".flac", "FLAC", "audio/flac"),
+    "wav": (".wav", "WAV", "audio/wav"),
+}
+# ステムのサンプル形式 (FLAC / WAV 共通)
+STEM_SUBTYPE = 'PCM_16'
+# 読み込み時に探す拡張子 (優先順)
+STEM_EXTENSIONS = tuple(ext for ext, _, _ in _FORMATS.values())
+
+# プレビューの形式: (拡張子, soundfile の format, subtype, MIMEタイプ)。
+# MP3 はブラウザの対応が広いが libsndfile 1.1 以降でしか書けないため、無ければ Ogg Vorbis にする
+PREVIEW_FORMATS = (
+    (".mp3", "MP3", "MPEG_LAYER_III", "audio/mpeg"),
+    (".ogg", "OGG", "VORBIS", "audio/ogg"),
+)
+PREVIEW_SR = 22050
+# 0.0 (高音質) 〜 1.0 (高圧縮)。22.05kHz モノラルで 40kbps 前後になる
+PREVIEW_COMPRESSION = 0.8
+# 波形のピーク1点あたりのサンプル数 (44.1kHz で 1秒あたり約 86 点)
+PEAKS_SAMPLES_PER_PIXEL = 512
+
+
+def _format(fmt):
+    try:
+        return _FORMATS[fmt]
+    except KeyError:
+        raise ValueError(f"未知のステム保存形式です: {fmt} (利用可能: {', '.join(_FORMATS)})")
+
+
+def find_stem(track_dir, stem="other"):
+    """トラックのディレクトリから指定したステムのファイルを探す。無ければ None"""
+    for ext in STEM_EXTENSIONS:
+        path = os.path.join(track_dir, f"{stem}{ext}")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def open_stem_writer(track_dir, stem, samplerate, channels, fmt=STEM_FORMAT):
+    """
+    ステムを書き込む soundfile.SoundFile を開く (16bit)。
+    他の形式で保存された同じステムがあれば削除し、読み込み時に古いファイルを拾わないようにする。
+    """
+    ext, sf_format, _ = _format(fmt)
+    os.makedirs(track_dir, exist_ok=True)
+    for other_ext in STEM_EXTENSIONS:
+        old_path = os.path.join(track_dir, f"{stem}{other_ext}")
+        if other_ext != ext and os.path.exists(old_path):
+            os.remove(old_path)
+    path = os.path.join(track_dir, f"{stem}{ext}")
+    return sf.SoundFile(path, 'w', samplerate=samplerate, channels=channels, format=sf_format, subtype=STEM_SUBTYPE)
+
+
+def load_audio(source, sr=None, start_sec=None, end_sec=None, mono=True):
+    """
+    音声を float32 で読み込む。start_sec/end_sec を指定すると、その区間だけをデコードする。
+
+    :param source: ファイルパスまたはファイルライクオブジェクト
+    :param sr: 出力のサンプルレート。None なら元のサンプルレート
+    :return: (音声, サンプルレート)。mono=False の場合、音声は (チャンネル数, サンプル数)
+    """
+    try:
+        with sf.SoundFile(source) as f:
+            native_sr = f.samplerate
+            start = int(round((start_sec or 0.0) * native_sr))
+            stop = f.frames if end_sec is None else min(f.frames, int(round(end_sec * native_sr)))
+            f.seek(min(start, f.frames))
+            y = f.read(max(0, stop - start), dtype='float32', always_2d=True).T
+    except (RuntimeError, TypeError):
+        # soundfile で読めない形式 (一部の mp3/m4a など) は librosa (audioread) で読む
+        import librosa
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        offset = start_sec or 0.0
+        duration = None if end_sec is None else max(0.0, end_sec - offset)
+        y, native_sr = librosa.load(source, sr=None, mono=False, offset=offset, duration=duration)
+        y = np.atleast_2d(y).astype(np.float32)
+
+    if mono:
+        y = y.mean(axis=0)
+    if sr is not None and sr != native_sr:
+        import librosa
+        y = librosa.resample(y, orig_sr=native_sr, target_sr=sr)
+        native_sr = sr
+    return y, native_sr
+
+
+@functools.lru_cache(maxsize=16)
+def _encoded_range(path, mtime_ns, start_sec, end_sec):
+    with sf.SoundFile(path) as f:
+        sr = f.samplerate
+        fmt = "flac" if f.format == "FLAC" else "wav"
+    y, _ = load_audio(path, start_sec=start_sec, end_sec=end_sec, mono=False)
+    _, sf_format, mime = _format(fmt)
+    buffer = io.BytesIO()
+    sf.write(buffer, y.T, sr, format=sf_format, subtype=STEM_SUBTYPE)
+    return buffer.getvalue(), mime
+
+
+def stem_media(path, start_sec=None, end_sec=None):
+    """
+    プレーヤー (st.audio) に渡すための (バイト列, MIMEタイプ) を返す。
+    区間を指定しない場合はファイルをそのまま返し、指定した場合はその区間だけを同じ形式で切り出す。
+    切り出した結果はファイルが更新されるまでメモリにキャッシュする。
+    """
+    if start_sec is None and end_sec is None:
+        ext = os.path.splitext(path)[1].lower()
+        mime = next((m for e, _, m in _FORMATS.values() if e == ext), "audio/wav")
+        with open(path, 'rb') as f:
+            return f.read(), mime
+    return _encoded_range(path, os.stat(path).st_mtime_ns, start_sec, end_sec)
+
+
+def preview_format():
+    """この環境で書き出せるプレビューの形式 (拡張子, format, subtype, MIMEタイプ)"""
+    available = sf.available_formats()
+    return next(fmt for fmt in PREVIEW_FORMATS if fmt[1] in available)
+
+
+def write_preview(source_path, output_base, sr=PREVIEW_SR, compression=PREVIEW_COMPRESSION):
+    """
+    再生用のプレビュー (モノラル・低サンプルレートの圧縮音声) を書き出す。
+    :param output_base: 拡張子を除いた出力パス (拡張子は形式に合わせて付ける)
+    :return: (プレビューのパス, MIMEタイプ)
+    """
+    ext, sf_format, subtype, mime = preview_format()
+    y, _ = load_audio(source_path, sr=sr)
+    path = output_base + ext
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    sf.write(path, y, sr, format=sf_format, subtype=subtype, compression_level=compression)
+    return path, mime
+
+
+def compute_peaks(source_path, samples_per_pixel=PEAKS_SAMPLES_PER_PIXEL):
+    """
+    波形表示用のピークを求める。ブロックごとに読むので、メモリは音源の長さに依存しない。
+    形式は audiowaveform の JSON (8bit) に合わせ、data は [最小, 最大, 最小, 最大, ...] (-128〜127)。
+    """
+    mins, maxs = [], []
+    with sf.SoundFile(source_path) as f:
+        sr = f.samplerate
+        # 1ブロックを samples_per_pixel の倍数にして、ピークの区切りをブロック間で揃える
+        for block in f.blocks(blocksize=samples_per_pixel * 256, dtype='float32', always_2d=True):
+            mono = block.mean(axis=1)
+            n = -(-len(mono) // samples_per_pixel)
+            padded = np.pad(mono, (0, n * samples_per_pixel - len(mono)), mode='edge').reshape(n, samples_per_pixel)
+            mins.append(padded.min(axis=1))
+            maxs.append(padded.max(axis=1))
+    lo = np.concatenate(mins) if mins else np.zeros(0, dtype=np.float32)
+    hi = np.concatenate(maxs) if maxs else np.zeros(0, dtype=np.float32)
+    data = np.empty(2 * len(lo), dtype=np.int8)
+    data[0::2] = np.clip(np.round(lo * 128), -128, 127)
+    data[1::2] = np.clip(np.round(hi * 128), -128, 127)
+    return {
+        "version": 2, "channels": 1, "sample_rate": sr, "samples_per_pixel": samples_per_pixel,
+        "bits": 8, "length": len(lo), "data": data.tolist(),
+    }
+
+
+def write_peaks(source_path, output_path, samples_per_pixel=PEAKS_SAMPLES_PER_PIXEL):
+    """compute_peaks の結果を JSON で書き出し、そのパスを返す"""
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(compute_peaks(source_path, samples_per_pixel), f, separators=(',', ':'))
+    return output_path
+
+
+def load_peaks(path):
+    """write_peaks で保存したピークを読み込む。:return: (最小値, 最大値, 1点あたりの秒数)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        peaks = json.load(f)
+    data = np.asarray(peaks["data"], dtype=np.float32) / 128.0
+    return data[0::2], data[1::2], peaks["samples_per_pixel"] / peaks["sample_rate"]
+
+
+def compact_track(track_dir, keep=STEMS_TO_KEEP, fmt=STEM_FORMAT):
+    """
+    既存の分離結果を変換する。keep 以外のステムを削除し、残すステムを fmt 形式 (16bit) で保存し直す。
+    :return: (変換前のバイト数, 変換後のバイト数)
+    """
+    ext, _, _ = _format(fmt)
+    before = after = 0
+    for name in sorted(os.listdir(track_dir)):
+        stem, file_ext = os.path.splitext(name)
+        if file_ext.lower() not in STEM_EXTENSIONS:
+            continue
+        path = os.path.join(track_dir, name)
+        before += os.path.getsize(path)
+        if stem not in keep:
+            os.remove(path)
+            continue
+        # 拡張子が同じでも、demucs のCLIが書いた float32 の WAV などは 16bit に変換し直す
+        if file_ext.lower() != ext or sf.info(path).subtype != STEM_SUBTYPE:
+            y, sr = load_audio(path, mono=False)
+            # 書き込みが終わってから元のファイルを消すため、一時ファイル経由で保存する
+            tmp_path = os.path.join(track_dir, f".{stem}.tmp{ext}")
+            sf.write(tmp_path, y.T, sr, format=_format(fmt)[1], subtype=STEM_SUBTYPE)
+            os.remove(path)
+            path = os.path.join(track_dir, f"{stem}{ext}")
+            os.replace(tmp_path, path)
+        after += os.path.getsize(path)
+    return before, after
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="分離済みのステムを必要なものだけ残して圧縮形式に変換します。")
+    parser.add_argument("root", nargs='?', default="separated_audio", help="分離結果のディレクトリ")
+    parser.add_argument("--keep", default=",".join(STEMS_TO_KEEP), help="残すステム (カンマ区切り)")
+    parser.add_argument("--format", default=STEM_FORMAT, choices=sorted(_FORMATS), help="保存形式")
+    args = parser.parse_args(argv)
+
+    keep = tuple(name.strip() for name in args.keep.split(",") if name.strip())
+    total_before = total_after = 0
+    for dirpath, _, filenames in os.walk(args.root):
+        if not any(name.lower().endswith(STEM_EXTENSIONS) for name in filenames):
+            continue
+        before, after = compact_track(dirpath, keep=keep, fmt=args.format)
+        total_before += before
+        total_after += after
+        print(f"  {dirpath}: {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB")
+    print(f"合計: {total_before / 1e6:.1f} MB -> {total_after / 1e6:.1f} MB")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,66 @@
+# test_analysis_pool.py
+"""
+解析用プロセスプール (analysis_pool) のフォールバックのテスト。
+
+    python -m pytest test_analysis_pool.py
+"""
+
+import os
+
+import pytest
+
+import analysis_pool
+
+_PARENT_PID = os.getpid()
+
+
+def _square(x):
+    return x * x
+
+
+def _pid(_):
+    return os.getpid()
+
+
+def _exit_in_worker(x):
+    """ワーカーの中でだけ異常終了する (順番に実行し直した場合は値を返す)"""
+    if os.getpid() != _PARENT_PID:
+        os._exit(1)
+    return x
+
+
+def _fail(x):
+    raise ValueError(f"bad input: {x}")
+
+
+@pytest.fixture(autouse=True)
+def _workers(monkeypatch):
+    monkeypatch.setattr(analysis_pool, "ANALYSIS_WORKERS", 2)
+    yield
+    analysis_pool.shutdown_process_pool()
+
+
+def test_tasks_run_in_worker_processes():
+    assert analysis_pool.run_parallel([(_square, (2,)), (_square, (3,), {})]) == [4, 9]
+    assert _PARENT_PID not in analysis_pool.run_parallel([(_pid, (0,)), (_pid, (1,))])
+
+
+def test_pool_creation_failure_falls_back_to_serial(monkeypatch):
+    def unavailable():
+        raise OSError("no /dev/shm")
+
+    monkeypatch.setattr(analysis_pool, "get_process_pool", unavailable)
+    assert analysis_pool.run_parallel([(_pid, (0,)), (_pid, (1,))]) == [_PARENT_PID, _PARENT_PID]
+
+
+def test_broken_pool_falls_back_to_serial_and_is_recreated():
+    assert analysis_pool.run_parallel([(_exit_in_worker, (1,)), (_exit_in_worker, (2,))]) == [1, 2]
+    # 壊れたプールは破棄され、次の呼び出しでは新しいプールが使われる
+    assert analysis_pool.run_parallel([(_square, (2,)), (_square, (3,))]) == [4, 9]
+
+
+def test_task_exceptions_propagate_without_serial_rerun():
+    pool = analysis_pool.get_process_pool()
+    with pytest.raises(ValueError, match="bad input"):
+        analysis_pool.run_parallel([(_fail, (1,)), (_square, (2,))])
+    assert analysis_pool.get_process_pool() is pool
@@ -0,0 +1,163 @@
+# test_asset_pipeline.py
+"""
+差分ビルド (asset_pipeline.Pipeline) とアセット台帳のテスト。ダウンロードや音源分離は行わず、ファイルを書くだけのノードを使う。
+
+    python -m pytest test_asset_pipeline.py
+"""
+
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import soundfile as sf
+
+import asset_pipeline
+import asset_registry
+from asset_pipeline import Node, Pipeline, phrase_nodes
+
+
+class _Chain:
+    """source → double → total の3ノード。実行回数を数える"""
+
+    def __init__(self, directory, source_text="1 2 3"):
+        self.directory = directory
+        self.source_text = source_text
+        self.runs = []
+
+    def _write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def nodes(self, scale=2):
+        def source(inputs):
+            self.runs.append("source")
+            return {"numbers": self._write("numbers.txt", self.source_text)}
+
+        def double(inputs):
+            self.runs.append("double")
+            with open(inputs["source"]["numbers"]) as f:
+                values = [int(v) * scale for v in f.read().split()]
+            return {"doubled": self._write("doubled.txt", " ".join(map(str, values)))}
+
+        def total(inputs):
+            self.runs.append("total")
+            with open(inputs["double"]["doubled"]) as f:
+                # 入力が変わっても合計が同じなら出力の内容も同じになる
+                return {"total": self._write("total.txt", str(sum(int(v) for v in f.read().split())))}
+
+        return [
+            Node("source", source, params={"text": self.source_text}),
+            Node("double", double, deps=("source",), params={"scale": scale}),
+            Node("total", total, deps=("double",)),
+        ]
+
+
+def _statuses(results):
+    return {result.node: result.status for result in results}
+
+
+def test_second_run_reuses_every_node(tmp_path):
+    chain = _Chain(str(tmp_path))
+    state_path = str(tmp_path / "state.json")
+    assert set(_statuses(Pipeline(state_path).run("a", chain.nodes())).values()) == {"built"}
+
+    chain.runs.clear()
+    results = Pipeline(state_path).run("a", chain.nodes())
+    assert set(_statuses(results).values()) == {"fresh"}
+    assert chain.runs == []
+    assert open(results[-1].outputs["total"]).read() == "12"
+
+
+def test_only_stale_nodes_are_rebuilt(tmp_path):
+    chain = _Chain(str(tmp_path))
+    pipeline = Pipeline(str(tmp_path / "state.json"))
+    pipeline.run("a", chain.nodes())
+
+    # パラメータが変わったノードと、その下流だけを実行し直す
+    chain.runs.clear()
+    assert _statuses(pipeline.run("a", chain.nodes(scale=3))) == {"source": "fresh", "double": "built", "total": "built"}
+    assert chain.runs == ["double", "total"]
+
+    # 出力ファイルが書き換えられたら、そのノードを実行し直す
+    chain.runs.clear()
+    with open(tmp_path / "numbers.txt", 'w') as f:
+        f.write("changed")
+    pipeline.run("a", chain.nodes(scale=3))
+    assert chain.runs == ["source"]  # 作り直した出力が前回と同じ内容なので下流は最新のまま
+
+
+def test_targets_are_independent_and_failures_block_downstream(tmp_path):
+    pipeline = Pipeline(str(tmp_path / "state.json"))
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    first = _Chain(str(tmp_path / "a"))
+    pipeline.run("a", first.nodes())
+
+    # 別のターゲットを追加しても既存のターゲットは再実行しない
+    second = _Chain(str(tmp_path / "b"), source_text="4 5")
+    assert set(_statuses(pipeline.run("b", second.nodes())).values()) == {"built"}
+    first.runs.clear()
+    assert set(_statuses(pipeline.run("a", first.nodes())).values()) == {"fresh"}
+
+    def broken(inputs):
+        raise RuntimeError("download failed")
+
+    nodes = second.nodes()
+    nodes[0] = Node("source", broken, params={"text": "other"})
+    results = pipeline.run("b", nodes)
+    assert _statuses(results) == {"source": "error", "double": "blocked", "total": "blocked"}
+    assert "download failed" in results[0].error
+
+
+def test_registry_is_built_on_first_use(tmp_path, monkeypatch):
+    # 台帳ファイルはリポジトリに含めないので、無ければ練習フレーズを scan して作る
+    from data_loader import PRACTICE_PHRASES
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(asset_registry, "_registry", None)
+    path = str(tmp_path / "asset_registry.json")
+    registry = asset_registry.get_asset_registry(path)
+    assert os.path.exists(path)
+    assert sorted(asset["guitarist"] for asset in registry) == sorted(PRACTICE_PHRASES)
+    assert asset_registry.get_asset_registry(path) is registry
+
+
+class _FakeSeparationWorker:
+    """demucs の代わりに、入力をそのまま other ステムとして保存する"""
+
+    def separate(self, input_path, output_dir, start_sec=None, end_sec=None):
+        y, sr = sf.read(input_path)
+        track_dir = os.path.join(output_dir, "htdemucs", "song")
+        os.makedirs(track_dir, exist_ok=True)
+        stem = os.path.join(track_dir, "other.flac")
+        sf.write(stem, y, sr, subtype='PCM_16')
+        return SimpleNamespace(status="done", stems={"other": stem}, error=None)
+
+
+def test_fresh_nodes_restore_cleared_registry_records(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(asset_pipeline, "get_separation_worker", lambda model_name: _FakeSeparationWorker())
+    sr = 22050
+    f0 = np.repeat([220.0, 247.0, 262.0, 294.0], sr // 4)
+    song = np.concatenate([np.zeros(sr // 2), 0.5 * np.sin(2 * np.pi * np.cumsum(f0) / sr), np.zeros(sr // 2)])
+    os.makedirs("downloaded_audio")
+    sf.write("downloaded_audio/song.wav", song, sr)
+
+    phrase = {"title": "song", "youtube_url": "https://www.youtube.com/watch?v=abc123", "start_sec": None, "end_sec": None}
+    registry = asset_registry.AssetRegistry(str(tmp_path / "registry.json"))
+    registry.register("abc123", "guitarist", "song", phrase["youtube_url"], "downloaded_audio/song.wav")
+    pipeline = Pipeline(str(tmp_path / "state.json"))
+    nodes = phrase_nodes("guitarist", phrase, registry, engine="acf")
+    assert set(_statuses(pipeline.run("abc123", nodes)).values()) == {"built"}
+    built = dict(registry.get("abc123"))
+    assert abs(built["reference"]["offset_sec"] - 0.5) < 0.05
+
+    # scan などでステムの記録が変わると、お手本・プレビュー・輪郭の記録は消される
+    registry.record_stems("abc123", {})
+    assert registry.get("abc123")["reference"] is None
+    assert set(_statuses(pipeline.run("abc123", nodes)).values()) == {"fresh"}
+    restored = registry.get("abc123")
+    for name in ("stems", "reference", "preview", "contours"):
+        assert restored[name] == built[name]
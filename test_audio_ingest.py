@@ -0,0 +1,45 @@
+# test_audio_ingest.py
+"""
+録音の取り込み (audio_ingest) のテスト。
+
+    python -m pytest test_audio_ingest.py
+"""
+
+import io
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from audio_ingest import AudioIngestError, ingest_audio
+
+
+def _recording(sr=48000, seconds=6.0, silence=1.0, channels=2, fmt='WAV'):
+    t = np.arange(int(seconds * sr)) / sr
+    tone = np.where((t >= silence) & (t < seconds - silence), 0.5 * np.sin(2 * np.pi * 220.0 * t), 0.0)
+    buffer = io.BytesIO()
+    sf.write(buffer, np.stack([tone] * channels, axis=1).astype(np.float32), sr, format=fmt, subtype='PCM_16')
+    buffer.seek(0)
+    return buffer
+
+
+def test_ingest_downmixes_resamples_and_trims():
+    audio = ingest_audio(_recording(), sr=44100)
+    assert audio.sr == 44100 and audio.source_sr == 48000 and audio.source_channels == 2
+    assert audio.samples.ndim == 1 and audio.samples.dtype == np.float32
+    # 前後1秒の無音を取り除く (判定はフレーム単位なので 0.1 秒の誤差を許す)
+    assert audio.duration_sec == pytest.approx(4.0, abs=0.1)
+    assert audio.trimmed_start_sec == pytest.approx(1.0, abs=0.1)
+    # リサンプル後も 220Hz のまま
+    spectrum = np.abs(np.fft.rfft(audio.samples))
+    assert np.fft.rfftfreq(len(audio.samples), 1 / 44100)[np.argmax(spectrum)] == pytest.approx(220.0, abs=1.0)
+
+
+def test_ingest_rejects_oversized_and_overlong_input():
+    recording = _recording(seconds=6.0)
+    with pytest.raises(AudioIngestError):
+        ingest_audio(recording, max_bytes=1000)
+    with pytest.raises(AudioIngestError):
+        ingest_audio(recording, max_duration_sec=5.0)
+    with pytest.raises(AudioIngestError):
+        ingest_audio(_recording(silence=3.0))
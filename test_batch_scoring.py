@@ -0,0 +1,74 @@
+# test_batch_scoring.py
+"""
+バッチ採点 (batch_scoring) のテスト。合成した短い演奏を使うので、ネットワークやAPIキーは不要。
+
+    python -m pytest test_batch_scoring.py
+"""
+
+import csv
+import os
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+import batch_scoring
+from audio_ingest import ingest_audio
+from pitch_analyzer import compare_pitch_contours, extract_user_contour, load_reference_contour
+
+# ユーザー演奏は取り込み時に INGEST_SR に揃うので、お手本も同じレートで書いてフレーム間隔を合わせる
+SR = 44100
+NOTES = [57, 59, 61, 62, 64, 66, 68, 69]
+
+
+def _melody(notes, note_sec=0.25, detune=0.0):
+    f0 = np.repeat(440.0 * 2 ** ((np.asarray(notes, dtype=float) + detune - 69) / 12), int(SR * note_sec))
+    return (0.5 * np.sin(2 * np.pi * np.cumsum(f0) / SR)).astype(np.float32)
+
+
+@pytest.fixture
+def takes(tmp_path, monkeypatch):
+    # お手本の輪郭キャッシュ (cache/contours) を一時ディレクトリに作る
+    monkeypatch.chdir(tmp_path)
+    reference = tmp_path / "reference.wav"
+    sf.write(reference, _melody(NOTES), SR)
+    # 別のディレクトリにある同じ名前の演奏 (お手本の一部分のフレーズで、片方は 0.3 半音ずれている)
+    paths = []
+    for name, detune in (("a", 0.0), ("b", 0.3)):
+        (tmp_path / name).mkdir()
+        path = tmp_path / name / "take.wav"
+        sf.write(path, _melody(NOTES[2:5], detune=detune), SR)
+        paths.append(str(path))
+    return str(reference), paths
+
+
+def test_scores_takes_like_interactive_scoring(takes, tmp_path):
+    reference, paths = takes
+    plot_dir = tmp_path / "plots"
+    records = list(batch_scoring.score_takes(
+        reference, paths, engine="acf", reference_engine="acf", workers=2, plot_dir=str(plot_dir)
+    ))
+
+    assert sorted(record["take"] for record in records) == paths
+    assert all("error" not in record for record in records)
+    # 同じファイル名でもグラフは別々に保存される
+    plots = {record["plot"] for record in records}
+    assert len(plots) == 2 and all(os.path.exists(p) for p in plots)
+
+    # 対話的な採点 (audio_ingest で取り込んでから解析) と同じスコアになる
+    ref_contour = load_reference_contour(reference, engine="acf")
+    for record in records:
+        contour = extract_user_contour(ingest_audio(record["take"]), engine="acf")
+        expected, _ = compare_pitch_contours(contour, ref_contour)
+        assert record["score"] == round(expected["score"], 2)
+        assert record["pitch_score"] > 80
+
+
+def test_write_report_csv(takes, tmp_path):
+    reference, paths = takes
+    report = tmp_path / "report.csv"
+    records = batch_scoring.score_takes(reference, paths, engine="acf", reference_engine="acf", workers=2)
+    assert batch_scoring.write_report(records, str(report)) == 2
+    with open(report, encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    assert sorted(row["take"] for row in rows) == paths
@@ -0,0 +1,93 @@
+# test_contour_cache.py
+"""
+ピッチ輪郭のディスクキャッシュ (contour_cache) のテスト。解析の代わりに呼び出し回数を数える関数を使う。
+
+    python -m pytest test_contour_cache.py
+"""
+
+import os
+
+import numpy as np
+
+from contour_cache import load_cached, load_or_compute
+
+
+class _Compute:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, path):
+        self.calls += 1
+        with open(path, 'rb') as f:
+            size = len(f.read())
+        return {"f0": np.full(4, size, dtype=np.float32), "voiced_flag": np.ones(4, dtype=bool)}
+
+
+def _entries(cache_dir):
+    (source_dir,) = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir)]
+    return [name for name in os.listdir(source_dir) if not name.startswith('.tmp-')]
+
+
+def test_hit_returns_memory_mapped_arrays(tmp_path):
+    audio = tmp_path / "a.wav"
+    audio.write_bytes(b"abc")
+    compute, cache_dir = _Compute(), str(tmp_path / "cache")
+
+    first = load_or_compute(str(audio), {"hop": 512}, compute, cache_dir=cache_dir)
+    second = load_or_compute(str(audio), {"hop": 512}, compute, cache_dir=cache_dir)
+    assert compute.calls == 1
+    assert isinstance(second["f0"], np.memmap)
+    np.testing.assert_array_equal(first["f0"], second["f0"])
+    assert second["voiced_flag"].dtype == bool
+
+
+def test_content_or_params_change_invalidates_and_drops_stale_entries(tmp_path):
+    audio = tmp_path / "a.wav"
+    audio.write_bytes(b"abc")
+    compute, cache_dir = _Compute(), str(tmp_path / "cache")
+    load_or_compute(str(audio), {"hop": 512}, compute, cache_dir=cache_dir)
+
+    # パラメータ (エンジン) ごとにエントリを持つので、切り替えても再計算しない
+    load_or_compute(str(audio), {"hop": 256}, compute, cache_dir=cache_dir)
+    assert compute.calls == 2
+    assert len(_entries(cache_dir)) == 2
+    load_or_compute(str(audio), {"hop": 512}, compute, cache_dir=cache_dir)
+    load_or_compute(str(audio), {"hop": 256}, compute, cache_dir=cache_dir)
+    assert compute.calls == 2
+
+    # 内容が変わると計算し直し、同じパラメータの古いエントリだけが消える
+    # (サイズと更新時刻でハッシュのメモを無効化する)
+    audio.write_bytes(b"abcdef")
+    result = load_or_compute(str(audio), {"hop": 256}, compute, cache_dir=cache_dir)
+    assert compute.calls == 3
+    assert result["f0"][0] == 6
+    assert len(_entries(cache_dir)) == 2
+    load_or_compute(str(audio), {"hop": 512}, compute, cache_dir=cache_dir)
+    assert compute.calls == 4
+    assert len(_entries(cache_dir)) == 2
+
+
+def test_corrupt_entry_is_recomputed(tmp_path):
+    audio = tmp_path / "a.wav"
+    audio.write_bytes(b"abc")
+    compute, cache_dir = _Compute(), str(tmp_path / "cache")
+    load_or_compute(str(audio), {}, compute, cache_dir=cache_dir)
+    (entry,) = _entries(cache_dir)
+    (source_dir,) = os.listdir(cache_dir)
+    os.remove(os.path.join(cache_dir, source_dir, entry, "f0.npy"))
+
+    assert load_or_compute(str(audio), {}, compute, cache_dir=cache_dir)["f0"][0] == 3
+    assert compute.calls == 2
+
+
+def test_load_cached_never_computes(tmp_path):
+    audio = tmp_path / "a.wav"
+    audio.write_bytes(b"abc")
+    compute, cache_dir = _Compute(), str(tmp_path / "cache")
+
+    assert load_cached(str(audio), {"hop": 512}, cache_dir=cache_dir) is None
+    load_or_compute(str(audio), {"hop": 512}, compute, cache_dir=cache_dir)
+    cached = load_cached(str(audio), {"hop": 512}, cache_dir=cache_dir)
+    assert isinstance(cached["f0"], np.memmap)
+    assert load_cached(str(audio), {"hop": 256}, cache_dir=cache_dir) is None
+    assert compute.calls == 1
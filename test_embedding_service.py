@@ -0,0 +1,90 @@
+# test_embedding_service.py
+"""
+埋め込みキャッシュ (embedding_service) のテスト。埋め込みAPIの代わりに呼び出しを記録する関数と、ローカル埋め込みを使う。
+
+    python -m pytest test_embedding_service.py
+"""
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from embedding_service import CachedEmbeddings, HashingEmbeddings, get_embedding_service
+from equipment_index import EquipmentIndex
+
+
+class _RecordingEmbeddings(Embeddings):
+    """embed_documents に渡されたバッチを記録する"""
+
+    def __init__(self):
+        self.batches = []
+
+    def embed_documents(self, texts):
+        self.batches.append(list(texts))
+        return [[float(len(text)), float(sum(map(ord, text)) % 97)] for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def test_misses_are_deduplicated_and_batched(tmp_path):
+    base = _RecordingEmbeddings()
+    service = CachedEmbeddings("model-a", base=base, path=str(tmp_path / "e.sqlite3"), batch_size=2)
+    texts = ["ギター: レスポール", "アンプ:　マーシャル", "ギター:  レスポール", "エフェクター", "アンプ: マーシャル"]
+    vectors = service.embed_documents(texts)
+
+    # 全角空白や空白の数の違いは同じテキストとして扱い、3件を2件ずつのバッチで埋め込む
+    assert base.batches == [["ギター: レスポール", "アンプ: マーシャル"], ["エフェクター"]]
+    assert vectors[0] == vectors[2] and vectors[1] == vectors[4]
+    assert service.stats == {"hits": 0, "misses": 3, "calls": 2}
+
+    # 2回目は一部だけがミスになる
+    service.embed_documents(["エフェクター", "ピック"])
+    assert base.batches[-1] == ["ピック"]
+    assert service.stats == {"hits": 1, "misses": 4, "calls": 3}
+
+
+def test_cache_is_shared_across_instances_and_keyed_by_model(tmp_path):
+    path = str(tmp_path / "e.sqlite3")
+    first = CachedEmbeddings("model-a", base=_RecordingEmbeddings(), path=path)
+    expected = first.embed_documents(["ギター", "アンプ"])
+
+    # 別のプロセス (新しいインスタンス) からはAPIを呼ばずに読める
+    base = _RecordingEmbeddings()
+    second = CachedEmbeddings("model-a", base=base, path=path)
+    assert second.embed_documents(["アンプ", "ギター"]) == expected[::-1]
+    assert base.batches == []
+
+    # モデルが違えば埋め込み直す
+    other = _RecordingEmbeddings()
+    CachedEmbeddings("model-b", base=other, path=path).embed_documents(["ギター"])
+    assert other.batches == [["ギター"]]
+
+
+def test_local_embeddings_fold_width_and_case():
+    embeddings = HashingEmbeddings()
+    vectors = np.array(embeddings.embed_documents(["ＢＯＳＳ　ｺｰﾗｽ", "boss  コーラス", "Marshall JCM800"]))
+    assert vectors.shape == (3, embeddings.dim)
+    np.testing.assert_allclose(np.linalg.norm(vectors, axis=1), 1.0, rtol=1e-5)
+    np.testing.assert_allclose(vectors[0], vectors[1])
+    assert vectors[0] @ vectors[2] < 0.2
+    # バッチで埋め込んでも1件ずつでも同じ
+    np.testing.assert_allclose(embeddings.embed_query("Marshall JCM800"), vectors[2], rtol=1e-6)
+    assert get_embedding_service(backend="local") is get_embedding_service(backend="local")
+
+
+def test_local_retrieval_over_catalog(tmp_path):
+    from data_loader import EQUIPMENT_FILES, get_equipment_data
+
+    embeddings = HashingEmbeddings()
+    index = EquipmentIndex(
+        {guitarist: get_equipment_data(guitarist) for guitarist in EQUIPMENT_FILES},
+        embeddings, embeddings.model_name, index_dir=str(tmp_path)
+    )
+    top = lambda query, guitarist, category=None: index.search(query, 1, guitarist, category)[0].metadata["name"]
+    assert top("クライベイビー Cry Baby ワウ", "B'z 松本孝弘") == "Jim Dunlop TM95 TAK Cry Baby"
+    assert top("marshall jcm800", "B'z 松本孝弘", "アンプ") == "Marshall JCM800 2203"
+    assert top("ＲＡＴ２ ディストーション", "結束バンド 後藤ひとり") == "ProCo RAT2 (Distortion)"
+    # 型番は BM25 との併用で確実に拾う
+    hybrid = lambda query, guitarist: index.hybrid_search(query, 1, guitarist)[0].metadata["name"]
+    assert hybrid("Firebird", "B'z 松本孝弘") == "Gibson Tak Matsumoto Firebird"
+    assert hybrid("Tak Matsumoto DC", "B'z 松本孝弘") == "Gibson Tak Matsumoto DC (Double Cutaway)"
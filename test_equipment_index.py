@@ -0,0 +1,124 @@
+# test_equipment_index.py
+"""
+全機材の共有インデックス (equipment_index) のテスト。埋め込みAPIの代わりにキーワードの出現数で埋め込む。
+
+    python -m pytest test_equipment_index.py
+"""
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from equipment_index import EquipmentIndex
+from lexical_index import tokenize
+
+
+class _CharEmbeddings(Embeddings):
+    def _embed(self, text):
+        return [float(text.count(word)) for word in ["歪み", "空間", "クリーン", "太い"]]
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def _doc(name, category, text):
+    return Document(page_content=f"{name} {text}", metadata={"name": name, "category": category})
+
+
+CATALOG = {
+    "tak": [
+        _doc("ディストーション", "エフェクター", "歪み 歪み"),
+        _doc("レスポール", "ギター", "太い"),
+        _doc("ハイゲインアンプ", "アンプ", "歪み 太い"),
+        _doc("ディレイ", "エフェクター", "空間"),
+    ],
+    "hotei": [
+        _doc("テレキャスター", "ギター", "クリーン"),
+        _doc("リバーブ", "エフェクター", "空間 空間"),
+        _doc("オーバードライブ", "エフェクター", "歪み"),
+    ],
+}
+
+
+def _index(tmp_path):
+    return EquipmentIndex(CATALOG, _CharEmbeddings(), "test-model", index_dir=str(tmp_path))
+
+
+def test_rows_are_grouped_by_guitarist_and_category(tmp_path):
+    index = _index(tmp_path)
+    assert len(index) == 7
+    assert [doc.metadata["name"] for doc in index.documents[:4]] == ["レスポール", "ハイゲインアンプ", "ディストーション", "ディレイ"]
+    # どの (ギタリスト, カテゴリ) も連続した区間になる
+    for guitarist in CATALOG:
+        for category in ["ギター", "アンプ", "エフェクター", "すべて"]:
+            ids = np.flatnonzero(index.mask(guitarist, category))
+            assert len(ids) == 0 or ids[-1] - ids[0] + 1 == len(ids)
+
+
+def test_filtered_search_stays_in_scope(tmp_path):
+    index = _index(tmp_path)
+    names = lambda docs: [doc.metadata["name"] for doc in docs]
+
+    assert names(index.search("歪み", k=2, guitarist="tak", category="エフェクター")) == ["ディストーション", "ディレイ"]
+    assert names(index.search("空間", k=1, guitarist="hotei")) == ["リバーブ"]
+    assert names(index.search("空間 空間", k=1)) == ["リバーブ"]
+    # 連続しない組み合わせ (ギターとエフェクター) はビットマップで絞り込む
+    assert set(names(index.search("歪み", k=10, guitarist="tak", category=["ギター", "エフェクター"]))) == {
+        "レスポール", "ディストーション", "ディレイ"}
+    assert index.search("歪み", guitarist="unknown") == []
+    assert all(doc.metadata["guitarist"] == "hotei"
+               for doc in index.as_retriever("hotei", "すべて", k=10).invoke("歪み"))
+
+
+class _CountingEmbeddings(_CharEmbeddings):
+    def __init__(self):
+        self.queries = 0
+
+    def embed_query(self, text):
+        self.queries += 1
+        return super().embed_query(text)
+
+
+def test_tokenize_mixes_latin_words_and_japanese_bigrams():
+    assert tokenize("Gibson ＤＣ ファイヤーバード") == ["gibson", "dc", "ファ", "ァイ", "イヤ", "ヤー", "ーバ", "バー", "ード"]
+
+
+def test_hybrid_search_finds_names_without_embedding(tmp_path):
+    embeddings = _CountingEmbeddings()
+    index = EquipmentIndex(CATALOG, embeddings, "test-model", index_dir=str(tmp_path))
+    names = lambda docs: [doc.metadata["name"] for doc in docs]
+
+    # 製品名に一致するクエリは埋め込みを呼ばない
+    assert names(index.hybrid_search("ハイゲインアンプ", k=1, guitarist="tak")) == ["ハイゲインアンプ"]
+    assert names(index.hybrid_search("オーバードライブ", k=1)) == ["オーバードライブ"]
+    assert index.hybrid_search("オーバードライブ", guitarist="tak")[0].metadata["name"] != "オーバードライブ"
+    assert embeddings.queries == 1  # 範囲外で名前が一致しなかった最後の検索だけ
+
+    # 名前に一致しなければ、ベクトル検索 (空間) と BM25 (「ディレ」) の順位を融合する
+    assert names(index.hybrid_search("空間系 ディレ", k=2, guitarist="tak")) == ["ディレイ", "ディストーション"]
+    assert embeddings.queries == 2
+
+
+def test_generic_brand_queries_still_use_embeddings(tmp_path):
+    catalog = {"tak": [
+        _doc("Gibson Les Paul", "ギター", "太い"),
+        _doc("Gibson Firebird", "ギター", "太い"),
+        _doc("Marshall JCM800 2203", "アンプ", "歪み"),
+        _doc("Marshall Silver Jubilee", "アンプ", "歪み"),
+    ]}
+    embeddings = _CountingEmbeddings()
+    index = EquipmentIndex(catalog, embeddings, "test-model", index_dir=str(tmp_path))
+    names = lambda docs: [doc.metadata["name"] for doc in docs]
+
+    # 多くの製品名に含まれるブランド名などは、名前の一致として扱わずベクトル検索も使う
+    for query in ("gibson", "Marshall", "tak"):
+        index.hybrid_search(query, k=2)
+    assert embeddings.queries == 3
+
+    # 製品名そのもの、または1製品だけの型番なら埋め込みを呼ばない
+    assert names(index.hybrid_search("ＧＩＢＳＯＮ  firebird", k=1)) == ["Gibson Firebird"]
+    assert names(index.hybrid_search("JCM800", k=1)) == ["Marshall JCM800 2203"]
+    assert embeddings.queries == 3
@@ -0,0 +1,96 @@
+# test_live_scorer.py
+"""
+リアルタイム採点 (live_scorer) のテスト。合成した演奏を WAV に書き出し、実時間相当のブロックで流す。
+
+    python -m pytest test_live_scorer.py
+"""
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from benchmark_pitch import note_sequence_signal
+from live_scorer import LiveScorer, RingBuffer, score_wav
+from pitch_analyzer import _contour_from_samples
+
+SR = 44100
+# 同じ音が2回出てこない並び (開始位置が一意に決まる)
+NOTES = [52, 55, 57, 59, 62, 64, 67, 65, 60, 58, 53, 50]
+NOTE_SECONDS = 0.4
+
+
+def _reference():
+    y, _ = note_sequence_signal(NOTES, NOTE_SECONDS, SR)
+    return y.astype(np.float32), _contour_from_samples(y, SR, engine="acf")
+
+
+def test_ring_buffer_wraps_by_absolute_position():
+    ring = RingBuffer(8)
+    ring.append(np.arange(5, dtype=np.float32))
+    ring.append(np.arange(5, 11, dtype=np.float32))
+    assert ring.total == 11
+    assert list(ring.read(4, 6)) == [4, 5, 6, 7, 8, 9]
+
+
+def test_streamed_pitch_matches_offline_acf():
+    y, contour = _reference()
+    scorer = LiveScorer(contour, input_sr=SR)
+    updates = []
+    for start in range(0, len(y), 512):
+        updates.extend(scorer.feed(y[start:start + 512]))
+    updates.extend(scorer.flush())
+
+    assert len(updates) == len(contour["times"])
+    voiced = np.array([update.voiced for update in updates])
+    assert np.mean(voiced == contour["voiced_flag"]) > 0.99
+    both = voiced & contour["voiced_flag"]
+    live_midi = np.array([update.user_midi if update.voiced else np.nan for update in updates])
+    assert np.nanmax(np.abs(live_midi[both] - contour["midi"][both])) < 0.01
+
+
+def test_wav_excerpt_is_tracked_in_position(tmp_path):
+    y, contour = _reference()
+    # お手本の途中 (4音目) から弾き始めた 48kHz ステレオの演奏
+    excerpt = y[int(3 * NOTE_SECONDS * SR):int(9 * NOTE_SECONDS * SR)]
+    take = tmp_path / "take.wav"
+    sf.write(take, np.stack([excerpt, excerpt], axis=1), SR)
+
+    updates, latencies = score_wav(str(take), contour, block_size=1024)
+    scored = [update for update in updates if update.score is not None]
+    assert len(scored) > 0.8 * len(updates)
+    # 最初の数フレームを除けば、お手本上の位置は演奏の時刻 + 開始位置にほぼ一致する
+    lag = np.array([update.position_sec - update.time_sec for update in scored[10:]])
+    assert np.median(np.abs(lag - 3 * NOTE_SECONDS)) < 0.05
+    assert np.median(np.abs([update.pitch_error for update in scored])) < 0.1
+    assert scored[-1].score > 90
+    # 1ブロック (約23ms) の処理がブロックの長さより十分短い
+    assert np.median(latencies) < 1024 / SR
+
+
+def test_transposed_take_reports_the_shift():
+    y, contour = _reference()
+    # 半音の整数倍だと別の音に合ってしまうので、チューニングが 40 セント高い演奏にする
+    shifted, _ = note_sequence_signal([note + 0.4 for note in NOTES], NOTE_SECONDS, SR)
+    shifted = shifted.astype(np.float32)
+    scorer = LiveScorer(contour, input_sr=SR)
+    updates = []
+    for start in range(0, len(shifted), 1024):
+        updates.extend(scorer.feed(shifted[start:start + 1024]))
+    errors = [update.pitch_error for update in updates if update.pitch_error is not None]
+    assert abs(np.median(errors) - 0.4) < 0.05
+
+    # 既知のずれ (チューニング) を指定すれば補正される
+    scorer = LiveScorer(contour, input_sr=SR, offset_semitones=0.4)
+    updates = scorer.feed(shifted)
+    errors = [update.pitch_error for update in updates if update.pitch_error is not None]
+    assert abs(np.median(errors)) < 0.05
+
+
+def test_single_frame_reference_needs_explicit_sample_rate():
+    contour = {
+        "times": np.zeros(1, dtype=np.float32), "voiced_flag": np.ones(1, dtype=bool),
+        "midi": np.full(1, 60.0, dtype=np.float32),
+    }
+    with pytest.raises(ValueError):
+        LiveScorer(contour)
+    assert LiveScorer(contour, input_sr=SR, sr=22050).sr == 22050
@@ -0,0 +1,214 @@
+# test_pitch_analysis.py
+"""
+ピッチ分析まわり (アライメント等) のテスト。ネットワークやAPIキーは不要。
+
+    python -m pytest test_pitch_analysis.py
+"""
+
+import numpy as np
+import pytest
+
+from alignment import dtw_align, dtw_align_batch
+from phrase_index import PhraseIndex, candidate_windows
+from pitch_analyzer import _estimate_offsets, _rhythm_errors
+from pitch_render import compact_result, lttb_indices
+
+
+def _naive_asymmetric_dtw(x, y, open_begin, open_end):
+    """全コスト行列を使う素朴な実装 (step_pattern='asymmetric')"""
+    n, m = len(x), len(y)
+    cost = np.abs(x[:, None] - y[None, :])
+    g = np.full((n, m), np.inf)
+    if open_begin:
+        g[0] = cost[0]
+    else:
+        g[0, 0] = cost[0, 0]
+    for i in range(1, n):
+        for j in range(m):
+            best = min(g[i - 1, j - k] for k in (0, 1, 2) if j - k >= 0)
+            g[i, j] = cost[i, j] + best
+    return g[-1].min() if open_end else g[-1, -1]
+
+
+@pytest.mark.parametrize("open_begin,open_end", [(False, False), (True, True), (True, False), (False, True)])
+def test_dtw_align_matches_full_matrix(open_begin, open_end):
+    rng = np.random.default_rng(0)
+    for _ in range(10):
+        n = int(rng.integers(5, 40))
+        m = int(rng.integers(n // 2 + 1, 2 * n - 1))
+        x, y = rng.normal(size=n), rng.normal(size=m)
+        expected = _naive_asymmetric_dtw(x, y, open_begin, open_end)
+        result = dtw_align(x, y, open_begin=open_begin, open_end=open_end)
+        assert result.distance == pytest.approx(expected)
+        assert result.normalizedDistance == pytest.approx(expected / n)
+        # パスに沿ったコストの合計が距離と一致すること
+        assert np.abs(x[result.index1] - y[result.index2]).sum() == pytest.approx(result.distance)
+        assert np.all(np.diff(result.index2) >= 0) and np.all(np.diff(result.index2) <= 2)
+
+
+@pytest.mark.parametrize("open_begin,open_end", [(False, False), (True, True)])
+def test_dtw_align_matches_dtw_python(open_begin, open_end):
+    dtw = pytest.importorskip("dtw")
+    rng = np.random.default_rng(5)
+    x, y = rng.normal(size=60), rng.normal(size=80)
+    expected = dtw.dtw(x, y, step_pattern='asymmetric', open_begin=open_begin, open_end=open_end, keep_internals=False)
+    result = dtw_align(x, y, open_begin=open_begin, open_end=open_end)
+    assert result.distance == pytest.approx(expected.distance)
+    assert result.normalizedDistance == pytest.approx(expected.normalizedDistance)
+    np.testing.assert_array_equal(result.index2, expected.index2)
+
+
+def test_unrestricted_dtw_falls_back_to_multiscale_above_cell_limit(monkeypatch):
+    import alignment
+
+    rng = np.random.default_rng(6)
+    t = np.arange(400)
+    ref = 60 + 5 * np.sin(t / 20)
+    user = np.interp(np.linspace(50, 350, 300), t, ref) + rng.normal(0, 0.1, 300)
+    exact = dtw_align(ref, user, open_begin=True, open_end=True)
+
+    widths = []
+    original = alignment._windowed_dtw_batch
+
+    def recording(xs, y, lo, hi, *args):
+        widths.append((hi - lo).max())
+        return original(xs, y, lo, hi, *args)
+
+    monkeypatch.setattr(alignment, "FULL_DTW_MAX_CELLS", 10_000)
+    monkeypatch.setattr(alignment, "_windowed_dtw_batch", recording)
+    bounded = dtw_align(ref, user, open_begin=True, open_end=True)
+    # 最も細かい解像度では全列ではなく粗いパスの周囲だけを解く
+    assert widths[-1] < len(user)
+    assert bounded.normalizedDistance <= exact.normalizedDistance * 1.05
+
+
+def test_multiscale_and_band_stay_close_to_exact():
+    rng = np.random.default_rng(1)
+    t = np.arange(2000)
+    ref = 60 + 5 * np.sin(t / 50) + np.round(np.sin(t / 300) * 3)
+    user = np.interp(np.linspace(200, 1800, 1500), t, ref) + rng.normal(0, 0.2, 1500)
+
+    exact = dtw_align(ref, user, open_begin=True, open_end=True)
+    multiscale = dtw_align(ref, user, open_begin=True, open_end=True, multiscale=True)
+    assert multiscale.normalizedDistance <= exact.normalizedDistance * 1.05
+
+    exact_full = dtw_align(ref[200:1800], user)
+    banded = dtw_align(ref[200:1800], user, band_radius=100)
+    assert banded.normalizedDistance == pytest.approx(exact_full.normalizedDistance, rel=0.05)
+
+
+def test_dtw_align_rejects_infeasible_lengths():
+    with pytest.raises(ValueError):
+        dtw_align(np.zeros(3), np.zeros(20))
+
+
+@pytest.mark.parametrize("multiscale", [False, True])
+def test_dtw_align_batch_matches_single_runs(multiscale):
+    rng = np.random.default_rng(3)
+    reference = np.repeat(rng.integers(45, 75, size=60), 8).astype(float)
+    take = reference[100:300] + rng.normal(0, 0.1, 200)
+    offsets = [0.0, 1.0, -2.5]
+    batch = dtw_align_batch([take + o for o in offsets], reference, open_begin=True, open_end=True, multiscale=multiscale)
+    for offset, result in zip(offsets, batch):
+        single = dtw_align(take + offset, reference, open_begin=True, open_end=True, multiscale=multiscale)
+        if multiscale:
+            # 窓を共有するので、単独で解いた場合より悪くなることはない
+            assert result.distance <= single.distance + 1e-9
+        else:
+            assert result.distance == pytest.approx(single.distance)
+            np.testing.assert_array_equal(result.index2, single.index2)
+
+
+def test_estimate_offsets_finds_transposition_and_detune():
+    rng = np.random.default_rng(4)
+    reference = np.repeat(rng.integers(45, 75, size=40), 8) + rng.normal(0, 0.05, 320)
+    for shift in (-1.0, 2.0, 0.3, -12.0):
+        offsets = _estimate_offsets(reference[:160] + shift, reference)
+        assert offsets[0] == 0.0
+        assert any(abs(o + shift) < 0.1 for o in offsets)
+
+
+def _note_sequence(pitches, frames_per_note=8):
+    return np.repeat(np.asarray(pitches, dtype=float), frames_per_note)
+
+
+def test_phrase_index_finds_take_inside_long_reference():
+    rng = np.random.default_rng(2)
+    ref_midi = _note_sequence(rng.integers(45, 75, size=400)) + rng.normal(0, 0.1, 3200)
+    start = 1800
+    # 少し遅く弾いた演奏
+    take = np.interp(np.linspace(start, start + 240, 300), np.arange(len(ref_midi)), ref_midi)
+
+    index = PhraseIndex.from_arrays(PhraseIndex.build(ref_midi).to_arrays())
+    windows = candidate_windows(index, take)
+    assert any(lo <= start and start + 240 <= hi for lo, hi in windows)
+    assert all(hi - lo < len(ref_midi) // 4 for lo, hi in windows)
+
+
+def test_phrase_index_is_transposition_invariant():
+    rng = np.random.default_rng(3)
+    ref_midi = _note_sequence(rng.integers(45, 75, size=200))
+    take = ref_midi[800:1040] - 1.0  # 半音下げチューニング
+    index = PhraseIndex.build(ref_midi)
+    assert any(abs(c - 800) <= 16 for c in index.candidate_starts(take))
+
+
+def test_rhythm_errors_follow_warping_path():
+    # ユーザーはお手本の半分の速さで弾き、2つ目の音だけ 40ms 遅れ、余計なオンセットが1つある
+    ref_onsets = np.array([0.0, 0.5, 1.0, 1.5])
+    user_onsets = np.array([0.0, 1.04, 2.0, 2.5, 3.0])
+    path_user = np.linspace(0, 3, 301)
+    path_ref = path_user / 2
+    rhythm = _rhythm_errors(user_onsets, ref_onsets, path_user, path_ref)
+    assert rhythm["onset_recall"] == 1.0
+    assert rhythm["onset_precision"] == 0.8
+    assert rhythm["timing_offset_ms"] == pytest.approx(5.0, abs=0.5)
+    assert rhythm["rhythm_score"] == pytest.approx(100 * 2 * 0.8 / 1.8)
+    assert _rhythm_errors(user_onsets, np.array([5.0]), path_user, path_ref) is None
+
+
+def test_lttb_keeps_endpoints_and_extremes():
+    x = np.arange(5000, dtype=float)
+    y = np.sin(x / 200)
+    y[2500] = 10.0  # 鋭いピーク
+    keep = lttb_indices(x, y, 200)
+    assert len(keep) == 200
+    assert keep[0] == 0 and keep[-1] == len(x) - 1
+    assert np.all(np.diff(keep) > 0)
+    assert 2500 in keep
+
+
+def test_compact_result_is_small():
+    n = 20000
+    result = {
+        "score": 80.0,
+        "ref_times": np.linspace(0, 200, n),
+        "ref_midi": np.full(n, 60.0),
+        "user_midi": np.full(n, 60.5),
+        "segments": [],
+    }
+    compact = compact_result(result, max_points=1000)
+    assert compact["score"] == 80.0
+    assert len(compact["ref_times"]) <= 1000
+    assert compact["ref_midi"].dtype == np.float32
+
+
+def test_align_pitches_penalizes_partial_and_constant_takes():
+    from pitch_analyzer import _align_pitches, _similarity_score
+
+    rng = np.random.default_rng(7)
+    ref_midi = _note_sequence(rng.integers(45, 75, size=50)) + rng.normal(0, 0.1, 400)
+    index = PhraseIndex.build(ref_midi)
+
+    def score(take):
+        alignment, _ = _align_pitches(take, ref_midi, index)
+        return _similarity_score(alignment.normalizedDistance)
+
+    full = score(ref_midi + rng.normal(0, 0.1, 400))
+    # お手本の半分より長い演奏はお手本の全区間と照合するので、一部しか弾いていなければ減点される
+    # (半分以下の演奏は、索引で見つけたフレーズの練習として採点する)
+    half = score(ref_midi[:216] + rng.normal(0, 0.1, 216))
+    constant = score(np.full(300, float(np.median(ref_midi))))
+    assert full > 80
+    assert half < full - 30
+    assert constant < full - 30
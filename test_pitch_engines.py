@@ -0,0 +1,45 @@
+# test_pitch_engines.py
+"""
+ピッチ推定エンジン (pitch_engines) のテスト。正弦波と無音で確認する。
+
+    python -m pytest test_pitch_engines.py
+"""
+
+import librosa
+import numpy as np
+import pytest
+
+from pitch_analyzer import HOP_LENGTH, PITCH_FMAX, PITCH_FMIN
+from pitch_engines import FRAME_LENGTH, PITCH_ENGINES, get_engine
+
+SR = 22050
+
+
+def _sine(hz, seconds=1.0, sr=SR):
+    return (0.3 * np.sin(2 * np.pi * hz * np.arange(int(seconds * sr)) / sr)).astype(np.float32)
+
+
+@pytest.mark.parametrize("engine", list(PITCH_ENGINES))
+@pytest.mark.parametrize("midi", [45, 64, 81])
+def test_sine_pitch_within_a_few_cents(engine, midi):
+    f0, voiced_flag = get_engine(engine)(_sine(librosa.midi_to_hz(midi)), SR, PITCH_FMIN, PITCH_FMAX, HOP_LENGTH, FRAME_LENGTH)
+    # 両端 (ゼロ詰めの区間) を除いたフレームはすべて有声で、誤差は数セント以内
+    inner = slice(4, -4)
+    assert voiced_flag[inner].all()
+    cents = 1200 * np.abs(np.log2(f0[inner] / librosa.midi_to_hz(midi)))
+    assert np.median(cents) < 5
+    assert cents.max() < 20
+
+
+@pytest.mark.parametrize("engine", list(PITCH_ENGINES))
+def test_silence_is_unvoiced(engine):
+    y = np.random.default_rng(0).normal(0, 1e-5, SR).astype(np.float32)
+    f0, voiced_flag = get_engine(engine)(y, SR, PITCH_FMIN, PITCH_FMAX, HOP_LENGTH, FRAME_LENGTH)
+    assert len(f0) == 1 + len(y) // HOP_LENGTH
+    assert not voiced_flag.any()
+    assert np.isnan(f0).all()
+
+
+def test_unknown_engine_is_rejected():
+    with pytest.raises(ValueError):
+        get_engine("crepe")
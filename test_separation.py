@@ -0,0 +1,176 @@
+# test_separation.py
+"""
+音源分離まわり (チャンク分割と overlap-add、音量の正規化、ステムの波形ピークと変換、バッチ分離のスキップ) のテスト。
+demucs や torch は不要。
+
+    python -m pytest test_separation.py
+"""
+
+import os
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+import audio_separator
+from separation_worker import OverlapAddWriter, chunk_bounds, normalization_stats, track_dir_name
+from stem_store import compact_track, compute_peaks
+
+
+class _Sink:
+    def __init__(self):
+        self.blocks = []
+
+    def write(self, data):
+        self.blocks.append(np.array(data))
+
+    def samples(self):
+        return np.concatenate(self.blocks) if self.blocks else np.zeros((0, 2))
+
+
+@pytest.mark.parametrize("n_samples", [50, 100, 101, 350, 1000])
+def test_chunk_bounds_cover_input_with_overlap(n_samples):
+    chunks = chunk_bounds(n_samples, chunk_size=100, overlap=20)
+    assert chunks[0][0] == 0 and chunks[-1][1] == n_samples
+    for (lo, hi), (next_lo, next_hi) in zip(chunks, chunks[1:]):
+        assert hi - next_lo == 20
+        assert next_hi - next_lo > 20
+    assert all(hi - lo <= 100 for lo, hi in chunks)
+
+
+@pytest.mark.parametrize("trim", [(0, None), (130, 710)])
+def test_overlap_add_reconstructs_signal(trim):
+    # 分離が恒等変換なら、チャンクをつないだ結果は元の信号 (の指定区間) と一致する
+    rng = np.random.default_rng(0)
+    signal = rng.normal(size=(2, 2, 1000)).astype(np.float32)
+    sinks = [_Sink(), _Sink()]
+    writer = OverlapAddWriter(sinks, overlap=20, trim_start=trim[0], trim_end=trim[1])
+    for lo, hi in chunk_bounds(1000, chunk_size=100, overlap=20):
+        writer.add(signal[..., lo:hi])
+    writer.close()
+    for sink, source in zip(sinks, signal):
+        np.testing.assert_allclose(sink.samples(), source[:, trim[0]:trim[1]].T, atol=1e-6)
+
+
+def test_peaks_match_blockwise_min_max(tmp_path):
+    # ブロック単位で読んでも、全体を一度に計算した場合と同じピークになる
+    rng = np.random.default_rng(1)
+    signal = (rng.uniform(-0.9, 0.9, size=(100_000, 2))).astype(np.float32)
+    path = str(tmp_path / "stem.wav")
+    sf.write(path, signal, 8000, subtype='FLOAT')
+
+    peaks = compute_peaks(path, samples_per_pixel=64)
+    mono = signal.mean(axis=1)
+    n = -(-len(mono) // 64)
+    assert peaks["length"] == n and len(peaks["data"]) == 2 * n
+    padded = np.pad(mono, (0, n * 64 - len(mono)), mode='edge').reshape(n, 64)
+    data = np.asarray(peaks["data"])
+    np.testing.assert_allclose(data[0::2], np.round(padded.min(axis=1) * 128), atol=1)
+    np.testing.assert_allclose(data[1::2], np.round(padded.max(axis=1) * 128), atol=1)
+
+
+def test_normalization_stats_match_whole_signal():
+    # チャンクごとに足し合わせても、全体を一度に計算した平均・標準偏差 (不偏推定) と同じになる
+    rng = np.random.default_rng(2)
+    signal = rng.normal(0.1, 0.3, size=1000)
+    blocks = (signal[lo:hi] for lo, hi in chunk_bounds(len(signal), chunk_size=300, overlap=0))
+    mean, std = normalization_stats(blocks)
+    assert mean == pytest.approx(signal.mean())
+    assert std == pytest.approx(signal.std(ddof=1) + 1e-8)
+
+
+class _FakeRegistry:
+    def record_separation(self, *args, **kwargs):
+        pass
+
+
+@pytest.fixture
+def fake_separation(tmp_path, monkeypatch):
+    """demucs の代わりに other.flac を書き出すだけの分離。呼ばれた入力を記録する"""
+    calls = []
+
+    def separate(input_path, output_path, model_name, start_sec=None, end_sec=None):
+        calls.append(input_path)
+        track_dir = os.path.join(output_path, model_name, track_dir_name(input_path, start_sec, end_sec))
+        os.makedirs(track_dir, exist_ok=True)
+        stem = os.path.join(track_dir, "other.flac")
+        sf.write(stem, np.zeros(100, dtype=np.float32), 8000)
+        return {"input_path": input_path, "status": "done", "stems": {"other": stem}, "track_dir": track_dir, "elapsed_sec": 0.0}
+
+    monkeypatch.setattr(audio_separator, "_separate_in_process", separate)
+    monkeypatch.setattr(audio_separator, "get_asset_registry", _FakeRegistry)
+    return calls
+
+
+def test_separate_batch_skips_existing_manifest_entries_unless_forced(tmp_path, fake_separation):
+    inputs = []
+    for name, content in (("a.wav", b"a"), ("b.wav", b"b"), ("a_copy.wav", b"a")):
+        path = tmp_path / name
+        path.write_bytes(content)
+        inputs.append(str(path))
+    out = str(tmp_path / "separated")
+
+    first = list(audio_separator.separate_batch(inputs, out, "htdemucs", workers=1))
+    # 同じ内容のファイル (a と a_copy) は1回だけ分離する
+    assert sorted(r["status"] for r in first) == ["done"] * 3
+    assert len(fake_separation) == 2
+    assert len(audio_separator.load_manifest(out)) == 2
+
+    second = list(audio_separator.separate_batch(inputs, out, "htdemucs", workers=1))
+    assert [r["status"] for r in second] == ["skipped"] * 3
+    assert len(fake_separation) == 2
+
+    # ステムが消えていれば分離し直す
+    os.remove(second[1]["stems"]["other"])
+    third = list(audio_separator.separate_batch(inputs, out, "htdemucs", workers=1))
+    assert sorted(r["status"] for r in third) == ["done", "skipped", "skipped"]
+    assert fake_separation[-1] == inputs[1]
+
+    forced = list(audio_separator.separate_batch(inputs, out, "htdemucs", workers=1, force=True))
+    assert sorted(r["status"] for r in forced) == ["done"] * 3
+    assert len(fake_separation) == 5
+
+
+def test_track_dir_name_includes_window():
+    assert track_dir_name("downloaded_audio/song.wav") == "song"
+    assert track_dir_name("downloaded_audio/song.wav", 12.5, 45.0) == "song@12.5-45"
+    assert track_dir_name("downloaded_audio/song.wav", None, 30) == "song@0-30"
+    assert track_dir_name("downloaded_audio/song.wav", 10, None) == "song@10-end"
+
+
+def test_windowed_separation_does_not_overwrite_full_track(tmp_path, fake_separation):
+    from asset_registry import _separated_stems
+
+    song = tmp_path / "song.wav"
+    song.write_bytes(b"song")
+    out = str(tmp_path / "separated")
+
+    (full,) = audio_separator.separate_batch([str(song)], out, "htdemucs", workers=1)
+    (window,) = audio_separator.separate_batch([str(song)], out, "htdemucs", workers=1, start_sec=12.5, end_sec=45.0)
+    assert full["stems"]["other"] != window["stems"]["other"]
+    assert all(os.path.exists(r["stems"]["other"]) for r in (full, window))
+
+    manifest = audio_separator.load_manifest(out)
+    content_hash = full["content_hash"]
+    entry = manifest[audio_separator.manifest_key(content_hash, "htdemucs", 12.5, 45.0)]
+    assert entry["track_dir"].endswith("song@12.5-45")
+    assert manifest[audio_separator.manifest_key(content_hash, "htdemucs")]["track_dir"].endswith("song")
+
+    # 台帳の scan と同じ探し方 (マニフェスト、無ければタイトル) で、区間ごとのステムが見つかる
+    for audio_hash in (content_hash, None):
+        assert _separated_stems(out, "htdemucs", audio_hash, "song", 12.5, 45.0) == window["stems"]
+        assert _separated_stems(out, "htdemucs", audio_hash, "song") == full["stems"]
+
+
+def test_compact_track_converts_float_wav_with_target_extension(tmp_path):
+    # demucs のCLIが書いた float32 の WAV は、保存形式が wav でも 16bit に変換する
+    signal = (np.sin(np.arange(8000) / 10) * 0.5).astype(np.float32)
+    for name in ("other", "vocals"):
+        sf.write(str(tmp_path / f"{name}.wav"), np.stack([signal, signal], axis=1), 8000, subtype='FLOAT')
+
+    before, after = compact_track(str(tmp_path), keep=("other",), fmt="wav")
+    assert sorted(os.listdir(tmp_path)) == ["other.wav"]
+    assert sf.info(str(tmp_path / "other.wav")).subtype == 'PCM_16'
+    assert after < before
+    # 変換済みなら何もしない
+    assert compact_track(str(tmp_path), keep=("other",), fmt="wav") == (after, after)
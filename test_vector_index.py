@@ -0,0 +1,58 @@
+# test_vector_index.py
+"""
+FAISSインデックスの保存・再利用 (vector_index) のテスト。埋め込みAPIの代わりに文字の出現数で埋め込む。
+
+    python -m pytest test_vector_index.py
+"""
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from vector_index import load_or_build_index
+
+
+class _CountingEmbeddings(Embeddings):
+    """埋め込んだ文書の数を数える"""
+
+    def __init__(self):
+        self.embedded = 0
+
+    def _embed(self, text):
+        return [float(text.count(c)) for c in "アイウエオギタ"] + [float(len(text))]
+
+    def embed_documents(self, texts):
+        self.embedded += len(texts)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def _documents(extra=""):
+    return [
+        Document(page_content="ギター: レスポール" + extra, metadata={"category": "ギター"}),
+        Document(page_content="アンプ: マーシャル", metadata={"category": "アンプ"}),
+        Document(page_content="エフェクター: オーバードライブ", metadata={"category": "エフェクター"}),
+    ]
+
+
+def test_index_is_reused_until_documents_or_model_change(tmp_path):
+    embeddings = _CountingEmbeddings()
+    first = load_or_build_index("tak/すべて", _documents(), embeddings, "model-a", index_dir=str(tmp_path))
+    assert embeddings.embedded == 3
+
+    # 同じ内容・同じモデルなら埋め込みを呼ばずに読み込む
+    loaded = load_or_build_index("tak/すべて", _documents(), embeddings, "model-a", index_dir=str(tmp_path))
+    assert embeddings.embedded == 3
+    query = "ギターのアンプ"
+    assert ([doc.page_content for doc in loaded.similarity_search(query, k=3)]
+            == [doc.page_content for doc in first.similarity_search(query, k=3)])
+    assert loaded.similarity_search("アンプ", k=1)[0].metadata == {"category": "アンプ"}
+
+    # カタログかモデルが変わったら作り直す
+    load_or_build_index("tak/すべて", _documents(extra=" (改)"), embeddings, "model-a", index_dir=str(tmp_path))
+    assert embeddings.embedded == 6
+    load_or_build_index("tak/すべて", _documents(extra=" (改)"), embeddings, "model-b", index_dir=str(tmp_path))
+    assert embeddings.embedded == 9
+    # 名前ごとに最新の1件だけを残す
+    assert len(list(next(tmp_path.iterdir()).iterdir())) == 1
@@ -0,0 +1,152 @@
+# test_youtube_downloader.py
+"""
+一括ダウンロードのテスト。YouTube には接続せず、ローカルのファイルを配信する代用の抽出器を使う。
+
+    python -m pytest test_youtube_downloader.py
+"""
+
+import os
+import threading
+import time
+
+import pytest
+
+from asset_registry import AssetRegistry
+from youtube_downloader import download_audio, download_batch, download_practice_phrases
+
+
+class LocalExtractor:
+    """
+    yt_dlp.YoutubeDL の代わりに、動画IDごとのローカルファイルを outtmpl の場所へコピーする抽出器。
+    yt-dlp と同じく .part ファイルに書き込み、continuedl なら既存の .part の続きから書く。
+    """
+
+    def __init__(self, sources, delay=0.0):
+        self.sources = sources
+        self.delay = delay
+        self.calls = []
+        self.resumed_from = {}
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, options):
+        self.options = options
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def extract_info(self, url, download=True):
+        video_id = url.split("v=")[1].split("&")[0]
+        with self._lock:
+            self.calls.append(video_id)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delay)
+            if video_id not in self.sources:
+                raise RuntimeError(f"Video unavailable: {video_id}")
+            ext = self.options['postprocessors'][0]['preferredcodec']
+            path = self.options['outtmpl'] % {"id": video_id, "ext": ext}
+            part_path = path + ".part"
+            offset = os.path.getsize(part_path) if self.options['continuedl'] and os.path.exists(part_path) else 0
+            self.resumed_from[video_id] = offset
+            with open(self.sources[video_id], 'rb') as src, open(part_path, 'ab' if offset else 'wb') as dst:
+                src.seek(offset)
+                dst.write(src.read())
+            os.replace(part_path, path)
+            return {"id": video_id, "ext": ext}
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+def _url(video_id):
+    return f"https://www.youtube.com/watch?v={video_id}&list=RD{video_id}"
+
+
+@pytest.fixture
+def sources(tmp_path):
+    source_dir = tmp_path / "site"
+    source_dir.mkdir()
+    paths = {}
+    for i, video_id in enumerate(["aaaaaaaaaaa", "bbbbbbbbbbb", "ccccccccccc", "ddddddddddd"]):
+        path = source_dir / f"{video_id}.bin"
+        path.write_bytes(bytes(range(256)) * (i + 1) * 16)
+        paths[video_id] = str(path)
+    return paths
+
+
+def test_download_is_keyed_by_video_id_and_skips_existing(tmp_path, sources):
+    out = str(tmp_path / "out")
+    extractor = LocalExtractor(sources)
+
+    first = download_audio(_url("aaaaaaaaaaa"), out, extractor_factory=extractor)
+    assert first.status == "done"
+    assert first.path == os.path.join(out, "aaaaaaaaaaa.wav")
+    with open(first.path, 'rb') as f, open(sources["aaaaaaaaaaa"], 'rb') as g:
+        assert f.read() == g.read()
+
+    # 同じ動画を別のURL (プレイリストなし) で指定してもダウンロードし直さない
+    second = download_audio("https://youtu.be/aaaaaaaaaaa", out, extractor_factory=extractor)
+    assert second.status == "skipped" and second.path == first.path
+    assert extractor.calls == ["aaaaaaaaaaa"]
+
+
+def test_partial_download_is_resumed(tmp_path, sources):
+    out = tmp_path / "out"
+    out.mkdir()
+    with open(sources["bbbbbbbbbbb"], 'rb') as f:
+        data = f.read()
+    (out / "bbbbbbbbbbb.wav.part").write_bytes(data[:1000])
+
+    extractor = LocalExtractor(sources)
+    result = download_audio(_url("bbbbbbbbbbb"), str(out), extractor_factory=extractor)
+    assert result.status == "done"
+    assert extractor.resumed_from["bbbbbbbbbbb"] == 1000
+    assert (out / "bbbbbbbbbbb.wav").read_bytes() == data
+
+
+def test_batch_bounds_concurrency_and_reports_each_item(tmp_path, sources):
+    extractor = LocalExtractor(sources, delay=0.05)
+    urls = [_url(video_id) for video_id in sources] + [_url("missing0000"), _url("aaaaaaaaaaa"), "https://example.com/"]
+    results = list(download_batch(urls, str(tmp_path / "out"), concurrency=2, extractor_factory=extractor))
+
+    assert len(results) == len(urls)
+    assert extractor.max_active <= 2
+    # 重複したURLは1回だけダウンロードする
+    assert sorted(extractor.calls) == sorted(list(sources) + ["missing0000"])
+    by_status = {}
+    for result in results:
+        by_status.setdefault(result.status, []).append(result)
+    assert len(by_status["done"]) == len(sources) + 1
+    errors = {result.url: result.error for result in by_status["error"]}
+    assert "Video unavailable" in errors[_url("missing0000")]
+    assert "動画ID" in errors["https://example.com/"]
+
+
+def test_practice_phrases_report_every_guitarist_and_reuse_registered_audio(tmp_path, sources):
+    out = str(tmp_path / "out")
+    # 動画IDで保存する前の、タイトル名でダウンロード済みの音源
+    legacy = tmp_path / "Old Title.wav"
+    legacy.write_bytes(b"legacy")
+    registry = AssetRegistry(str(tmp_path / "registry.json"))
+    registry.register("ccccccccccc", "C", "old", _url("ccccccccccc"), str(legacy))
+    phrases = {
+        "A": {"title": "a", "youtube_url": _url("aaaaaaaaaaa")},
+        "B": {"title": "b", "youtube_url": _url("aaaaaaaaaaa")},
+        "C": {"title": "c", "youtube_url": _url("ccccccccccc")},
+    }
+
+    extractor = LocalExtractor(sources)
+    results = download_practice_phrases(phrases, out, extractor_factory=extractor, registry=registry)
+    # 同じURLのギタリストは両方とも結果を持ち、ダウンロードは1回だけ
+    assert sorted(results) == ["A", "B", "C"]
+    assert results["A"].status == results["B"].status == "done"
+    assert results["C"].status == "skipped" and os.path.samefile(results["C"].path, legacy)
+    assert extractor.calls == ["aaaaaaaaaaa"]
+    assert registry.get("aaaaaaaaaaa")["guitarist"] == "A"
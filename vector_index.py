@@ -0,0 +1,147 @@
+# vector_index.py
+"""
+機材カタログのFAISSインデックスをディスクに保存して再利用するモジュール。
+
+キーは「ドキュメント (本文 + メタデータ) のハッシュ + 埋め込みモデル名」で決まる。
+.doc ファイルの内容・チャンク分割・モデルのどれかが変わった場合だけ埋め込みAPIを呼んで作り直し、
+それ以外は保存済みのインデックスをメモリマップで読み込むだけで起動できる。
+インデックス名ごとに最新のエントリを1件だけ保持する (contour_cache と同じ構成)。
+機材カタログは全ギタリスト・全カテゴリをまとめた1つのインデックス (equipment_index.INDEX_NAME = "equipment") で、
+ギタリストやカテゴリでの絞り込みは equipment_index が検索時に行う。
+
+    vectorstore = load_or_build_index("equipment", documents, embeddings, EMBEDDING_MODEL)
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from contour_cache import META_FILENAME, drop_stale_entries
+
+# インデックスの保存先 (contour_cache と同じく cache/ 以下)
+INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", os.path.join('cache', 'vector_indexes'))
+INDEX_FILENAME = 'index.faiss'
+DOCUMENTS_FILENAME = 'documents.json'
+# 保存形式を変更した場合はこの値を上げて古いインデックスを無効化する
+INDEX_VERSION = 1
+
+
+def documents_hash(documents):
+    """ドキュメントの本文とメタデータ (順序を含む) のSHA-256"""
+    digest = hashlib.sha256()
+    for doc in documents:
+        payload = json.dumps([doc.page_content, doc.metadata], sort_keys=True, ensure_ascii=False, default=str)
+        digest.update(payload.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def index_key(documents, model_name):
+    """ドキュメントと埋め込みモデル名からインデックスのキーを生成する。"""
+    payload = json.dumps(
+        {"version": INDEX_VERSION, "documents": documents_hash(documents), "model": model_name},
+        sort_keys=True, ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+def _name_dir(name, index_dir):
+    """インデックス名ごとのディレクトリ。名前は日本語や記号を含むのでハッシュにする"""
+    return os.path.join(index_dir, hashlib.sha1(name.encode('utf-8')).hexdigest()[:16])
+
+
+def _read_faiss_index(path):
+    """FAISSのインデックスをメモリマップで読み込む (対応していないビルドでは通常の読み込み)"""
+    import faiss
+
+    flags = getattr(faiss, 'IO_FLAG_MMAP', 0) | getattr(faiss, 'IO_FLAG_READ_ONLY', 0)
+    try:
+        return faiss.read_index(path, flags)
+    except RuntimeError:
+        return faiss.read_index(path)
+
+
+def _load_entry(entry_dir, embeddings):
+    """保存済みのインデックスから FAISS ベクトルストアを組み立てる。壊れていれば None を返す。"""
+    try:
+        with open(os.path.join(entry_dir, DOCUMENTS_FILENAME), 'r', encoding='utf-8') as f:
+            stored = json.load(f)
+        index = _read_faiss_index(os.path.join(entry_dir, INDEX_FILENAME))
+    except (OSError, ValueError, RuntimeError):
+        return None
+    if index.ntotal != len(stored):
+        return None
+
+    documents = {
+        str(i): Document(page_content=item["page_content"], metadata=item["metadata"])
+        for i, item in enumerate(stored)
+    }
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=InMemoryDocstore(documents),
+        index_to_docstore_id={i: str(i) for i in range(len(stored))},
+    )
+
+
+def _write_entry(name_dir, key, vectorstore, documents, meta):
+    """一時ディレクトリに書き出してからリネームし、書きかけのインデックスを残さない。"""
+    import faiss
+
+    os.makedirs(name_dir, exist_ok=True)
+    entry_dir = os.path.join(name_dir, key)
+    tmp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=name_dir)
+    try:
+        faiss.write_index(vectorstore.index, os.path.join(tmp_dir, INDEX_FILENAME))
+        # インデックスの i 番目のベクトルは documents[i] (from_documents は順番どおりに追加する)
+        with open(os.path.join(tmp_dir, DOCUMENTS_FILENAME), 'w', encoding='utf-8') as f:
+            json.dump(
+                [{"page_content": doc.page_content, "metadata": doc.metadata} for doc in documents],
+                f, ensure_ascii=False, default=str
+            )
+        with open(os.path.join(tmp_dir, META_FILENAME), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_dir, entry_dir)
+    except OSError:
+        # 別プロセスが同じインデックスを先に書き終えた場合など
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if not os.path.isdir(entry_dir):
+            raise
+    return entry_dir
+
+
+def load_or_build_index(name, documents, embeddings, model_name, index_dir=INDEX_DIR):
+    """
+    保存済みのFAISSベクトルストアを返す。無ければ埋め込みを計算して作成し、保存する。
+
+    :param name: インデックス名 (例: equipment_index.INDEX_NAME の "equipment")。名前ごとに最新の1件を保持する
+    :param documents: インデックスに入れる Document のリスト (空でないこと)
+    :param embeddings: 埋め込みモデル (検索時のクエリの埋め込みにも使う)
+    :param model_name: 埋め込みモデル名。キーの一部になり、変わると作り直す
+    :return: FAISS ベクトルストア
+    """
+    key = index_key(documents, model_name)
+    name_dir = _name_dir(name, index_dir)
+    entry_dir = os.path.join(name_dir, key)
+
+    if os.path.isdir(entry_dir):
+        vectorstore = _load_entry(entry_dir, embeddings)
+        if vectorstore is not None:
+            return vectorstore
+        shutil.rmtree(entry_dir, ignore_errors=True)
+
+    vectorstore = FAISS.from_documents(documents, embeddings)
+    meta = {"key": key, "name": name, "model": model_name, "documents": len(documents)}
+    try:
+        _write_entry(name_dir, key, vectorstore, documents, meta)
+        drop_stale_entries(name_dir, key)
+    except OSError as e:
+        # 保存できなくても作成したインデックスはそのまま使う
+        print(f"Error writing vector index: {e}")
+    return vectorstore
@@ -1,50 +1,244 @@
-import yt_dlp
+# youtube_downloader.py
+"""
+YouTube の動画から音声をダウンロードする。
+
+ファイル名は動画ID (<動画ID>.<形式>) にするため、動画のタイトルが変わっても同じファイルを指す。
+既にダウンロード済みの動画はスキップし、途中で止まったダウンロード (.part) は続きから再開する。
+複数の動画は download_batch で同時実行数を制限しながら並列にダウンロードし、
+結果は1件ごとに DownloadResult で返す (例外は握りつぶさず error に記録する)。
+
+実際のダウンロードは yt_dlp.YoutubeDL と同じインターフェース (コンテキストマネージャーと
+extract_info(url, download=True)) を持つ「抽出器」が行う。extractor_factory に別の実装を渡すと、
+テストなどでローカルのファイルを配信する代用品に差し替えられる。
+
+    python youtube_downloader.py                      # 全ての練習フレーズ (data_loader.PRACTICE_PHRASES)
+    python youtube_downloader.py urls.txt --jobs 4    # URLを1行ずつ書いたマニフェスト
+    python youtube_downloader.py https://www.youtube.com/watch?v=...
+"""
+
+import argparse
 import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass
 
-def download_audio_from_youtube(url, output_path='.', file_format='wav'):
-    """
-    YouTubeの動画から音声をダウンロードし、指定されたフォーマットで保存する。
+from asset_registry import get_asset_registry, video_id_from_url
 
-    :param url: YouTube動画のURL
-    :param output_path: 保存先のディレクトリ
-    :param file_format: 保存する音声フォーマット (例: 'wav', 'mp3')
+DEFAULT_OUTPUT_DIR = 'downloaded_audio'
+DEFAULT_FORMAT = 'wav'
+# 同時にダウンロードする動画の数 (サイトへの負荷と帯域を考えて小さめにする)
+DEFAULT_CONCURRENCY = 3
+DOWNLOAD_RETRIES = 3
+
+
+@dataclass
+class DownloadResult:
     """
-    # 出力先のディレクトリが存在しない場合は作成
-    os.makedirs(output_path, exist_ok=True)
+    1件のダウンロード結果。status は "done" / "skipped" (ダウンロード済み) / "error"。
+    成功またはスキップした場合、path に音声ファイルのパスが入る。
+    """
+    url: str
+    video_id: str = None
+    status: str = "error"
+    path: str = None
+    error: str = None
+    elapsed_sec: float = 0.0
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def _yt_dlp_extractor(options):
+    import yt_dlp
+    return yt_dlp.YoutubeDL(options)
 
-    ydl_opts = {
+
+def audio_path_for(video_id, output_path=DEFAULT_OUTPUT_DIR, file_format=DEFAULT_FORMAT):
+    """動画IDに対応する音声ファイルのパス"""
+    return os.path.join(output_path, f"{video_id}.{file_format}")
+
+
+def _extractor_options(output_path, file_format):
+    return {
         'format': 'bestaudio/best',
         'postprocessors': [{
             'key': 'FFmpegExtractAudio',
             'preferredcodec': file_format,
             'preferredquality': '192',
         }],
-        'outtmpl': os.path.join(output_path, '%(title)s.%(ext)s'),
+        'outtmpl': os.path.join(output_path, '%(id)s.%(ext)s'),
         'noplaylist': True,
+        # 中断したダウンロードは .part ファイルから再開する
+        'continuedl': True,
+        'nopart': False,
+        'retries': DOWNLOAD_RETRIES,
+        'quiet': True,
+        'noprogress': True,
     }
 
+
+def download_audio(url, output_path=DEFAULT_OUTPUT_DIR, file_format=DEFAULT_FORMAT, extractor_factory=None):
+    """
+    YouTube の動画から音声をダウンロードし、<動画ID>.<形式> で保存する。
+
+    :param url: YouTube動画のURL
+    :param output_path: 保存先のディレクトリ
+    :param file_format: 保存する音声フォーマット (例: 'wav', 'mp3')
+    :param extractor_factory: オプションの辞書を受け取り yt_dlp.YoutubeDL 互換の抽出器を返す関数。
+                              None なら yt_dlp を使う
+    :return: DownloadResult
+    """
+    started = time.perf_counter()
+    result = DownloadResult(url=url, video_id=video_id_from_url(url))
+    if result.video_id is None:
+        result.error = "URLから動画IDを取得できません"
+        return result
+
+    path = audio_path_for(result.video_id, output_path, file_format)
+    if os.path.exists(path):
+        result.status, result.path = "skipped", path
+        return result
+
+    os.makedirs(output_path, exist_ok=True)
+    factory = extractor_factory or _yt_dlp_extractor
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            print(f"'{url}' から音声をダウンロードして{file_format}形式に変換します...")
-            ydl.download([url])
-            # yt-dlp はダウンロードと変換を自動で行うため、
-            # 完了メッセージを表示する
-            print("処理が完了しました。")
-            
+        with factory(_extractor_options(output_path, file_format)) as extractor:
+            extractor.extract_info(url, download=True)
     except Exception as e:
-        print(f"エラーが発生しました: {e}")
+        result.error = f"{e.__class__.__name__}: {e}"
+    else:
+        if os.path.exists(path):
+            result.status, result.path = "done", path
+        else:
+            result.error = f"ダウンロード後のファイルが見つかりません: {path}"
+    result.elapsed_sec = time.perf_counter() - started
+    return result
 
-if __name__ == '__main__':
-    import sys
-    
-    # コマンドライン引数からURLを取得
-    if len(sys.argv) > 1:
-        youtube_url = sys.argv[1]
+
+def download_batch(urls, output_path=DEFAULT_OUTPUT_DIR, file_format=DEFAULT_FORMAT, concurrency=DEFAULT_CONCURRENCY,
+                   extractor_factory=None):
+    """
+    複数の動画を最大 concurrency 件ずつ並列にダウンロードする。結果は完了した順に1件ずつ返す。
+    同じ動画を指すURLが複数あれば1回だけダウンロードし、それぞれのURLについて結果を返す。
+
+    :return: DownloadResult のジェネレーター
+    """
+    by_video = {}
+    for url in urls:
+        video_id = video_id_from_url(url)
+        if video_id is None:
+            yield DownloadResult(url=url, error="URLから動画IDを取得できません")
+            continue
+        by_video.setdefault(video_id, []).append(url)
+    if not by_video:
+        return
+
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(by_video)))) as pool:
+        futures = {
+            pool.submit(download_audio, same_video[0], output_path, file_format, extractor_factory): same_video
+            for same_video in by_video.values()
+        }
+        for future in as_completed(futures):
+            result = future.result()
+            for url in futures[future]:
+                yield DownloadResult(**dict(result.to_dict(), url=url))
+
+
+def download_practice_phrases(phrases=None, output_path=DEFAULT_OUTPUT_DIR, file_format=DEFAULT_FORMAT,
+                              concurrency=DEFAULT_CONCURRENCY, extractor_factory=None, registry=None):
+    """
+    練習フレーズ (data_loader.PRACTICE_PHRASES) の音源をまとめてダウンロードし、アセット台帳に登録する。
+    台帳に音源が記録済みでファイルがあれば (動画IDで保存する前のタイトル名のファイルを含む)、ダウンロードしない。
+    同じ動画を使うギタリストが複数いれば1回だけダウンロードし、全員分の結果を返す
+    (台帳は動画IDごとなので、アセットは最初のギタリストで登録する)。
+    :return: {ギタリスト: DownloadResult}
+    """
+    if phrases is None:
+        from data_loader import PRACTICE_PHRASES as phrases
+    registry = registry or get_asset_registry()
+    guitarists = {}
+    for guitarist, phrase in phrases.items():
+        guitarists.setdefault(phrase["youtube_url"], []).append(guitarist)
+
+    results, urls = {}, []
+    for url, same_url in guitarists.items():
+        video_id = video_id_from_url(url)
+        asset = registry.get(video_id) if video_id else None
+        audio = asset.get("audio") if asset else None
+        if audio and os.path.exists(audio["path"]):
+            recorded = DownloadResult(url=url, video_id=video_id, status="skipped", path=audio["path"])
+            results.update((guitarist, recorded) for guitarist in same_url)
+        else:
+            urls.append(url)
+
+    for result in download_batch(urls, output_path, file_format, concurrency, extractor_factory):
+        for guitarist in guitarists[result.url]:
+            results[guitarist] = result
+        if result.path:
+            guitarist = guitarists[result.url][0]
+            registry.register(result.video_id, guitarist, phrases[guitarist]["title"], result.url, result.path)
+    registry.save()
+    return results
+
+
+def download_audio_from_youtube(url, output_path='.', file_format='wav'):
+    """
+    YouTubeの動画から音声をダウンロードし、指定されたフォーマットで保存する (1件用)。
+
+    :param url: YouTube動画のURL
+    :param output_path: 保存先のディレクトリ
+    :param file_format: 保存する音声フォーマット (例: 'wav', 'mp3')
+    :return: DownloadResult
+    """
+    print(f"'{url}' から音声をダウンロードして{file_format}形式に変換します...")
+    result = download_audio(url, output_path, file_format)
+    if result.status == "error":
+        print(f"エラーが発生しました: {result.error}")
     else:
-        # デフォルトURL（松本孝弘の例）
-        youtube_url = "https://www.youtube.com/watch?v=P53EuU4-p8Y"
-    
-    # 保存先ディレクトリ
-    download_dir = "downloaded_audio"
+        print(f"処理が完了しました: {result.path}")
+    return result
+
+
+def _read_url_manifest(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="YouTube の動画から音声をまとめてダウンロードします。")
+    parser.add_argument("sources", nargs='*',
+                        help="動画のURL、またはURLを1行ずつ書いたマニフェスト (.txt)。省略すると全ての練習フレーズ")
+    parser.add_argument("--out", default=DEFAULT_OUTPUT_DIR, help="保存先のディレクトリ")
+    parser.add_argument("--format", default=DEFAULT_FORMAT, help="保存する音声フォーマット")
+    parser.add_argument("--jobs", type=int, default=DEFAULT_CONCURRENCY, help="同時にダウンロードする数")
+    args = parser.parse_args(argv)
 
-    download_audio_from_youtube(youtube_url, output_path=download_dir, file_format='wav') 
\ No newline at end of file
+    counts = {"done": 0, "skipped": 0, "error": 0}
+
+    def report(label, result):
+        counts[result.status] += 1
+        if result.status == "error":
+            print(f"  ✗ {label}: {result.error}")
+        elif result.status == "skipped":
+            print(f"  - {label}: ダウンロード済み ({result.path})")
+        else:
+            print(f"  ✓ {label}: {result.path} ({result.elapsed_sec:.1f}秒)")
+
+    if args.sources:
+        urls = []
+        for source in args.sources:
+            urls.extend(_read_url_manifest(source) if os.path.isfile(source) else [source])
+        for result in download_batch(urls, args.out, args.format, args.jobs):
+            report(result.url, result)
+    else:
+        results = download_practice_phrases(output_path=args.out, file_format=args.format, concurrency=args.jobs)
+        for guitarist, result in results.items():
+            report(guitarist, result)
+
+    print(f"完了: ダウンロード {counts['done']} 件 / スキップ {counts['skipped']} 件 / エラー {counts['error']} 件")
+    return 1 if counts["error"] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())